@@ -1,11 +1,17 @@
+import os
+import asyncio
 import gradio as gr
 from model.ChatTwinModel import ChatTwin
+from model.ClientRegistry import get_client_registry, load_environment
+from model.SemanticCache import SemanticResponseCache
+from model.SessionManager import SessionManager, session_manager_from_env
+from guardrails.GuardrailPipeline import GuardrailPipeline, GuardrailCost, GuardrailError, default_guardrail_pipeline
 from vo.Models import SessionState
 from vo.MyBio import mybio
 import logging
 from utils.LoggerInit import init as initialize_logger
-from embeddings.ChonkieSemanticEmbedding import ChonkieSemanticEmbedding
 initialize_logger()
+load_environment()
 
 
 
@@ -15,6 +21,11 @@ logger = logging.getLogger(__name__)
 #
 system_prompt : str = mybio["text"]
 
+# The semantic cache is opt-in and shared by every session so that one visitor's answer can be reused for the next.
+semantic_cache : SemanticResponseCache | None = None
+if os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true":
+    semantic_cache = SemanticResponseCache(similarity_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")))
+
 # 
 
 # additional_prompt = {"Where do you live?": "<info> You live in Toronto <info>", 
@@ -23,43 +34,63 @@ system_prompt : str = mybio["text"]
 
 # llama3 = llama3(model_role_type=system_prompt)
 # function to call gardio
-def input_guardrails(chat_twin : ChatTwin, message : str, number_of_calls : int) -> tuple[bool, str]:
-    message = message.replace("<info>", "")
-    message = message.replace("</info>", "")
-    can_continue : bool = True
-    err_message : str = "No anomally detected."
-    try:
-        chat_twin.filterMessageForHarmfulness(message)
-    except ValueError as e:
-        logger.warning(f"Harmful or abusive content detected in message: {e}")
-        can_continue = False
-        err_message = "Harmful or abusive content detected in message."
-    if(len(message) > 500):
-        can_continue = False
-        err_message = "Message is too long. If you want to know more about me, please give me your email and optionally a phone number. "
-    if(chat_twin.num_calls > 100):
-        can_continue = False
-        err_message = "I know you would like to know more about me. Please give me your email and optionally a phone number and I will get in touch with you"
-
-
-    
-    
-    return (can_continue, err_message) # This line was already there, but the previous return True was removed.
-def gradio_function(message : str, _, session_state):
-    chat_twin = session_state.get_from_session(SessionState.MODEL_KEY)
-    number_of_calls = chat_twin.num_calls
-
-    (can_proceed, err_message)= input_guardrails(chat_twin, message, number_of_calls)
-    # value_in_dictionary = encode_and_compare(message)
-    # message = value_in_dictionary +" If the info tag is present and it is relevant to the question thenyou can respond to the question using the text between the info tag. Do not mention the info tag in your response. " + message 
-    # print(message)
-
-    return_str = ""
-    if(can_proceed):
-        return_str = chat_twin.chat(prompt=message)
-    else:
-        return_str = err_message
-    return return_str
+# The guardrails run cheapest first and stop at the first failure, so a message that fails a local check never
+# costs a call to the moderation API.
+guardrail_pipeline : GuardrailPipeline = default_guardrail_pipeline()
+
+# In speculative mode the remote guardrails (moderation) and the LLM call run at the same time. The response is held back
+# until they pass and the turn is rolled back if they fail, so a clean turn takes max(moderation, LLM) instead of the sum.
+speculative_moderation : bool = os.getenv("SPECULATIVE_MODERATION", "true").lower() == "true"
+
+# The guardrails fail closed: a message that could not be checked, e.g. because the moderation API was unreachable, is
+# not answered and its turn is rolled back, so it is never sent to the LLM again with a later turn.
+GUARDRAIL_UNAVAILABLE_RESPONSE : str = "Sorry, I could not check your message just now. Please try again in a moment."
+
+async def input_guardrails(chat_twin : ChatTwin, message : str, number_of_calls : int, run_moderation : bool = True) -> tuple[bool, str]:
+    max_cost = None if run_moderation else GuardrailCost.LOCAL
+    report = await guardrail_pipeline.run(chat_twin, message, max_cost=max_cost)
+    if(report.passed):
+        return (True, "No anomally detected.")
+    return (False, report.err_message)
+
+async def gradio_function(message : str, _, session_state):
+    # The session is held for the whole turn so that it is not evicted while the response is streaming.
+    with session_manager.turn(session_state) as chat_twin:
+        number_of_calls = chat_twin.num_calls
+        checkpoint = chat_twin.checkpoint()
+
+        try:
+            (can_proceed, err_message)= await input_guardrails(chat_twin, message, number_of_calls, run_moderation=not speculative_moderation)
+        except Exception as e:
+            logger.error(f"The input guardrails could not be run, not answering the message: {e}", exc_info=True)
+            yield GUARDRAIL_UNAVAILABLE_RESPONSE
+            return
+        # value_in_dictionary = encode_and_compare(message)
+        # message = value_in_dictionary +" If the info tag is present and it is relevant to the question thenyou can respond to the question using the text between the info tag. Do not mention the info tag in your response. " + message 
+        # print(message)
+
+        # gradio_function is an async generator so that Gradio renders the response as the tokens stream in
+        # and each user's turn waits on the event loop instead of holding a worker thread.
+        if(can_proceed):
+            moderation = None
+            if(speculative_moderation):
+                moderation = asyncio.create_task(guardrail_pipeline.enforce(chat_twin, message, min_cost=GuardrailCost.REMOTE))
+            try:
+                async for partial_response in chat_twin.achat_stream(prompt=message, moderation=moderation):
+                    yield partial_response
+            except GuardrailError as e:
+                yield e.err_message
+            except Exception as e:
+                # achat_stream rolls the turn back before it re-raises a moderation error. Rolling back to the same
+                # checkpoint again is harmless and covers anything that escaped before it could.
+                chat_twin.rollback_turn(checkpoint, number_of_calls)
+                logger.error(f"The moderation of the message failed, not answering it: {e}", exc_info=True)
+                yield GUARDRAIL_UNAVAILABLE_RESPONSE
+            finally:
+                if moderation is not None and not moderation.done():
+                    moderation.cancel()
+        else:
+            yield err_message
 
 
 # def encode_and_compare(message) -> str :
@@ -76,15 +107,21 @@ def gradio_function(message : str, _, session_state):
 #             break
 #     return return_string
 
+# The LLM clients are shared by every session. Creating them and loading the tokenizer at startup keeps that cost off
+# the first message of the first visitor.
+chat_model_name : str = os.getenv("CHAT_MODEL", "gpt-4o-mini-2024-07-18")
+get_client_registry().warm_up([chat_model_name], open_connections=os.getenv("CLIENT_WARMUP_CONNECT", "true").lower() == "true")
+
+def create_chat_twin() -> ChatTwin:
+    return ChatTwin(model_name=chat_model_name, model_role_type=system_prompt, semantic_cache=semantic_cache)
+
+# The chat clients live in the session manager rather than in gr.State so that abandoned tabs can be evicted.
+session_manager : SessionManager = session_manager_from_env(create_chat_twin)
+
 def create_initial_state():
     logger.info("New user session started.")
-    # This function runs EVERY TIME a new user opens the page
-    new_session = SessionState()
-    new_session.add_to_session(
-        SessionState.MODEL_KEY, 
-        ChatTwin(model_role_type=system_prompt)
-    )
-    return new_session
+    # This function runs EVERY TIME a new user opens the page. The state only holds the session id.
+    return session_manager.create_session()
 
 with gr.Blocks() as chat_interface:
     state_object = gr.State(value=create_initial_state)
@@ -94,7 +131,10 @@ with gr.Blocks() as chat_interface:
             additional_inputs=[state_object] # Matches the 3rd arg in gradio_function
       )
 if __name__ == "__main__":
-    chat_interface.launch(inbrowser=True)
+    try:
+        chat_interface.launch(inbrowser=True)
+    finally:
+        session_manager.stop()
  
 
 #
\ No newline at end of file
@@ -1,15 +1,29 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Callable, Iterable, Iterator, List, NamedTuple
+import os
+import numpy as np
 from chonkie import BaseChunker, Document
 from dotenv import load_dotenv
 from chonkie import Pipeline, MarkdownChef
 from chonkie import EmbeddingsRefinery
-from chonkie.embeddings import OpenAIEmbeddings, GeminiEmbeddings
+from chonkie.embeddings import AutoEmbeddings, OpenAIEmbeddings, GeminiEmbeddings, BaseEmbeddings
 import logging
-from utils.FileProcessor import file_to_text_factory
+from utils.FileProcessor import PageText, file_to_text_factory, iter_pdf_pages, iter_pages_parallel, walk_directory
+from embeddings.EmbeddingCache import CachedEmbeddings, get_embedding_cache
+from vo.Metadata import Metadata
 
 logger = logging.getLogger(__name__)
 OPEN_AI_EMBEDDING_MODELS = ["text-embedding-3-large", "text-embedding-3-small", "text-embedding-ada-002" ]
+
+class ChunkEmbeddings(NamedTuple):
+    """
+    The chunks produced by a pipeline run and their embeddings.
+    Row i of vectors is the embedding of texts[i], and metadatas[i] holds the source file, the index of the chunk in
+    its document and its token count. vectors is a C-contiguous float32 matrix of shape (number of chunks, dimension).
+    """
+    vectors : np.ndarray
+    texts : List[str]
+    metadatas : List[Metadata]
 class AbstractEmbeddingModel(ABC):
     """
     An abstract base class for creating and running text processing and embedding pipelines.
@@ -25,7 +39,7 @@ class AbstractEmbeddingModel(ABC):
         Initializes the AbstractEmbeddingModel.
 
         Args:
-            directory_name: The path to a directory of files to be processed. (Currently not supported)
+            directory_name: The path to a directory of files to be processed.
             file_name: The path to a single file to be processed.
             text_to_chunk: A string of text to be processed directly.
             model_name: The name of the embedding model to be used.
@@ -34,7 +48,7 @@ class AbstractEmbeddingModel(ABC):
         self.pipeline = Pipeline()
         self.file_name = file_name
         self.text_to_chunk = text_to_chunk
-        self.directory_name = directory_name  #not supported right now
+        self.directory_name = directory_name
         self.model_name = model_name
 
 
@@ -52,21 +66,62 @@ class AbstractEmbeddingModel(ABC):
         Subclasses must implement this to define how text is split into chunks.
         """
         pass
-    def get_embeddings(self) -> List[float]:
+    def get_embeddings(self) -> ChunkEmbeddings:
         """
-        Runs the pipeline and is intended to return embeddings for the processed documents.
-        NOTE: Currently returns an empty list.
+        Runs the pipeline and returns the embeddings of the chunks with their texts and metadata.
+
+        The matrix is allocated once and each embedding is copied straight into its row, so no intermediate list of
+        vectors is built. Chunks that came back without an embedding are left out.
         """
-        
         documents = self.run_pipeline()
         logger.info(f"Generated {len(documents)} documents for embedding.")
-        for document in documents:      
-            for chunk in document.chunks:
-                logger.debug(f"Processing chunk: {chunk.text[:50]}")
-                if(chunk.embedding is not None):
-                    logger.debug(f"Processing chunk: {chunk.embedding[:5]}")
+        return self.to_chunk_embeddings(documents)
+
+    def to_chunk_embeddings(self, documents : List[Document], source : str | None = None) -> ChunkEmbeddings:
+        """
+        Collects the embedded chunks of the documents into a ChunkEmbeddings. source, if given, overrides the
+        source recorded on the documents.
+        """
+        embedded = [(document, chunk_index, chunk)
+                    for document in documents
+                    for chunk_index, chunk in enumerate(document.chunks)
+                    if chunk.embedding is not None]
+        if not embedded:
+            return ChunkEmbeddings(np.empty((0, 0), dtype=np.float32), [], [])
 
-        return []
+        dimension = len(embedded[0][2].embedding)
+        vectors = np.empty((len(embedded), dimension), dtype=np.float32)
+        texts : List[str] = []
+        metadatas : List[Metadata] = []
+        for row, (document, chunk_index, chunk) in enumerate(embedded):
+            vectors[row] = chunk.embedding
+            texts.append(chunk.text)
+            chunk_metadata = {
+                "source": source if source is not None else self.get_source(document),
+                "chunk_index": chunk_index,
+                "token_count": chunk.token_count,
+            }
+            page_number = self.get_page(document)
+            if page_number is not None:
+                chunk_metadata["page"] = page_number
+            metadatas.append(Metadata.model_validate(chunk_metadata))
+        logger.info(f"Embedded {len(texts)} chunks into a {vectors.shape} matrix. Embedding cache: {get_embedding_cache().stats()}")
+        return ChunkEmbeddings(vectors, texts, metadatas)
+
+    def get_page(self, document : Document) -> int | None:
+        """
+        Returns the page a document was read from, or None if its file has no pages.
+        """
+        document_metadata = getattr(document, "metadata", None) or {}
+        return document_metadata.get("page")
+
+    def get_source(self, document : Document) -> str:
+        """
+        Returns the file a document was read from, or "text" if it was given as a string.
+        """
+        document_metadata = getattr(document, "metadata", None) or {}
+        source = document_metadata.get("filename") or document_metadata.get("source") or self.file_name
+        return str(source) if source is not None else "text"
 
     def get_model(self) -> BaseChunker | None:
         """
@@ -80,18 +135,58 @@ class AbstractEmbeddingModel(ABC):
         return True
     def add_embeddings_refinery(self):
         """Adds an embedding refinery step to the pipeline."""
-        self.pipeline.refine_with("embeddings", embedding_model=self.model_name)
+        self.pipeline.refine_with("embeddings", embedding_model=self.get_embedding_model())
+
+    def get_embedding_model(self) -> BaseEmbeddings | str:
+        """
+        Returns the embeddings model for the refinery. Unless EMBEDDING_CACHE_ENABLED is false, the client created by
+        initialize_client is wrapped so that chunks embedded by an earlier run are read from the embedding cache
+        instead of being sent to the API again.
+        """
+        embed_model = getattr(self, "_embed_model", None)
+        if embed_model is None or os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() != "true":
+            return self.model_name
+        return CachedEmbeddings(embed_model, self.model_name, get_embedding_cache())
+
+    def configure_pipeline(self, embed : bool = True) -> Pipeline:
+        """
+        Builds a fresh pipeline with the chef, the chunker of the subclass and, unless embed is False, the embeddings
+        refinery.
+        """
+        self.pipeline = Pipeline()
+        self.pipeline.process_with(chef_type=MarkdownChef.__name__)
+        self.configure_chunker_for_pipeline(self.pipeline)
+        if embed:
+            self.add_embeddings_refinery()
+        return self.pipeline
+
+    def embed_documents(self, documents : List[Document]):
+        """
+        Embeds the chunks of all the documents with a single embed_batch call and sets the embedding of each chunk.
+
+        The embeddings refinery embeds the chunks of one document at a time, so a pipeline run over many small pages
+        would make one request per page.
+        """
+        chunks = [chunk for document in documents for chunk in document.chunks]
+        if not chunks:
+            return
+        embedding_model = self.get_embedding_model()
+        if isinstance(embedding_model, str):
+            embedding_model = AutoEmbeddings.get_embeddings(embedding_model)
+        for chunk, embedding in zip(chunks, embedding_model.embed_batch([chunk.text for chunk in chunks])):
+            chunk.embedding = embedding
 
     def run_pipeline(self) -> List[Document]:
         """
         Executes the text processing pipeline based on the provided input.
 
         The method prioritizes input in the following order:
-        1. A single file (`file_name`): The file is processed into text using a factory.
+        1. A single file (`file_name`): The file is processed into text using a factory. PDFs are processed page by
+           page and each page becomes a Document, see iter_page_documents.
         2. A raw text string (`text_to_chunk`).
+        3. A directory (`directory_name`): Every supported file under it is processed, see iter_directory_documents.
 
-        Directory processing is currently disabled. After processing the input into
-        text, it configures the chunker and runs the chonkie pipeline.
+        After processing the input into text, it configures the chunker and runs the chonkie pipeline.
 
         Returns:
             A list of Document objects, where each object represents a chunk of text.
@@ -101,6 +196,11 @@ class AbstractEmbeddingModel(ABC):
             NotImplementedError: If the file type is not supported by the factory.
         """
         isText = self.text_to_chunk is not None
+
+        if self.file_name is not None and self.file_name.lower().endswith(".pdf"):
+            # PDFs are read and chunked a few pages at a time so that a large one is never held in memory as a whole.
+            pages = ((self.file_name, page) for page in iter_pdf_pages(self.file_name, max_workers=int(os.getenv("INGEST_PDF_MAX_WORKERS", "1"))))
+            return [document for _, document in self.iter_page_documents(pages)]
         
         if self.file_name is not None:
             try:
@@ -109,31 +209,132 @@ class AbstractEmbeddingModel(ABC):
             except (NotImplementedError, Exception) as e:
                 logger.error(f"Failed to process file {self.file_name}: {e}")
                 raise
-        
-        # Directory processing is currently disabled.
-        if self.directory_name is not None and not isText:
-            if not self.directory_name.startswith("/app"):
-                self.directory_name = "/app/" + self.directory_name
-            self.pipeline.fetch_from("file", dir=self.directory_name)
 
+        if not isText and self.directory_name is not None:
+            return list(self.iter_directory_documents())
         elif not isText: # Neither file, dir, nor initial text was provided
             logger.error("No input provided for chunking. Please provide a directory, file, or text.")
             raise ValueError("Input is missing")
 
-        self.pipeline.process_with(chef_type=MarkdownChef.__name__)
-        self.configure_chunker_for_pipeline(self.pipeline)
-        self.add_embeddings_refinery()
-
-        if isText:
-            result = self.pipeline.run(self.text_to_chunk)
-        else:
-            result = self.pipeline.run()
+        result = self.configure_pipeline().run(self.text_to_chunk)
 
         if isinstance(result, list):
             return result
         else:
             return [result]
 
+    def iter_directory_documents(self,
+                                 max_workers : int | None = None,
+                                 batch_size : int | None = None) -> Iterator[Document]:
+        """
+        Walks directory_name and yields the chunked and embedded Document of every supported file.
+        See iter_file_documents for the arguments.
+        """
+        directory = os.path.abspath(self.directory_name)
+        if not os.path.isdir(directory):
+            raise ValueError(f"{directory} is not a directory.")
+        for _, document in self.iter_file_documents(walk_directory(directory), max_workers=max_workers, batch_size=batch_size):
+            yield document
+
+    def iter_file_documents(self,
+                            file_paths : Iterable[str],
+                            max_workers : int | None = None,
+                            batch_size : int | None = None,
+                            on_error : Callable[[str, Exception], None] | None = None) -> Iterator[tuple[str, Document]]:
+        """
+        Yields (path, Document) with the chunked and embedded documents of each file, one per page for PDFs and one
+        per file otherwise. See iter_file_batches for the arguments.
+        """
+        for batch in self.iter_file_batches(file_paths, max_workers=max_workers, batch_size=batch_size, on_error=on_error):
+            yield from batch
+
+    def iter_file_batches(self,
+                          file_paths : Iterable[str],
+                          max_workers : int | None = None,
+                          batch_size : int | None = None,
+                          on_error : Callable[[str, Exception], None] | None = None) -> Iterator[List[tuple[str, Document]]]:
+        """
+        Yields the (path, Document) of each file batch by batch, one document per page for PDFs and one per file
+        otherwise. The files come in the order given and the documents of a file one after the other, possibly spread
+        over consecutive batches.
+
+        The pages are extracted in a pool of processes, a few pages of a PDF per task, and chunked as they come back,
+        see iter_pages_parallel and iter_page_batches. Files without text are skipped.
+
+        Args:
+            file_paths: The files to process.
+            max_workers: The number of extraction processes. Defaults to INGEST_MAX_WORKERS, or the number of CPUs.
+            batch_size: The number of pages chunked per pipeline run. Defaults to INGEST_BATCH_SIZE, or 16.
+            on_error: Called with the path and the exception of every file that could not be read. Its documents
+                      yielded before the error are not taken back.
+        """
+        if max_workers is None:
+            max_workers = int(os.getenv("INGEST_MAX_WORKERS", "0")) or None
+
+        def pages() -> Iterator[tuple[str, PageText]]:
+            file_count = 0
+            last_path = None
+            for file_path, page in iter_pages_parallel(file_paths, max_workers=max_workers, on_error=on_error):
+                if file_path != last_path:
+                    file_count += 1
+                    last_path = file_path
+                yield (file_path, page)
+            logger.info(f"Processed {file_count} files.")
+        return self.iter_page_batches(pages(), batch_size=batch_size)
+
+    def iter_page_documents(self,
+                            pages : Iterable[tuple[str, PageText]],
+                            batch_size : int | None = None) -> Iterator[tuple[str, Document]]:
+        """
+        Chunks and embeds the pages as they come and yields (path, Document) for each page, in order. See
+        iter_page_batches.
+        """
+        for batch in self.iter_page_batches(pages, batch_size=batch_size):
+            yield from batch
+
+    def iter_page_batches(self,
+                          pages : Iterable[tuple[str, PageText]],
+                          batch_size : int | None = None) -> Iterator[List[tuple[str, Document]]]:
+        """
+        Chunks and embeds the pages as they come and yields the (path, Document) of each batch of pages, in order.
+
+        The pages are chunked batch_size at a time (INGEST_BATCH_SIZE by default) and the chunks of a batch are
+        embedded with a single request, see embed_documents. Only one batch is held in memory. The source and page
+        number of each document are set in its metadata.
+        """
+        if batch_size is None:
+            batch_size = int(os.getenv("INGEST_BATCH_SIZE", "16"))
+        pipeline = self.configure_pipeline(embed=False)
+        batch : List[tuple[str, PageText]] = []
+
+        def run_batch() -> List[tuple[str, Document]]:
+            result = pipeline.run([page.text for _, page in batch])
+            documents = result if isinstance(result, list) else [result]
+            self.embed_documents(documents)
+            for (file_path, page), document in zip(batch, documents):
+                self.set_source(document, file_path, page.page_number)
+            return [(file_path, document) for (file_path, _), document in zip(batch, documents)]
+
+        for file_path, page in pages:
+            if not page.text.strip():
+                continue
+            batch.append((file_path, page))
+            if len(batch) >= batch_size:
+                yield run_batch()
+                batch = []
+        if batch:
+            yield run_batch()
+
+    def set_source(self, document : Document, file_path : str, page_number : int | None = None):
+        """
+        Records the file a document was read from, and its page, in its metadata, see get_source and get_page.
+        """
+        document_metadata = getattr(document, "metadata", None)
+        if isinstance(document_metadata, dict):
+            document_metadata["source"] = file_path
+            if page_number is not None:
+                document_metadata["page"] = page_number
+
     # def build_pipeline(self):
     #     if(self.is_chonkie):
     #         pipeline.chunker()
@@ -0,0 +1,237 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+from pathlib import Path
+from threading import Lock
+from typing import List, Sequence
+
+import numpy as np
+from chonkie.embeddings import BaseEmbeddings
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+
+class EmbeddingCache:
+    """
+    A disk-backed cache of embeddings keyed by the embedding model and the SHA-256 of the text.
+
+    The vectors of a model are kept in a memory-mapped float32 file with a fixed number of slots, so a lookup reads
+    only the rows it needs and the cache survives restarts. A small SQLite index maps (model, text hash) to a slot and
+    records when the slot was last used. Once the file is full the least recently used slots are reused, which keeps
+    the cache within max_bytes per model.
+    """
+
+    def __init__(self, cache_dir : str | Path, max_bytes : int = 256 * 1024 * 1024):
+        """
+        Initializes the EmbeddingCache.
+
+        Args:
+            cache_dir: The directory holding the index and the vector files.
+            max_bytes: The maximum size of the vector file of each model.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._connection = sqlite3.connect(self.cache_dir / "index.sqlite", check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                slot INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (model, last_used)")
+        self._connection.commit()
+        self._vectors : dict[str, np.memmap] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def text_hash(text : str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _model_key(self, model_name : str, dimension : int) -> str:
+        # The dimension is part of the key so that a model configured with a different output size gets its own file.
+        return f"{model_name}:{dimension}"
+
+    def _vector_file(self, model_key : str, dimension : int) -> np.memmap:
+        vectors = self._vectors.get(model_key)
+        if vectors is None:
+            path = self.cache_dir / (re.sub(r"[^A-Za-z0-9_.-]", "_", model_key) + ".f32")
+            capacity = max(1, self.max_bytes // (dimension * 4))
+            mode = "r+" if path.exists() and path.stat().st_size == capacity * dimension * 4 else "w+"
+            if mode == "w+":
+                # A new or resized file: whatever the index says about its slots is no longer true.
+                self._connection.execute("DELETE FROM embeddings WHERE model = ?", (model_key,))
+                self._connection.commit()
+            vectors = np.memmap(path, dtype=np.float32, mode=mode, shape=(capacity, dimension))
+            self._vectors[model_key] = vectors
+        return vectors
+
+    def get_many(self, model_name : str, dimension : int, texts : Sequence[str]) -> List[np.ndarray | None]:
+        """
+        Returns the cached embedding of each text, or None for the texts that are not in the cache.
+        """
+        if not texts:
+            return []
+        model_key = self._model_key(model_name, dimension)
+        hashes = [self.text_hash(text) for text in texts]
+        with self._lock:
+            vectors = self._vector_file(model_key, dimension)
+            slots = self._find_slots(model_key, hashes)
+            found = [slots.get(text_hash) for text_hash in hashes]
+            hits = [text_hash for text_hash in hashes if text_hash in slots]
+            if hits:
+                now = time.time()
+                self._connection.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                                             [(now, model_key, text_hash) for text_hash in hits])
+                self._connection.commit()
+            self.hits += len(hits)
+            self.misses += len(hashes) - len(hits)
+            return [np.array(vectors[slot]) if slot is not None else None for slot in found]
+
+    def put_many(self, model_name : str, texts : Sequence[str], embeddings : Sequence[np.ndarray]):
+        """
+        Stores the embeddings of the texts, evicting the least recently used entries if the cache is full.
+        """
+        if not texts:
+            return
+        dimension = len(embeddings[0])
+        model_key = self._model_key(model_name, dimension)
+        # The same text can appear more than once in a batch; it only needs one slot.
+        unique = {self.text_hash(text): embedding for text, embedding in zip(texts, embeddings)}
+        with self._lock:
+            vectors = self._vector_file(model_key, dimension)
+            existing = self._find_slots(model_key, list(unique))
+            new_hashes = [text_hash for text_hash in unique if text_hash not in existing]
+            free_slots = self._free_slots(model_key, len(vectors), len(new_hashes))
+            now = time.time()
+            rows = []
+            for text_hash, slot in zip(new_hashes, free_slots):
+                vectors[slot] = unique[text_hash]
+                rows.append((model_key, text_hash, slot, now))
+            vectors.flush()
+            self._connection.executemany("INSERT OR REPLACE INTO embeddings (model, text_hash, slot, last_used) VALUES (?, ?, ?, ?)", rows)
+            self._connection.commit()
+
+    def _find_slots(self, model_key : str, hashes : List[str]) -> dict[str, int]:
+        slots : dict[str, int] = {}
+        # SQLite limits the number of parameters of a statement.
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for text_hash, slot in self._connection.execute(
+                    f"SELECT text_hash, slot FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})", [model_key, *batch]):
+                slots[text_hash] = slot
+        return slots
+
+    def _free_slots(self, model_key : str, capacity : int, count : int) -> List[int]:
+        """
+        Returns up to count slots to write to: unused slots first, then the least recently used ones.
+        """
+        if count == 0:
+            return []
+        count = min(count, capacity)
+        used = {slot for (slot,) in self._connection.execute("SELECT slot FROM embeddings WHERE model = ?", (model_key,))}
+        free = [slot for slot in range(capacity) if slot not in used][:count]
+        if len(free) < count:
+            evicted = self._connection.execute(
+                "SELECT text_hash, slot FROM embeddings WHERE model = ? ORDER BY last_used LIMIT ?",
+                (model_key, count - len(free))).fetchall()
+            self._connection.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?",
+                                         [(model_key, text_hash) for text_hash, _ in evicted])
+            free.extend(slot for _, slot in evicted)
+            self.evictions += len(evicted)
+        return free
+
+    def stats(self) -> dict:
+        """
+        Returns the number of cached embeddings, the hits, misses and evictions, and the hit rate.
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class CachedEmbeddings(BaseEmbeddings):
+    """
+    Wraps a chonkie embeddings model so that only the texts missing from an EmbeddingCache are sent to it.
+    It can be given to the EmbeddingsRefinery in place of the model it wraps.
+    """
+
+    def __init__(self, embedding_model : BaseEmbeddings, model_name : str, cache : EmbeddingCache):
+        super().__init__()
+        self.embedding_model = embedding_model
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed(self, text : str) -> np.ndarray:
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts : List[str]) -> List[np.ndarray]:
+        if not texts:
+            return []
+        embeddings = self.cache.get_many(self.model_name, self.dimension, texts)
+        missing = [index for index, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_texts = [texts[index] for index in missing]
+            computed = self.embedding_model.embed_batch(missing_texts)
+            for index, embedding in zip(missing, computed):
+                embeddings[index] = np.asarray(embedding, dtype=np.float32)
+            self.cache.put_many(self.model_name, missing_texts, [embeddings[index] for index in missing])
+        logger.info(f"Embedded {len(texts)} texts, {len(texts) - len(missing)} from the cache.")
+        return embeddings
+
+    @property
+    def dimension(self) -> int:
+        return self.embedding_model.dimension
+
+    def get_tokenizer_or_token_counter(self):
+        return self.embedding_model.get_tokenizer_or_token_counter()
+
+    def get_tokenizer(self):
+        return self.embedding_model.get_tokenizer()
+
+    def similarity(self, u : np.ndarray, v : np.ndarray) -> np.float32:
+        return self.embedding_model.similarity(u, v)
+
+    @classmethod
+    def _is_available(cls) -> bool:
+        return True
+
+    def __repr__(self) -> str:
+        return f"CachedEmbeddings({self.embedding_model!r})"
+
+
+_embedding_cache : EmbeddingCache | None = None
+_embedding_cache_lock = Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Returns the process-wide EmbeddingCache. The directory and size are set with EMBEDDING_CACHE_DIR and
+    EMBEDDING_CACHE_MAX_MB.
+    """
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache(
+                    os.getenv("EMBEDDING_CACHE_DIR", str(PROJECT_ROOT / "data" / "embedding_cache")),
+                    max_bytes=int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024))
+    return _embedding_cache
@@ -0,0 +1,85 @@
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+from pathlib import Path
+from threading import Lock
+from typing import List, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestEntry(NamedTuple):
+    """
+    What was ingested from a file: its size and modification time when it was read, the SHA-256 of its content and the
+    ids of the chunks written to the vector database.
+    """
+    path : str
+    size : int
+    mtime : float
+    content_hash : str
+    chunk_ids : List[str]
+
+
+def hash_file(file_path : str, block_size : int = 1024 * 1024) -> str:
+    """
+    Returns the SHA-256 of the content of a file, read a block at a time.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestionManifest:
+    """
+    A SQLite table of the files that have been ingested, used to ingest only what changed since the last run.
+    """
+
+    def __init__(self, db_path : str | Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                content_hash TEXT NOT NULL,
+                chunk_ids TEXT NOT NULL,
+                ingested_at REAL NOT NULL
+            )""")
+        self._connection.commit()
+
+    def get(self, path : str) -> ManifestEntry | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT path, size, mtime, content_hash, chunk_ids FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        return ManifestEntry(row[0], row[1], row[2], row[3], json.loads(row[4]))
+
+    def put(self, entry : ManifestEntry):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, content_hash, chunk_ids, ingested_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (entry.path, entry.size, entry.mtime, entry.content_hash, json.dumps(entry.chunk_ids), time.time()))
+            self._connection.commit()
+
+    def remove(self, path : str):
+        with self._lock:
+            self._connection.execute("DELETE FROM files WHERE path = ?", (path,))
+            self._connection.commit()
+
+    def paths_under(self, directory : str) -> List[str]:
+        """
+        Returns the paths of the ingested files that are under the directory.
+        """
+        prefix = directory.rstrip("/") + "/"
+        with self._lock:
+            rows = self._connection.execute("SELECT path FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
@@ -0,0 +1,179 @@
+import os
+import hashlib
+import logging
+from itertools import groupby
+from pathlib import Path
+from typing import List, NamedTuple, TYPE_CHECKING
+
+import numpy as np
+
+from embeddings.AbstractEmbeddingModel import AbstractEmbeddingModel
+from embeddings.IngestionManifest import IngestionManifest, ManifestEntry, hash_file
+from utils.FileProcessor import walk_directory
+
+if TYPE_CHECKING:
+    from vectordb.DBWrapper import AbstractDBWrapper
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+
+class IngestionReport(NamedTuple):
+    """
+    The number of files in each state found by Ingestor.sync, and the number of chunks written and deleted. failed
+    counts the added or changed files that could not be read; they are tried again by the next sync.
+    """
+    added : int
+    changed : int
+    unchanged : int
+    removed : int
+    chunks_written : int
+    chunks_deleted : int
+    failed : int = 0
+
+
+class Ingestor:
+    """
+    Keeps the vector database in step with a directory of documents.
+
+    Every file that is ingested is recorded in an IngestionManifest with its size, modification time, content hash
+    and the ids of its chunks. sync then only reads the files that are new or whose size or modification time changed,
+    and of those only re-chunks the ones whose content hash changed. The chunks of changed and removed files are
+    deleted from the database, so editing or removing a document leaves no orphaned chunks behind.
+
+    Chunk ids are derived from the path, the content hash and the position of the chunk, so the new chunks of a
+    changed file never collide with the old ones and are written before the old ones are deleted.
+    """
+
+    def __init__(self, embedding_model : AbstractEmbeddingModel, db_wrapper : "AbstractDBWrapper", manifest : IngestionManifest | None = None):
+        """
+        Initializes the Ingestor.
+
+        Args:
+            embedding_model: The model that chunks and embeds the files.
+            db_wrapper: The collection the chunks are written to.
+            manifest: The manifest of the ingested files. Defaults to the one at INGEST_MANIFEST_PATH, by default
+                      data/ingestion_manifest.db.
+        """
+        self.embedding_model = embedding_model
+        self.db_wrapper = db_wrapper
+        if manifest is None:
+            manifest = IngestionManifest(os.getenv("INGEST_MANIFEST_PATH", str(PROJECT_ROOT / "data" / "ingestion_manifest.db")))
+        self.manifest = manifest
+
+    def chunk_ids(self, file_path : str, content_hash : str, count : int, start : int = 0) -> List[str]:
+        path_hash = hashlib.sha256(file_path.encode("utf-8")).hexdigest()[:16]
+        return [f"{path_hash}-{content_hash[:16]}-{index}" for index in range(start, start + count)]
+
+    def sync(self, directory : str) -> IngestionReport:
+        """
+        Ingests the files under the directory that were added or changed since the last sync and deletes the chunks
+        of the files that were changed or removed.
+        """
+        directory = os.path.abspath(directory)
+        if not os.path.isdir(directory):
+            raise ValueError(f"{directory} is not a directory.")
+
+        to_ingest : dict[str, tuple[int, float, str]] = {}
+        seen : set[str] = set()
+        added = changed = unchanged = 0
+        for file_path in walk_directory(directory):
+            seen.add(file_path)
+            stat = os.stat(file_path)
+            entry = self.manifest.get(file_path)
+            if entry is not None and entry.size == stat.st_size and entry.mtime == stat.st_mtime:
+                unchanged += 1
+                continue
+            content_hash = hash_file(file_path)
+            if entry is not None and entry.content_hash == content_hash:
+                # Touched but not edited: remember the new modification time so that it is not hashed again.
+                self.manifest.put(entry._replace(size=stat.st_size, mtime=stat.st_mtime))
+                unchanged += 1
+                continue
+            if entry is None:
+                added += 1
+            else:
+                changed += 1
+            to_ingest[file_path] = (stat.st_size, stat.st_mtime, content_hash)
+
+        chunks_written = 0
+        chunks_deleted = 0
+        ingested : set[str] = set()
+        failed : set[str] = set()
+        # The ids written so far for each file whose last chunks may still be to come.
+        written : dict[str, List[str]] = {}
+
+        def finish(file_path : str):
+            nonlocal chunks_written, chunks_deleted
+            ids = written.pop(file_path)
+            if file_path in failed:
+                # The chunks of the pages read before the error must not stay behind.
+                if ids:
+                    self.db_wrapper.delete(ids)
+                    chunks_written -= len(ids)
+                return
+            size, mtime, content_hash = to_ingest[file_path]
+            chunks_deleted += self._delete_chunks(file_path)
+            self.manifest.put(ManifestEntry(file_path, size, mtime, content_hash, ids))
+            ingested.add(file_path)
+
+        if to_ingest:
+            # The chunks are written a batch of pages at a time, so a large file is never held in memory as a whole.
+            # The documents of a file come one after the other, so a file is complete once the next one starts.
+            batches = self.embedding_model.iter_file_batches(list(to_ingest), on_error=lambda file_path, _: failed.add(file_path))
+            for batch in batches:
+                texts, metadatas, vectors, ids = [], [], [], []
+                for file_path, group in groupby(batch, key=lambda path_and_document: path_and_document[0]):
+                    if file_path in failed:
+                        continue
+                    chunk_embeddings = self.embedding_model.to_chunk_embeddings([document for _, document in group], source=file_path)
+                    file_ids = written.setdefault(file_path, [])
+                    if not chunk_embeddings.texts:
+                        continue
+                    batch_ids = self.chunk_ids(file_path, to_ingest[file_path][2], len(chunk_embeddings.texts), start=len(file_ids))
+                    texts.extend(chunk_embeddings.texts)
+                    metadatas.extend(chunk_embeddings.metadatas)
+                    vectors.append(chunk_embeddings.vectors)
+                    ids.extend(batch_ids)
+                    file_ids.extend(batch_ids)
+                if ids:
+                    self.db_wrapper.add(texts, metadatas, embeddings=np.concatenate(vectors), ids=ids)
+                    chunks_written += len(ids)
+                last_path = batch[-1][0]
+                for file_path in [file_path for file_path in written if file_path != last_path]:
+                    finish(file_path)
+            for file_path in list(written):
+                finish(file_path)
+        # A file that could not be read keeps its manifest entry and its old chunks, so a transient error does not drop
+        # it from the index and, as the entry no longer matches the file, the next sync tries it again.
+        for file_path in failed:
+            logger.warning(f"Could not read {file_path}; keeping its previous chunks and trying again on the next sync.")
+        # A file that was read but has no text must not keep its old chunks either. It is recorded with no chunks so
+        # that it is not read again until it changes.
+        for file_path in to_ingest.keys() - ingested - failed:
+            size, mtime, content_hash = to_ingest[file_path]
+            chunks_deleted += self._delete_chunks(file_path)
+            self.manifest.put(ManifestEntry(file_path, size, mtime, content_hash, []))
+
+        removed = 0
+        for file_path in self.manifest.paths_under(directory):
+            if file_path not in seen:
+                chunks_deleted += self._delete_chunks(file_path)
+                self.manifest.remove(file_path)
+                removed += 1
+
+        report = IngestionReport(added, changed, unchanged, removed, chunks_written, chunks_deleted, len(failed))
+        logger.info(f"Synced {directory}: {report}")
+        return report
+
+    def _delete_chunks(self, file_path : str) -> int:
+        """
+        Deletes the chunks the manifest has for the file. Called before the manifest entry is replaced or removed.
+        """
+        entry = self.manifest.get(file_path)
+        if entry is None or not entry.chunk_ids:
+            return 0
+        self.db_wrapper.delete(entry.chunk_ids)
+        logger.info(f"Deleted {len(entry.chunk_ids)} chunks of {file_path}.")
+        return len(entry.chunk_ids)
@@ -0,0 +1,112 @@
+import os
+import logging
+from threading import Lock, BoundedSemaphore
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClient:
+    """
+    A singleton that owns the pooled HTTP session shared by all outbound services (Weather, Pushover etc.).
+
+    Reusing one session keeps connections to the upstream services alive, so repeat calls skip the TCP and TLS
+    handshake. Every request gets a connect and read timeout so a slow upstream cannot hang a chat worker, idempotent
+    requests are retried a bounded number of times with exponential backoff, and the number of requests in flight to
+    a single host is capped.
+
+    The settings are read from the environment:
+        HTTP_CONNECT_TIMEOUT: Seconds to wait for a connection. Defaults to 3.05.
+        HTTP_READ_TIMEOUT: Seconds to wait for the response. Defaults to 10.
+        HTTP_MAX_RETRIES: Number of retries for failed requests. Defaults to 3.
+        HTTP_BACKOFF_FACTOR: Backoff factor between retries. Defaults to 0.5.
+        HTTP_POOL_MAXSIZE: Number of connections kept alive per host. Defaults to 20.
+        HTTP_MAX_CONCURRENCY_PER_HOST: Number of requests in flight to one host. Defaults to 10.
+    """
+    _instance = None
+    _lock = Lock()
+
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            with cls._lock:
+                if not cls._instance:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        with self._lock:
+            if hasattr(self, '_initialized'):
+                return
+            self._initialized = True
+
+            self.timeout = (float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05")), float(os.getenv("HTTP_READ_TIMEOUT", "10")))
+            self.max_concurrency_per_host = int(os.getenv("HTTP_MAX_CONCURRENCY_PER_HOST", "10"))
+            pool_maxsize = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+
+            # POST is left out of the retried methods (urllib3's default) so that a notification is never sent twice.
+            # Connection errors are still retried for every method because the request never reached the server.
+            retry = Retry(
+                total=int(os.getenv("HTTP_MAX_RETRIES", "3")),
+                backoff_factor=float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5")),
+                status_forcelist=self.RETRY_STATUS_CODES,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_maxsize, max_retries=retry)
+            self._session = requests.Session()
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+
+            self._host_semaphores : dict[str, BoundedSemaphore] = {}
+            self._host_semaphores_lock = Lock()
+
+    def _get_host_semaphore(self, url : str) -> BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._host_semaphores_lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = BoundedSemaphore(self.max_concurrency_per_host)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+
+    def request(self, method : str, url : str, **kwargs) -> requests.Response:
+        """
+        Sends a request through the shared session.
+
+        Args:
+            method: The HTTP method.
+            url: The URL to send the request to.
+            **kwargs: Passed on to requests. A timeout is added if one is not given.
+
+        Returns:
+            The response.
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails after all the retries.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        with self._get_host_semaphore(url):
+            return self._session.request(method, url, **kwargs)
+
+    def get(self, url : str, **kwargs) -> requests.Response:
+        """Sends a GET request through the shared session."""
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url : str, **kwargs) -> requests.Response:
+        """Sends a POST request through the shared session."""
+        return self.request("POST", url, **kwargs)
+
+
+def get_http_client() -> HttpClient:
+    """
+    A convenience function to get the process-wide HttpClient instance.
+    """
+    return HttpClient()
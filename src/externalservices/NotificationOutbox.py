@@ -0,0 +1,257 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+import atexit
+from pathlib import Path
+from threading import Lock, Thread, Event
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+
+class PermanentSendError(Exception):
+    """
+    Raised by a sender when sending again cannot succeed, e.g. because the API rejected the token or the recipient.
+    The notifications are marked as failed straight away instead of being retried.
+    """
+    pass
+
+
+class NotificationOutbox:
+    """
+    A durable outbox for notifications that are sent in the background.
+
+    The chat turn only enqueues a notification, which is written to a local SQLite database, and returns straight away.
+    Worker threads pick the pending notifications up, coalesce a burst of them into as few API calls as the message
+    size limit allows and hand them to the sender. Failed sends are retried with exponential backoff and jitter, unless
+    the sender raises PermanentSendError, and because the outbox lives on disk, notifications that were pending when
+    the process stopped are sent on restart.
+    """
+    STATUS_PENDING = "pending"
+    STATUS_SENDING = "sending"
+    STATUS_FAILED = "failed"
+
+    def __init__(self,
+                 db_path : str | Path,
+                 sender : Callable[[str], bool] | None = None,
+                 num_workers : int = 1,
+                 max_attempts : int = 8,
+                 base_backoff_seconds : float = 2.0,
+                 max_backoff_seconds : float = 300.0,
+                 coalesce_window_seconds : float = 2.0,
+                 max_message_length : int = 1024,
+                 separator : str = "\n---\n"):
+        """
+        Initializes the NotificationOutbox. The workers are not started until start is called.
+
+        Args:
+            db_path: The path of the SQLite database holding the outbox.
+            sender: A callable that sends a message and returns True on success. It raises PermanentSendError when
+                    the message should not be retried. Defaults to PushOver().send_message, created on first use.
+            num_workers: The number of worker threads sending notifications.
+            max_attempts: The number of attempts before a notification is marked as failed.
+            base_backoff_seconds: The delay before the first retry. It doubles with every attempt.
+            max_backoff_seconds: The upper bound on the delay between retries.
+            coalesce_window_seconds: How long a worker waits after being woken up so that a burst is sent together.
+            max_message_length: The longest message the sender accepts. Pushover's limit is 1024 characters.
+            separator: The text placed between coalesced notifications.
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._sender = sender
+        self.num_workers = num_workers
+        self.max_attempts = max_attempts
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.coalesce_window_seconds = coalesce_window_seconds
+        self.max_message_length = max_message_length
+        self.separator = separator
+
+        self._db_lock = Lock()
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+        # Anything that was being sent when the process stopped is sent again.
+        self._connection.execute("UPDATE outbox SET status = ? WHERE status = ?", (self.STATUS_PENDING, self.STATUS_SENDING))
+
+        self._wake_up = Event()
+        self._stop = Event()
+        self._workers : List[Thread] = []
+        self.sent_count = 0
+        self.api_calls = 0
+        self.failed_count = 0
+
+    def get_sender(self) -> Callable[[str], bool]:
+        """
+        Returns the sender, creating the PushOver client once if none was given.
+        """
+        if self._sender is None:
+            from externalservices.Pushover import PushOver
+            self._sender = PushOver().send_message
+        return self._sender
+
+    def enqueue(self, message : str) -> int:
+        """
+        Durably stores a notification for the workers to send and returns its id without waiting for it to be sent.
+        """
+        now = time.time()
+        with self._db_lock:
+            cursor = self._connection.execute(
+                "INSERT INTO outbox (message, status, attempts, next_attempt_at, created_at) VALUES (?, ?, 0, ?, ?)",
+                (message, self.STATUS_PENDING, now, now))
+        self._wake_up.set()
+        return cursor.lastrowid
+
+    def start(self):
+        """
+        Starts the worker threads if they are not already running.
+        """
+        if self._workers:
+            return
+        self._stop.clear()
+        for i in range(self.num_workers):
+            worker = Thread(target=self._run_worker, name=f"notification-outbox-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout : float = 5.0):
+        """
+        Stops the worker threads. Pending notifications stay in the outbox.
+        """
+        self._stop.set()
+        self._wake_up.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def _run_worker(self):
+        while not self._stop.is_set():
+            # Poll at least every few seconds so that retries become due even when nothing new is enqueued.
+            woken_up = self._wake_up.wait(timeout=self._seconds_until_next_due())
+            self._wake_up.clear()
+            if self._stop.is_set():
+                break
+            if woken_up:
+                # Give the rest of a burst time to arrive so it goes out in one call.
+                self._stop.wait(self.coalesce_window_seconds)
+            while not self._stop.is_set() and self.process_due():
+                pass
+
+    def _seconds_until_next_due(self) -> float:
+        with self._db_lock:
+            row = self._connection.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = ?", (self.STATUS_PENDING,)).fetchone()
+        if row is None or row[0] is None:
+            return 5.0
+        return min(5.0, max(0.0, row[0] - time.time()))
+
+    def _claim_batch(self) -> List[tuple]:
+        """
+        Claims as many due notifications as fit in a single message and marks them as being sent.
+        """
+        batch : List[tuple] = []
+        length = 0
+        with self._db_lock:
+            rows = self._connection.execute(
+                "SELECT id, message, attempts FROM outbox WHERE status = ? AND next_attempt_at <= ? ORDER BY id LIMIT 50",
+                (self.STATUS_PENDING, time.time())).fetchall()
+            for row in rows:
+                added_length = len(row[1]) + (len(self.separator) if batch else 0)
+                if batch and length + added_length > self.max_message_length:
+                    break
+                batch.append(row)
+                length += added_length
+            if batch:
+                self._connection.executemany(
+                    "UPDATE outbox SET status = ? WHERE id = ?", [(self.STATUS_SENDING, row[0]) for row in batch])
+        return batch
+
+    def process_due(self) -> bool:
+        """
+        Sends one coalesced batch of due notifications.
+
+        Returns:
+            bool: True if a batch was processed and there may be more to send.
+        """
+        batch = self._claim_batch()
+        if not batch:
+            return False
+        message = self.separator.join(row[1] for row in batch)
+        permanent = False
+        try:
+            sent = self.get_sender()(message)
+        except PermanentSendError as e:
+            logger.error(f"Notification rejected, not retrying: {e}")
+            sent = False
+            permanent = True
+        except Exception as e:
+            logger.error(f"An error occurred while sending a notification: {e}", exc_info=True)
+            sent = False
+        self.api_calls += 1
+
+        with self._db_lock:
+            if sent:
+                self._connection.executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for row in batch])
+                self.sent_count += len(batch)
+            else:
+                for row_id, _, attempts in batch:
+                    attempts += 1
+                    if permanent or attempts >= self.max_attempts:
+                        logger.error(f"Giving up on notification {row_id} after {attempts} attempts.")
+                        self._connection.execute(
+                            "UPDATE outbox SET status = ?, attempts = ? WHERE id = ?", (self.STATUS_FAILED, attempts, row_id))
+                        self.failed_count += 1
+                    else:
+                        backoff = min(self.max_backoff_seconds, self.base_backoff_seconds * 2 ** (attempts - 1))
+                        next_attempt_at = time.time() + backoff * random.uniform(0.5, 1.0)
+                        self._connection.execute(
+                            "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ? WHERE id = ?",
+                            (self.STATUS_PENDING, attempts, next_attempt_at, row_id))
+        return sent
+
+    def stats(self) -> dict:
+        """
+        Returns the number of pending and failed notifications along with the send counters.
+        """
+        with self._db_lock:
+            counts = dict(self._connection.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return {
+            "pending": counts.get(self.STATUS_PENDING, 0) + counts.get(self.STATUS_SENDING, 0),
+            "failed": counts.get(self.STATUS_FAILED, 0),
+            "sent": self.sent_count,
+            "api_calls": self.api_calls,
+        }
+
+
+_outbox_instance : NotificationOutbox | None = None
+_outbox_lock = Lock()
+
+def get_notification_outbox() -> NotificationOutbox:
+    """
+    Returns the process-wide NotificationOutbox, creating it and starting its workers on first use.
+    The location of the outbox can be set with the NOTIFICATION_OUTBOX_PATH environment variable. It defaults to
+    data/notification_outbox.db, which docker-compose.yaml mounts from the host so that it outlives the container.
+    """
+    global _outbox_instance
+    if _outbox_instance is None:
+        with _outbox_lock:
+            if _outbox_instance is None:
+                db_path = os.getenv("NOTIFICATION_OUTBOX_PATH", str(PROJECT_ROOT / "data" / "notification_outbox.db"))
+                outbox = NotificationOutbox(db_path, num_workers=int(os.getenv("NOTIFICATION_OUTBOX_WORKERS", "1")))
+                outbox.start()
+                atexit.register(outbox.stop)
+                _outbox_instance = outbox
+    return _outbox_instance
@@ -1,4 +1,6 @@
 import requests
+from externalservices.HttpClient import get_http_client
+from externalservices.NotificationOutbox import PermanentSendError
 from dotenv import load_dotenv
 import logging
 
@@ -15,15 +17,33 @@ class PushOver:
         if not self.api_key or not self.user_key:
             logger.error("Pushover API Key or User Key not found in environment variables.")
             raise ValueError("Pushover API Key or User Key not found.")
-    def send_message(self, message):
+    def send_message(self, message) -> bool:
+        """
+        Sends a message through the Pushover API.
+
+        Returns:
+            bool: True if Pushover accepted the message.
+
+        Raises:
+            PermanentSendError: If Pushover rejected the request with a 4xx status other than 429 (too many requests),
+                                e.g. because of an invalid token or user key, so sending it again would fail too.
+        """
         data = {
             "token": self.api_key,
             "user": self.user_key,
             "message": message
         }
-        response = requests.post(self.url, data=data)
+        try:
+            response = get_http_client().post(self.url, data=data)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Failed to send Pushover message: {e}")
+            return False
         if response.status_code == 200:
             logger.info(f"Pushover message sent successfully: {message}")
+            return True
+        elif 400 <= response.status_code < 500 and response.status_code != 429:
+            raise PermanentSendError(f"Pushover rejected the message. Status code: {response.status_code}, Response: {response.text}")
         else:
             logger.error(f"Failed to send Pushover message. Status code: {response.status_code}, Response: {response.text}")
+            return False
 
@@ -1,10 +1,48 @@
 from vo.Models import WeatherReport
+from utils.TTLCache import TTLCache
+from externalservices.HttpClient import get_http_client
+from threading import Lock
 import requests
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
 class WeatherService():
+    """
+    Gets the current weather for a city from the Open-Meteo API.
+
+    Lookups go through two process-wide caches. The coordinates of a city never change so geocoding results
+    are kept for a long time, keyed by the normalized city name. The current weather is fine to reuse for a
+    few minutes, so forecasts are kept briefly, keyed by the coordinates rounded to about a kilometre.
+    The caches are created on first use so that their WEATHER_* settings are read after the .env file is loaded.
+    """
+    _geocode_cache : TTLCache | None = None
+    _forecast_cache : TTLCache | None = None
+    _cache_lock = Lock()
+
+    @classmethod
+    def geocode_cache(cls) -> TTLCache:
+        if cls._geocode_cache is None:
+            with cls._cache_lock:
+                if cls._geocode_cache is None:
+                    cls._geocode_cache = TTLCache(
+                        max_size=int(os.getenv("WEATHER_GEOCODE_CACHE_SIZE", "2048")),
+                        ttl_seconds=float(os.getenv("WEATHER_GEOCODE_TTL_SECONDS", str(7 * 24 * 60 * 60))),
+                        name="weather_geocode")
+        return cls._geocode_cache
+
+    @classmethod
+    def forecast_cache(cls) -> TTLCache:
+        if cls._forecast_cache is None:
+            with cls._cache_lock:
+                if cls._forecast_cache is None:
+                    cls._forecast_cache = TTLCache(
+                        max_size=int(os.getenv("WEATHER_FORECAST_CACHE_SIZE", "512")),
+                        ttl_seconds=float(os.getenv("WEATHER_FORECAST_TTL_SECONDS", str(10 * 60))),
+                        name="weather_forecast")
+        return cls._forecast_cache
+
     def get_weather_object(self, city_name: str) -> WeatherReport:
         """
         Retrieves weather data for a given city using the Open-Meteo API.
@@ -17,17 +55,13 @@ class WeatherService():
         """
         try:
             # 1. Geocode the city name to get latitude and longitude.
-            geo_url = f"https://geocoding-api.open-meteo.com/v1/search?name={city_name}&count=1&format=json"
-            geo_res_json = requests.get(geo_url).json()
-            if "results" not in geo_res_json:
+            geo_res = self.get_location(city_name)
+            if geo_res is None:
                 return None
-            geo_res = geo_res_json["results"][0]
-            
+
             # 2. Get the current weather using the latitude and longitude.
-            lat, lon = geo_res["latitude"], geo_res["longitude"]
-            w_url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current=temperature_2m,relative_humidity_2m"
-            w_res = requests.get(w_url).json()["current"]
-            
+            w_res = self.get_current_weather(geo_res["latitude"], geo_res["longitude"])
+
             # 3. Instantiate and return the WeatherReport model with the retrieved data.
             return WeatherReport(
                 city=geo_res["name"],
@@ -37,3 +71,41 @@ class WeatherService():
         except (requests.exceptions.RequestException, KeyError, IndexError) as e:
             logger.error(f"An error occurred while getting weather for {city_name}: {e}", exc_info=True)
             return None
+
+    def get_location(self, city_name: str) -> dict | None:
+        """
+        Geocodes a city name, returning the first Open-Meteo result or None if the city is not found.
+        """
+        cache_key = " ".join(city_name.split()).casefold()
+        geo_res = self.geocode_cache().get(cache_key)
+        if geo_res is None:
+            geo_url = "https://geocoding-api.open-meteo.com/v1/search"
+            geo_res_json = get_http_client().get(geo_url, params={"name": city_name, "count": 1, "format": "json"}).json()
+            if "results" not in geo_res_json:
+                return None
+            geo_res = geo_res_json["results"][0]
+            self.geocode_cache().put(cache_key, geo_res)
+        return geo_res
+
+    def get_current_weather(self, lat : float, lon : float) -> dict:
+        """
+        Returns the current temperature and relative humidity at the given coordinates.
+        """
+        cache_key = (round(lat, 2), round(lon, 2))
+        w_res = self.forecast_cache().get(cache_key)
+        if w_res is None:
+            w_url = "https://api.open-meteo.com/v1/forecast"
+            params = {"latitude": cache_key[0], "longitude": cache_key[1], "current": "temperature_2m,relative_humidity_2m"}
+            w_res = get_http_client().get(w_url, params=params).json()["current"]
+            self.forecast_cache().put(cache_key, w_res)
+        return w_res
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        """
+        Returns the hit and miss counters of the geocoding and forecast caches.
+        """
+        return {
+            "geocode": cls.geocode_cache().stats(),
+            "forecast": cls.forecast_cache().stats(),
+        }
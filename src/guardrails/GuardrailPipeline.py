@@ -0,0 +1,226 @@
+import os
+import re
+import time
+import logging
+from abc import ABC, abstractmethod
+from enum import IntEnum
+from threading import Lock
+from typing import List, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class GuardrailCost(IntEnum):
+    """
+    How expensive a guardrail is to run. The pipeline runs the cheaper guardrails first.
+    """
+    LOCAL = 0    # pure Python checks that take microseconds
+    REMOTE = 10  # checks that make a network call, e.g. the moderation API
+
+
+class GuardrailError(ValueError):
+    """
+    Raised by GuardrailPipeline.enforce when a message fails a guardrail.
+    """
+    def __init__(self, stage : str, err_message : str):
+        super().__init__(f"{stage}: {err_message}")
+        self.stage = stage
+        self.err_message = err_message
+
+
+class GuardrailReport(NamedTuple):
+    """
+    The outcome of running the pipeline on a message.
+    failed_stage and err_message are None when the message passed, and timings holds the milliseconds spent in
+    each stage that ran.
+    """
+    passed : bool
+    err_message : str | None
+    failed_stage : str | None
+    timings : dict
+
+
+class AbstractGuardrail(ABC):
+    """
+    A single check in the guardrail pipeline.
+    """
+    name : str = "guardrail"
+    cost : GuardrailCost = GuardrailCost.LOCAL
+
+    @abstractmethod
+    async def check(self, chat_twin, message : str) -> str | None:
+        """
+        Checks a user message.
+
+        Args:
+            chat_twin: The chat client for the session the message was sent in.
+            message: The user message.
+
+        Returns:
+            The message to show the user if the check failed, or None if it passed.
+        """
+        pass
+
+
+class MessageLengthGuardrail(AbstractGuardrail):
+    """Rejects messages that are longer than max_length characters."""
+    name = "length"
+
+    def __init__(self, max_length : int = 500):
+        self.max_length = max_length
+
+    async def check(self, chat_twin, message : str) -> str | None:
+        if(len(message) > self.max_length):
+            return "Message is too long. If you want to know more about me, please give me your email and optionally a phone number. "
+        return None
+
+
+class CallQuotaGuardrail(AbstractGuardrail):
+    """Rejects messages once the session has used up its quota of LLM calls."""
+    name = "call_quota"
+
+    def __init__(self, max_calls : int = 100):
+        self.max_calls = max_calls
+
+    async def check(self, chat_twin, message : str) -> str | None:
+        if(chat_twin.num_calls > self.max_calls):
+            return "I know you would like to know more about me. Please give me your email and optionally a phone number and I will get in touch with you"
+        return None
+
+
+class InfoTagInjectionGuardrail(AbstractGuardrail):
+    """
+    Rejects messages that contain the <info> tags the system prompt uses to mark the profile.
+    A user could otherwise smuggle in made up profile details that the LLM would treat as facts.
+    """
+    name = "info_tag_injection"
+    INFO_TAG_PATTERN = re.compile(r"<\s*/?\s*info\s*>", re.IGNORECASE)
+
+    async def check(self, chat_twin, message : str) -> str | None:
+        if(self.INFO_TAG_PATTERN.search(message)):
+            return "Please ask your question without any markup tags."
+        return None
+
+
+class BlocklistGuardrail(AbstractGuardrail):
+    """
+    Rejects messages that match any of a list of regular expressions or keywords.
+    """
+    name = "blocklist"
+    DEFAULT_PATTERNS = [
+        r"\bignore\s+(all\s+)?(the\s+)?(previous|prior|above)\s+instructions\b",
+        r"\b(reveal|show|print|repeat)\s+(me\s+)?(your|the)\s+(system\s+)?(prompt|instructions)\b",
+        r"\byou\s+are\s+now\s+(in\s+)?(developer|dan|jailbreak)\b",
+    ]
+
+    def __init__(self, patterns : List[str] | None = None, blocklist_file : str | None = None):
+        """
+        Initializes the BlocklistGuardrail.
+
+        Args:
+            patterns: Regular expressions to block. Defaults to common prompt injection phrases.
+            blocklist_file: An optional file with one regular expression or keyword per line. Lines starting with # are ignored.
+        """
+        patterns = list(self.DEFAULT_PATTERNS if patterns is None else patterns)
+        if blocklist_file is not None:
+            with open(blocklist_file, "r", encoding="utf-8") as f:
+                patterns.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        # One combined expression so a message is scanned once no matter how long the list is.
+        self._pattern = re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE) if patterns else None
+
+    async def check(self, chat_twin, message : str) -> str | None:
+        if(self._pattern is not None and self._pattern.search(message)):
+            return "I am not able to help with that request."
+        return None
+
+
+class ModerationGuardrail(AbstractGuardrail):
+    """Rejects messages that the OpenAI moderation API flags as harmful."""
+    name = "moderation"
+    cost = GuardrailCost.REMOTE
+
+    async def check(self, chat_twin, message : str) -> str | None:
+        try:
+            await chat_twin.afilterMessageForHarmfulness(message)
+        except ValueError as e:
+            logger.warning(f"Harmful or abusive content detected in message: {e}")
+            return "Harmful or abusive content detected in message."
+        return None
+
+
+class GuardrailPipeline:
+    """
+    Runs an ordered list of guardrails on a user message and stops at the first one that fails.
+
+    The guardrails are run in order of their cost and, for the same cost, in the order they were given, so a message
+    that fails a cheap local check never reaches the moderation endpoint. The time spent in each stage is returned in
+    the report and accumulated in stats.
+    """
+
+    def __init__(self, guardrails : List[AbstractGuardrail]):
+        # sorted is stable so guardrails of the same cost keep their configured order.
+        self.guardrails = sorted(guardrails, key=lambda guardrail: guardrail.cost)
+        self._stats_lock = Lock()
+        self._stats = {guardrail.name: {"runs": 0, "failures": 0, "total_ms": 0.0} for guardrail in self.guardrails}
+
+    async def run(self, chat_twin, message : str, min_cost : GuardrailCost | None = None, max_cost : GuardrailCost | None = None) -> GuardrailReport:
+        """
+        Runs the guardrails whose cost is between min_cost and max_cost (inclusive) on the message.
+
+        Returns:
+            A GuardrailReport for the message.
+        """
+        timings : dict = {}
+        for guardrail in self.guardrails:
+            if(min_cost is not None and guardrail.cost < min_cost) or (max_cost is not None and guardrail.cost > max_cost):
+                continue
+            start = time.perf_counter()
+            err_message = await guardrail.check(chat_twin, message)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            timings[guardrail.name] = elapsed_ms
+            self._record(guardrail.name, elapsed_ms, err_message is not None)
+            if err_message is not None:
+                logger.info(f"Message stopped by the {guardrail.name} guardrail after {elapsed_ms:.1f} ms. Timings: {timings}")
+                return GuardrailReport(False, err_message, guardrail.name, timings)
+        logger.debug(f"Guardrail timings: {timings}")
+        return GuardrailReport(True, None, None, timings)
+
+    async def enforce(self, chat_twin, message : str, min_cost : GuardrailCost | None = None, max_cost : GuardrailCost | None = None):
+        """
+        Same as run but raises a GuardrailError if the message fails, so that it can be used as a speculative check.
+        """
+        report = await self.run(chat_twin, message, min_cost=min_cost, max_cost=max_cost)
+        if not report.passed:
+            raise GuardrailError(report.failed_stage, report.err_message)
+
+    def _record(self, name : str, elapsed_ms : float, failed : bool):
+        with self._stats_lock:
+            stage = self._stats[name]
+            stage["runs"] += 1
+            stage["total_ms"] += elapsed_ms
+            if failed:
+                stage["failures"] += 1
+
+    def stats(self) -> dict:
+        """
+        Returns, per stage, the number of runs and failures and the average time in milliseconds.
+        """
+        with self._stats_lock:
+            return {name: {"runs": stage["runs"],
+                           "failures": stage["failures"],
+                           "avg_ms": stage["total_ms"] / stage["runs"] if stage["runs"] else 0.0}
+                    for name, stage in self._stats.items()}
+
+
+def default_guardrail_pipeline() -> GuardrailPipeline:
+    """
+    Builds the pipeline used by the chat UI. A blocklist file can be added with the GUARDRAIL_BLOCKLIST_FILE
+    environment variable.
+    """
+    return GuardrailPipeline([
+        MessageLengthGuardrail(max_length=int(os.getenv("GUARDRAIL_MAX_MESSAGE_LENGTH", "500"))),
+        CallQuotaGuardrail(max_calls=int(os.getenv("GUARDRAIL_MAX_CALLS", "100"))),
+        InfoTagInjectionGuardrail(),
+        BlocklistGuardrail(blocklist_file=os.getenv("GUARDRAIL_BLOCKLIST_FILE")),
+        ModerationGuardrail(),
+    ])
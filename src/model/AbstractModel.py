@@ -1,21 +1,31 @@
 from abc import ABC, abstractmethod
-from dotenv import load_dotenv
 from openai.types.chat import ChatCompletionMessage
+from model.ClientRegistry import load_environment, get_client_registry
+from model.HistoryManager import HistoryManager
+from model.MessageStore import ConversationStore, ToolCallRecord
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+class HarmfulContentError(ValueError):
+    """
+    Raised when the moderation API flags a message as harmful.
+    """
+    pass
+
 class AbstractChatClient(ABC):
     def __init__(self, model_name, model_key, model_role_type = "You are an assistant"):
-        load_dotenv()
+        load_environment()
         self.model_name = model_name
         self.model_key = model_key
-        self.messages = []
+        self.messages = ConversationStore()
         self.model_role_type = model_role_type
         self.SYSTEM_ROLE = "system"
         self.USER_ROLE = "user"
         self.ASSISTANT_ROLE = "assistant"
         self.TOOL_ROLE = "tool"
+        self.history_manager = HistoryManager(model_name, token_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", "8000")))
         self.add_message(self.SYSTEM_ROLE, model_role_type)
 
     @abstractmethod
@@ -26,45 +36,63 @@ class AbstractChatClient(ABC):
     def chat(self, prompt, temperature = 0, max_tokens = 500, model = None) -> str:
         pass
 
+    @abstractmethod
+    async def achat(self, prompt, temperature = 0, max_tokens = 500, model = None) -> str:
+        """
+        Asynchronous version of chat. Awaiting the LLM instead of blocking on it lets a single
+        process serve many conversations without holding a thread per user.
+        """
+        pass
+
     # convenience method to create role type tool and add it to the message history
+    # only the id, name and arguments of the tool calls are kept from the assistant message
     def add_tool_message(self, assistant_msg : ChatCompletionMessage, content : str):
-        self.messages.append(assistant_msg.model_dump())
+        tool_calls = None
         if(assistant_msg.tool_calls is not None and len(assistant_msg.tool_calls) > 0):
-            self.messages.append(
-                {"role": self.TOOL_ROLE,
-                "tool_call_id": assistant_msg.tool_calls[0].id,
-                "content": content
-                }
-            )
+            tool_calls = tuple(ToolCallRecord(tool_call.id, tool_call.function.name, tool_call.function.arguments)
+                               for tool_call in assistant_msg.tool_calls)
+        self.messages.add(self.ASSISTANT_ROLE, assistant_msg.content, tool_calls=tool_calls)
+        if(tool_calls is not None):
+            self.messages.add(self.TOOL_ROLE, content, tool_call_id=tool_calls[0].id)
     # convenience method to add text to message history
     def add_message(self, role, content):
         # if(role == self.USER_ROLE):
         #     self.filterMessageForHarmfulness(content)
-        self.messages.append({"role": role, "content": content})
+        self.messages.add(role, content)
 
     def clear_messages(self):
-        self.messages = []
+        self.messages.clear()
+
+    # returns a marker of the current end of the message history that can be passed to rollback
+    def checkpoint(self) -> int:
+        return len(self.messages)
 
-    # convenience method to get all messages
+    # removes every message added after the checkpoint was taken
+    def rollback(self, checkpoint : int):
+        self.messages.truncate(checkpoint)
+
+    # convenience method to get all messages in the format the API expects
     def get_messages(self):
-        return self.messages
+        return self.messages.to_wire()
+
+    # the messages to send with a request, windowed to the history token budget
+    def get_request_messages(self):
+        if self.history_manager is None:
+            return self.get_messages()
+        return self.messages.to_wire(self.history_manager.window(self.messages))
     
     # convenience method to get the last message of a specific role
     def get_last_message(self, role = None) -> str:
         if(role is None):
             role = self.SYSTEM_ROLE
-        last_message = ""
-        if self.messages:
-            for message in reversed(self.messages):
-                if(isinstance(message, dict)):
-                    if message['role'] == role:
-                        last_message = message["content"]
-                        break
-        return last_message
+        last_message = self.messages.last(role)
+        if last_message is None or last_message.content is None:
+            return ""
+        return last_message.content
     # print all messages
     def print_messages(self):
         for message in self.messages:
-            logger.info(f"{message['role']}: {message['content']}")
+            logger.info(f"{message.role}: {message.content}")
 
     # print the last message that was recieved from the LLM 
     def print_last_message(self, role = "system"):
@@ -82,18 +110,36 @@ class AbstractChatClient(ABC):
             message: The message to filter.
 
         Raises:
-            ValueError: If harmful content is detected in the message.
+            HarmfulContentError: If harmful content is detected in the message.
+            ValueError: If the OpenAI API key is not set.
         """
-        import openai as client
-        import os
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable not set.")
-        client.api_key = api_key        
-        response = client.moderations.create(
+        response = get_client_registry().openai_client().moderations.create(
             model="omni-moderation-latest",
             input=message,
         )
+        self.raise_if_flagged(response)
+
+    async def afilterMessageForHarmfulness(self, message : str):
+        """
+        Asynchronous version of filterMessageForHarmfulness.
+
+        Args:
+            message: The message to filter.
+
+        Raises:
+            HarmfulContentError: If harmful content is detected in the message.
+            ValueError: If the OpenAI API key is not set.
+        """
+        response = await get_client_registry().async_openai_client().moderations.create(
+            model="omni-moderation-latest",
+            input=message,
+        )
+        self.raise_if_flagged(response)
+
+    def raise_if_flagged(self, response):
+        """
+        Raises a HarmfulContentError if any of the moderation results in the response was flagged.
+        """
         flagged : bool = False
 
         output = response.results
@@ -105,9 +151,4 @@ class AbstractChatClient(ABC):
                     if(flagged == False):
                         flagged = True
         if(flagged):
-            raise ValueError("Harmful content detected in message.")
-    
-
-
-
-    
\ No newline at end of file
+            raise HarmfulContentError("Harmful content detected in message.")
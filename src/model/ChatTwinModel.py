@@ -1,25 +1,66 @@
 from model.AbstractModel import AbstractChatClient
-from externalservices.Pushover import PushOver
-from instructor import Instructor, from_litellm
+from externalservices.NotificationOutbox import get_notification_outbox
+from instructor import Instructor, AsyncInstructor
 from functools import singledispatchmethod
-from litellm import completion
+from model.ClientRegistry import get_client_registry, load_environment
 from externalservices.Weather import WeatherService
-from typing import List
+from model.SemanticCache import SemanticResponseCache
+from model.ConversationSummarizer import ConversationSummarizer
+from model.PromptCacheStats import PromptCacheStats, get_prompt_cache_tracker
+from typing import List, Iterator, AsyncIterator, NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from decorators.AutoLog import log_vo
+import asyncio
 import logging
+import os
+import uuid
 # from pydantic import BaseModel, Field
-from vo.Models import GeneralChat, Weather, Contact, Choices
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageFunctionToolCall
+from openai.types.chat.chat_completion_message_function_tool_call import Function
+from vo.Models import GeneralChat, Weather, Contact, Choices, ChoicesStream
 import traceback
 
 logger = logging.getLogger(__name__)
-    
+
+# Shared by all sessions so that the number of concurrent outbound tool calls stays bounded.
+_tool_call_executor : ThreadPoolExecutor | None = None
+_tool_call_executor_lock = Lock()
+
+def get_tool_call_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool the tool calls of a turn run on. It is created on first use, after the .env file has been
+    loaded, with TOOL_CALL_MAX_WORKERS threads.
+    """
+    global _tool_call_executor
+    if _tool_call_executor is None:
+        with _tool_call_executor_lock:
+            if _tool_call_executor is None:
+                load_environment()
+                _tool_call_executor = ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_CALL_MAX_WORKERS", "8")), thread_name_prefix="tool-call")
+    return _tool_call_executor
+
+ERROR_RESPONSE = """This is embarrasing. I am an AI assistant who ever so often start hallucinating or stop following instruction.\
+              I try my best not to do that but you caught me red handed. I have lost my marbles.\
+              Can you please refresh and try again? If I still fail you can you please come back later?"""
+
+class ToolCallResult(NamedTuple):
+    """
+    The outcome of a single tool handler.
+    role is the role the content is added to the history with, content is None when there is nothing to add
+    and call_back tells whether the LLM must be called again for a natural language response.
+    """
+    role : str
+    content : str | None
+    call_back : bool = True
+
 class ChatTwin(AbstractChatClient):
     """
     An AI model that can cache responses and interact with a weather API.
     It inherits from AbstractChatClient and uses the litellm library to communicate with different chat models.
     The model uses the `instructor` library to process tool calls from the LLM and dispatch them to the appropriate methods.
     """
-    def __init__(self, model_name="gpt-4o-mini-2024-07-18", model_key="", model_role_type="You are an assistant"):
+    def __init__(self, model_name="gpt-4o-mini-2024-07-18", model_key="", model_role_type="You are an assistant", semantic_cache : SemanticResponseCache | None = None):
         """
         Initializes the CachingAIModel.
 
@@ -27,86 +68,146 @@ class ChatTwin(AbstractChatClient):
             model_name (str, optional): The name of the language model to use. Defaults to "openai/gpt-5-nano-2025-08-07".
             model_key (str, optional): The API key for the language model. Defaults to "".
             model_role_type (str, optional): The role of the model in the chat. Defaults to "You are an assistant".
+            semantic_cache (SemanticResponseCache, optional): A cache of answers shared across sessions. It is only used for the
+                first turn of a session, whose answer does not depend on the conversation. Defaults to None, which disables caching.
         """
         super().__init__(model_name, model_key, model_role_type=model_role_type)
+        self.semantic_cache = semantic_cache
+        self.prompt_fingerprint = SemanticResponseCache.fingerprint(model_role_type, model_name)
         self.client : Instructor
+        self.aclient : AsyncInstructor
         self.initialize_client()
         self.num_calls = 0
+        self.summarizer : ConversationSummarizer | None = None
+        if os.getenv("SUMMARY_ENABLED", "true").lower() == "true":
+            self.summarizer = ConversationSummarizer(self)
+        # The provider's prompt cache is measured per session as well as for the whole deployment.
+        self.session_id = uuid.uuid4().hex
+        self.prompt_cache_stats = PromptCacheStats()
+        get_prompt_cache_tracker().register(self.session_id, self.prompt_cache_stats)
 
 
     def initialize_client(self):
         """
-        Initializes the instructor client using litellm.
+        Initializes the instructor clients using litellm.
         This allows the model to respond with Pydantic models for tool calls.
+        The async client backs achat and achat_stream.
+        The clients are shared by all sessions, see ClientRegistry.
         """
-        self.client = from_litellm(completion)
+        self.client = get_client_registry().instructor_client()
+        self.aclient = get_client_registry().async_instructor_client()
 
     @singledispatchmethod    
-    def process_llm_tool_call(self, bm, completion) -> bool:
+    def process_llm_tool_call(self, bm) -> ToolCallResult:
         """
         Default method for processing LLM tool calls.
         This method is called when no specific tool call is matched.
+
+        The handlers only do the work for the tool and return its result. They do not touch the message history
+        because several of them can run at the same time, see dispatch_choices.
         """
-        self.add_tool_message(completion.choices[0].message, "I cannot find the information for this request. Please try again.")
-        return True
+        return ToolCallResult(self.TOOL_ROLE, "I cannot find the information for this request. Please try again.")
 
     @process_llm_tool_call.register(GeneralChat)
     @log_vo
-    def _(self, general_chat, completion) -> bool:
+    def _(self, general_chat) -> ToolCallResult:
         """
         Processes a general chat message from the LLM.
         """
-        content = general_chat.message
-        super().add_message(self.ASSISTANT_ROLE, content)
-        return False
+        return ToolCallResult(self.ASSISTANT_ROLE, general_chat.message, call_back=False)
 
 
     @process_llm_tool_call.register(Weather)
     @log_vo
-    def _(self, weather, completion) -> bool:
+    def _(self, weather) -> ToolCallResult:
         """
         Processes a weather tool call from the LLM.
         It gets the weather for the specified city and then calls the chat again to get a natural language response.
         """
         # Get the weather report for the specified city. 
         if(weather is None):
-            return True # Some unknown reason LLM returns with an empty object ignore it. This is not consistent behaviour. Consider it a Model vagary.  
+            return ToolCallResult(self.TOOL_ROLE, None) # Some unknown reason LLM returns with an empty object ignore it. This is not consistent behaviour. Consider it a Model vagary.  
         
         if(weather.city is None or weather.city.strip() == ""): 
-            return True # Some unknown reason LLM returns with an empty object ignore it. This is not consistent behaviour. Consider it a Model vagary.  
+            return ToolCallResult(self.TOOL_ROLE, None) # Some unknown reason LLM returns with an empty object ignore it. This is not consistent behaviour. Consider it a Model vagary.  
         else :
             weather_service = WeatherService()
             weather_report = weather_service.get_weather_object(city_name=weather.city)
 
             if(weather_report is not None):
                 # Add messages to the context to guide the model's final response.
-                self.add_tool_message(completion.choices[0].message, f"The weather in {weather_report.city} is {weather_report.temperature} degrees Celsius with {weather_report.humidity}% humidity.")
+                return ToolCallResult(self.TOOL_ROLE, f"The weather in {weather_report.city} is {weather_report.temperature} degrees Celsius with {weather_report.humidity}% humidity.")
                 # Make another call to the model to get a natural language response based on the weather data.
             else:
-                self.add_tool_message(completion.choices[0].message, f"I cannot find the information for {weather.city}")
-        return True
-        # self.chat(callback=True) 
+                return ToolCallResult(self.TOOL_ROLE, f"I cannot find the information for {weather.city}")
 
     @process_llm_tool_call.register(Contact)
     @log_vo
-    def _(self, contact, completion) -> bool:
+    def _(self, contact) -> ToolCallResult:
         """
         Processes a contact tool call from the LLM.
-        It sends a pushover notification and then calls the chat again to get a natural language response.
+        It queues a pushover notification, which is sent in the background, and then calls the chat again to get a natural language response.
         """
         if(contact is None):
-            return True # Some unknown reason LLM returns with an empty object ignore it. This is not consistent behaviour. Consider it a Model vagary.  
+            return ToolCallResult(self.TOOL_ROLE, None) # Some unknown reason LLM returns with an empty object ignore it. This is not consistent behaviour. Consider it a Model vagary.  
         # Add messages to the context to guide the model's final response.
         if(contact.name is None or contact.name.strip() == "" or contact.email is None or contact.email.strip() == ""):
-            return True # Some unknown reason LLM returns with an empty object ignore it. This is not consistent behaviour. Consider it a Model vagary.  
+            return ToolCallResult(self.TOOL_ROLE, None) # Some unknown reason LLM returns with an empty object ignore it. This is not consistent behaviour. Consider it a Model vagary.  
+
+        else:
+            get_notification_outbox().enqueue(f"The person {contact.name} would like to get in touch with you. His or her email is {contact.email} and their phone number is {contact.phone}")
+            return ToolCallResult(self.TOOL_ROLE, "Let the user know you will connect with them shortly and thank the user for their interest.")
+
+
+    def dispatch_choices(self, response : List[Choices], assistant_msg : ChatCompletionMessage) -> bool:
+        """
+        Dispatches every choice returned by the LLM to its tool handler.
+
+        When the LLM asks for more than one tool (e.g. What is the weather in Toronto, Phoenix and Melbourne) the handlers
+        run concurrently on a bounded thread pool, so the turn takes as long as the slowest tool rather than the sum of all
+        of them. Their results are then added to the message history in the order the LLM returned them.
 
+        Args:
+            response (List[Choices]): The choices parsed from the LLM response.
+            assistant_msg (ChatCompletionMessage): The assistant message that carried the tool call.
+
+        Returns:
+            bool: True if at least one choice needs the LLM to be called back for a natural language response.
+        """
+        call_back_LLM : bool = False
+        """
+          This code handles the following
+          1. If it is a tool call but a general chat
+          2. If it is a tool call with multiple entries example What is the weather in Toronto, Phoenix and Melbourne
+          3. If it is a multiple tool call (e.g. weather in Toronto and contact me)
+          Note that if it is a General Chat we don't have to call the LLM back but any other type we will have to call the LLM back
+          to get a natural language response.
+        """ 
+        """
+            The self.process_llm_tool_call is decorated with @singledispatchmethod. This is an elegant way 
+            to let the python interpretor decide at runtime which of the appropriate methods it needs to call.
+            We avoid any if else logic and if we need to add a new tool, we just add a new method. This logic
+            will never have to change. This is Python's solution to OOP's to handle overloaded method. 
+            A more elegant way would be to use DuckTyping but singledispatchmethod is more explicit and for our
+            current simplistic need we will encapsulate it in this class. 
+        """
+        bms = [choices.choice for choices in response]
+        if(len(bms) > 1):
+            # map returns the results in the order of the choices no matter which tool finishes first.
+            results = list(get_tool_call_executor().map(self.process_llm_tool_call, bms))
         else:
-            PushOver().send_message(f"The person {contact.name} would like to get in touch with you. His or her email is {contact.email} and their phone number is {contact.phone}")
-            self.add_tool_message(completion.choices[0].message, "Let the user know you will connect with them shortly and thank the user for their interest.")
-        # # Make another call to the model to get a natural language response based on the weather data.
-        # self.chat(callback=True) 
-        return True
+            results = [self.process_llm_tool_call(bm) for bm in bms]
 
+        """Process the entire response before calling the LLM again."""
+        for result in results:
+            if(result.content is not None):
+                if(result.role == self.ASSISTANT_ROLE):
+                    self.add_message(self.ASSISTANT_ROLE, result.content)
+                else:
+                    self.add_tool_message(assistant_msg, result.content)
+            if(call_back_LLM == False and result.call_back == True):
+                call_back_LLM = True
+        return call_back_LLM
 
     def chat(self, prompt=None, temperature=0, max_tokens=500, model=None, print_messages = True) -> str:
         """
@@ -123,6 +224,7 @@ class ChatTwin(AbstractChatClient):
         Returns:
             str: The LLM's response.
         """
+        self.before_turn()
         response : List
         # Allow the user to change the model for a specific chat, but maintain the conversation history.
         if(prompt is not None):
@@ -130,38 +232,25 @@ class ChatTwin(AbstractChatClient):
         if model is None:
             model = self.model_name
         try:             
+            cached_response, prompt_vector = self.lookup_cached_response(prompt)
+            if cached_response is not None:
+                self.commit_cached_response(cached_response)
+                return cached_response
             # If this is not a callback, it's a new user message.
             # The 'response_model' parameter tells the instructor client to parse the response into the 'Choices' Pydantic model.
+            # Every chat path asks for the same ChoicesStream so that the tool schema, which comes before the bio in the
+            # prompt, is identical on every first call and the provider can serve the prefix from its prompt cache.
             response, completion = self.client.chat.create_with_completion(
                 model=model,
-                messages=self.get_messages(),
-                response_model=List[Choices])
+                messages=self.get_request_messages(),
+                response_model=ChoicesStream,
+                **self.request_options())
             
-            call_back_LLM : bool = False
-            """
-              This code handles the following
-              1. If it is a tool call but a general chat
-              2. If it is a tool call with multiple entries example What is the weather in Toronto, Phoenix and Melbourne
-              3. If it is a multiple tool call (e.g. weather in Toronto and contact me)
-              Note that if it is a General Chat we don't have to call the LLM back but any other type we will have to call the LLM back
-              to get a natural language response.
-            """ 
-
-            for choices in response:
-                """
-                    The self.process_llm_tool_call is decorated with @singledispatchmethod. This is an elegant way 
-                    to let the python interpretor decide at runtime which of the appropriate methods it needs to call.
-                    We avoid any if else logic and if we need to add a new tool, we just add a new method. This logic
-                    will never have to change. This is Python's solution to OOP's to handle overloaded method. 
-                    A more elegant way would be to use DuckTyping but singledispatchmethod is more explicit and for our
-                    current simplistic need we will encapsulate it in this class. 
-                """
-                should_call_back =self.process_llm_tool_call(choices.choice, completion)
-                """Process the entire response before calling the LLM again."""
-                if(call_back_LLM == False and should_call_back == True):
-                    call_back_LLM = True                     
+            call_back_LLM = self.dispatch_choices(response.choices, completion.choices[0].message)
+            if(not call_back_LLM):
+                self.store_cached_response(prompt, prompt_vector)
             if(call_back_LLM):
-                chat_response = self.client.chat.completions.create(model=model, messages=self.get_messages(), response_model=GeneralChat)
+                chat_response = self.client.chat.completions.create(model=model, messages=self.get_request_messages(), response_model=GeneralChat, **self.request_options())
                 """ 
                 Can only be a GeneralChat but we will type check it to make sure it is that and not another type that the Instructor or 
                 the LLM thought it would be.
@@ -169,9 +258,359 @@ class ChatTwin(AbstractChatClient):
                 if isinstance(chat_response, GeneralChat):
                     self.add_message(self.ASSISTANT_ROLE, chat_response.message)
             self.num_calls += 1
+            self.after_turn()
         except Exception as e:
             logger.error(f"An error occurred: {e}", exc_info=True)
-            return """This is embarrasing. I am an AI assistant who ever so often start hallucinating or stop following instruction.\
-              I try my best not to do that but you caught me red handed. I have lost my marbles.\
-              Can you please refresh and try again? If I still fail you can you please come back later?"""
+            return ERROR_RESPONSE
+        return self.get_last_message(role=self.ASSISTANT_ROLE)
+
+    def chat_stream(self, prompt=None, temperature=0, max_tokens=500, model=None) -> Iterator[str]:
+        """
+        Streaming variant of chat. It yields the LLM's response as the tokens arrive instead of waiting for the whole response.
+
+        Each value yielded is the full text received so far and not just the latest token, which is what Gradio expects
+        from a generator. Tool calls (Weather, Contact) are dispatched only once the structured part of the response has
+        finished streaming, after which the natural language response from the call back to the LLM is streamed.
+
+        Args:
+            prompt (str, optional): The user's message. Defaults to None.
+            temperature (int, optional): The temperature for the LLM. Defaults to 0.
+            max_tokens (int, optional): The maximum number of tokens for the LLM to generate. Defaults to 500.
+            model (str, optional): The name of the language model to use. Defaults to None.
+
+        Yields:
+            str: The LLM's response received so far.
+        """
+        self.before_turn()
+        if(prompt is not None):
+            self.add_message(self.USER_ROLE, prompt)
+        if model is None:
+            model = self.model_name
+        try:
+            cached_response, prompt_vector = self.lookup_cached_response(prompt)
+            if cached_response is not None:
+                self.commit_cached_response(cached_response)
+                yield cached_response
+                return
+            partial_response = None
+            # create_partial yields a partially populated ChoicesStream every time a token is parsed.
+            for partial_response in self.client.chat.completions.create_partial(
+                    model=model,
+                    messages=self.get_request_messages(),
+                    response_model=ChoicesStream,
+                    **self.request_options(stream=True)):
+                partial_text = self.get_partial_text(partial_response)
+                if partial_text:
+                    yield partial_text
+            if partial_response is None:
+                raise ValueError("The LLM returned an empty stream.")
+
+            # The partial objects are not the vo classes singledispatch knows about, so validate the final one into them.
+            response = ChoicesStream.model_validate(partial_response.model_dump())
+            call_back_LLM = self.dispatch_choices(response.choices, self.build_tool_call_message(response))
+            if(not call_back_LLM):
+                self.store_cached_response(prompt, prompt_vector)
+            if(call_back_LLM):
+                partial_chat = None
+                for partial_chat in self.client.chat.completions.create_partial(
+                        model=model,
+                        messages=self.get_request_messages(),
+                        response_model=GeneralChat,
+                    **self.request_options(stream=True)):
+                    if partial_chat.message:
+                        yield partial_chat.message
+                if partial_chat is not None and partial_chat.message:
+                    self.add_message(self.ASSISTANT_ROLE, partial_chat.message)
+            self.num_calls += 1
+            self.after_turn()
+        except Exception as e:
+            logger.error(f"An error occurred: {e}", exc_info=True)
+            yield ERROR_RESPONSE
+
+    async def achat(self, prompt=None, temperature=0, max_tokens=500, model=None, print_messages = True, moderation : asyncio.Future | None = None) -> str:
+        """
+        Asynchronous version of chat. The LLM calls are awaited on the event loop so that a single process can
+        serve many conversations at once without holding a thread per user.
+
+        Args:
+            prompt (str, optional): The user's message. Defaults to None.
+            temperature (int, optional): The temperature for the LLM. Defaults to 0.
+            max_tokens (int, optional): The maximum number of tokens for the LLM to generate. Defaults to 500.
+            model (str, optional): The name of the language model to use. Defaults to None.
+            print_messages (bool, optional): Whether to print the messages. Defaults to True.
+            moderation (asyncio.Future, optional): A moderation check of the prompt that is running speculatively alongside
+                the LLM call. The response is only committed once it passes. Defaults to None.
+
+        Returns:
+            str: The LLM's response.
+
+        Raises:
+            Exception: Whatever the moderation raised, after the turn has been rolled back. A turn that fails for any
+                other reason is rolled back as well and ERROR_RESPONSE is returned.
+        """
+        self.before_turn()
+        checkpoint = self.checkpoint()
+        num_calls = self.num_calls
+        if(prompt is not None):
+            self.add_message(self.USER_ROLE, prompt)
+        if model is None:
+            model = self.model_name
+        try:
+            cached_response, prompt_vector = await self.alookup_cached_response(prompt)
+            if cached_response is not None:
+                await self.await_moderation(moderation)
+                self.commit_cached_response(cached_response)
+                return cached_response
+            response, completion = await self.aclient.chat.create_with_completion(
+                model=model,
+                messages=self.get_request_messages(),
+                response_model=ChoicesStream,
+                **self.request_options())
+            # Tools have side effects (e.g. notifications) so they only run once the moderation has passed.
+            await self.await_moderation(moderation)
+            # The tool handlers make blocking HTTP calls so they are run off the event loop.
+            call_back_LLM = await asyncio.to_thread(self.dispatch_choices, response.choices, completion.choices[0].message)
+            if(not call_back_LLM):
+                self.store_cached_response(prompt, prompt_vector)
+            if(call_back_LLM):
+                chat_response = await self.aclient.chat.completions.create(model=model, messages=self.get_request_messages(), response_model=GeneralChat, **self.request_options())
+                if isinstance(chat_response, GeneralChat):
+                    self.add_message(self.ASSISTANT_ROLE, chat_response.message)
+            self.num_calls += 1
+            self.after_turn()
+        except Exception as e:
+            # A failed turn never stays in the history, whether or not its prompt was moderated yet.
+            self.rollback_turn(checkpoint, num_calls)
+            moderation_error = await self.settle_moderation(moderation)
+            if(moderation_error is not None):
+                raise moderation_error
+            logger.error(f"An error occurred: {e}", exc_info=True)
+            return ERROR_RESPONSE
         return self.get_last_message(role=self.ASSISTANT_ROLE)
+
+    async def achat_stream(self, prompt=None, temperature=0, max_tokens=500, model=None, moderation : asyncio.Future | None = None) -> AsyncIterator[str]:
+        """
+        Asynchronous version of chat_stream. Yields the LLM's response received so far as the tokens arrive.
+
+        Args:
+            prompt (str, optional): The user's message. Defaults to None.
+            temperature (int, optional): The temperature for the LLM. Defaults to 0.
+            max_tokens (int, optional): The maximum number of tokens for the LLM to generate. Defaults to 500.
+            model (str, optional): The name of the language model to use. Defaults to None.
+            moderation (asyncio.Future, optional): A moderation check of the prompt that is running speculatively alongside
+                the LLM call. Nothing is yielded and no tool is run until it passes. Defaults to None.
+
+        Yields:
+            str: The LLM's response received so far.
+
+        Raises:
+            Exception: Whatever the moderation raised, after the turn has been rolled back. A turn that fails for any
+                other reason is rolled back as well and ERROR_RESPONSE is yielded.
+        """
+        self.before_turn()
+        checkpoint = self.checkpoint()
+        num_calls = self.num_calls
+        if(prompt is not None):
+            self.add_message(self.USER_ROLE, prompt)
+        if model is None:
+            model = self.model_name
+        try:
+            cached_response, prompt_vector = await self.alookup_cached_response(prompt)
+            if cached_response is not None:
+                await self.await_moderation(moderation)
+                self.commit_cached_response(cached_response)
+                yield cached_response
+                return
+            partial_response = None
+            async for partial_response in self.aclient.chat.completions.create_partial(
+                    model=model,
+                    messages=self.get_request_messages(),
+                    response_model=ChoicesStream,
+                    **self.request_options(stream=True)):
+                partial_text = self.get_partial_text(partial_response)
+                if partial_text:
+                    # The tokens wait in the stream until the moderation has passed so that flagged content never reaches the user.
+                    await self.await_moderation(moderation)
+                    yield partial_text
+            if partial_response is None:
+                raise ValueError("The LLM returned an empty stream.")
+
+            response = ChoicesStream.model_validate(partial_response.model_dump())
+            await self.await_moderation(moderation)
+            # The tool handlers make blocking HTTP calls so they are run off the event loop.
+            call_back_LLM = await asyncio.to_thread(self.dispatch_choices, response.choices, self.build_tool_call_message(response))
+            if(not call_back_LLM):
+                self.store_cached_response(prompt, prompt_vector)
+            if(call_back_LLM):
+                partial_chat = None
+                async for partial_chat in self.aclient.chat.completions.create_partial(
+                        model=model,
+                        messages=self.get_request_messages(),
+                        response_model=GeneralChat,
+                    **self.request_options(stream=True)):
+                    if partial_chat.message:
+                        yield partial_chat.message
+                if partial_chat is not None and partial_chat.message:
+                    self.add_message(self.ASSISTANT_ROLE, partial_chat.message)
+            self.num_calls += 1
+            self.after_turn()
+        except Exception as e:
+            # A failed turn never stays in the history, whether or not its prompt was moderated yet.
+            self.rollback_turn(checkpoint, num_calls)
+            moderation_error = await self.settle_moderation(moderation)
+            if(moderation_error is not None):
+                raise moderation_error
+            logger.error(f"An error occurred: {e}", exc_info=True)
+            yield ERROR_RESPONSE
+
+    async def await_moderation(self, moderation : asyncio.Future | None):
+        """
+        Waits for a speculative moderation check to finish. Raises whatever the check raised if it did not pass.
+        Awaiting a finished check again returns (or raises) straight away.
+        """
+        if moderation is not None:
+            await moderation
+
+    async def settle_moderation(self, moderation : asyncio.Future | None) -> BaseException | None:
+        """
+        Waits for a speculative moderation check to finish after the turn failed, and returns what it raised, or None if
+        it passed, was cancelled or there was none. This tells a flagged prompt apart from an LLM or tool failure.
+        """
+        if moderation is None:
+            return None
+        if not moderation.done():
+            await asyncio.wait([moderation])
+        if moderation.cancelled():
+            return None
+        return moderation.exception()
+
+    def rollback_turn(self, checkpoint : int, num_calls : int):
+        """
+        Removes everything the current turn added to the message history, as if the user had never sent it.
+        """
+        self.rollback(checkpoint)
+        self.num_calls = num_calls
+
+    def request_options(self, stream : bool = False) -> dict:
+        """
+        Returns the extra litellm arguments sent with every LLM call of this session. The metadata ties the usage of the
+        call to this session for the prompt cache stats, and streamed calls ask for the usage to be included in the stream.
+        """
+        options = {"metadata": get_prompt_cache_tracker().metadata_for(self.session_id)}
+        if stream:
+            options["stream_options"] = {"include_usage": True}
+        return options
+
+    def get_prompt_cache_stats(self) -> dict:
+        """
+        Returns the prompt cache hit ratio of this session and of the whole deployment.
+        """
+        return {
+            "session": self.prompt_cache_stats.stats(),
+            "deployment": get_prompt_cache_tracker().deployment.stats(),
+        }
+
+    def before_turn(self):
+        """
+        Called at the start of every turn. Picks up a conversation summary if one was finished in the background.
+        """
+        if self.summarizer is not None:
+            self.summarizer.apply_pending()
+
+    def after_turn(self):
+        """
+        Called at the end of every successful turn. Starts summarizing the older turns in the background if the history is long.
+        """
+        if self.summarizer is not None:
+            self.summarizer.maybe_schedule()
+
+    def uses_semantic_cache(self, prompt) -> bool:
+        """
+        The cache is shared by every session, so only the first turn, which has no conversation to depend on, is looked up and stored.
+        """
+        return self.semantic_cache is not None and prompt is not None and self.num_calls == 0
+
+    def lookup_cached_response(self, prompt) -> tuple:
+        """
+        Looks the prompt up in the semantic cache if this model has one and this is the first turn. On a hit the caller
+        adds the cached answer to the history with commit_cached_response, once the prompt has passed moderation.
+
+        Returns:
+            tuple: The cached answer (None on a miss) and the prompt's embedding, to be passed to store_cached_response.
+        """
+        if not self.uses_semantic_cache(prompt):
+            return (None, None)
+        try:
+            cached_response, prompt_vector = self.semantic_cache.lookup(prompt, self.prompt_fingerprint)
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed, calling the LLM instead: {e}")
+            return (None, None)
+        return (cached_response, prompt_vector)
+
+    async def alookup_cached_response(self, prompt) -> tuple:
+        """
+        Asynchronous version of lookup_cached_response.
+        """
+        if not self.uses_semantic_cache(prompt):
+            return (None, None)
+        try:
+            cached_response, prompt_vector = await self.semantic_cache.alookup(prompt, self.prompt_fingerprint)
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed, calling the LLM instead: {e}")
+            return (None, None)
+        return (cached_response, prompt_vector)
+
+    def commit_cached_response(self, cached_response : str | None):
+        """
+        Adds a cached answer to the message history and ends the turn as if the LLM had given it.
+        """
+        if cached_response is not None:
+            self.add_message(self.ASSISTANT_ROLE, cached_response)
+            self.num_calls += 1
+            self.after_turn()
+
+    def store_cached_response(self, prompt, prompt_vector):
+        """
+        Stores the last assistant message in the semantic cache. Only called for turns that did not need a tool, and
+        skipped when the answer repeats the visitor's own details.
+        """
+        if self.semantic_cache is None or prompt_vector is None:
+            return
+        answer = self.get_last_message(role=self.ASSISTANT_ROLE)
+        if not SemanticResponseCache.is_shareable(prompt, answer, known_text=self.model_role_type):
+            logger.info("Not caching an answer that repeats details from the prompt.")
+            return
+        self.semantic_cache.store_vector(prompt_vector, self.prompt_fingerprint, answer)
+
+    def get_partial_text(self, partial_response) -> str:
+        """
+        Returns the text of all the general chat messages in a partially streamed ChoicesStream.
+        Tool choices (Weather, Contact) have no message and are skipped.
+
+        Until a choice is complete instructor cannot tell which member of the union it is, so it is left as the dict
+        parsed so far and only becomes a GeneralChat once its message is finished.
+        """
+        messages : List[str] = []
+        for choices in partial_response.choices or []:
+            choice = getattr(choices, "choice", None)
+            if isinstance(choice, dict):
+                message = choice.get("message")
+            else:
+                message = getattr(choice, "message", None)
+            if isinstance(message, str) and message:
+                messages.append(message)
+        return "\n".join(messages)
+
+    def build_tool_call_message(self, response : ChoicesStream) -> ChatCompletionMessage:
+        """
+        Rebuilds the assistant message that carried the tool call for a streamed response.
+        A streamed response has no completion object, but the tool messages added to the history
+        must reference the tool call that the assistant made.
+        """
+        return ChatCompletionMessage(
+            role=self.ASSISTANT_ROLE,
+            content=None,
+            tool_calls=[ChatCompletionMessageFunctionToolCall(
+                id=f"call_{uuid.uuid4().hex}",
+                type="function",
+                function=Function(name=ChoicesStream.__name__, arguments=response.model_dump_json()))])
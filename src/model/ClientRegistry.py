@@ -0,0 +1,129 @@
+import os
+import logging
+from threading import Lock
+from typing import Any, Callable, Hashable, Iterable
+
+import openai
+from dotenv import load_dotenv
+from instructor import Instructor, AsyncInstructor, from_litellm
+from litellm import completion, acompletion, token_counter
+
+logger = logging.getLogger(__name__)
+
+_environment_loaded = False
+_environment_lock = Lock()
+
+def load_environment():
+    """
+    Loads the .env file. Only the first call reads the file; the later ones return straight away.
+    """
+    global _environment_loaded
+    if _environment_loaded:
+        return
+    with _environment_lock:
+        if not _environment_loaded:
+            load_dotenv()
+            _environment_loaded = True
+
+
+class ClientRegistry:
+    """
+    The LLM clients of the process, shared by every chat session.
+
+    A client is created the first time it is asked for and the same instance is returned from then on, so a new
+    session costs no client construction and reuses the connection pools of the sessions before it. The instructor and
+    OpenAI clients are safe to share between threads, and the async ones between the tasks of the event loop.
+    warm_up creates the clients and loads the tokenizers at startup, before the first visitor arrives.
+    """
+
+    def __init__(self):
+        load_environment()
+        self._clients : dict[Hashable, Any] = {}
+        self._lock = Lock()
+
+    def get(self, key : Hashable, factory : Callable[[], Any]) -> Any:
+        """
+        Returns the client registered under the key, creating it with the factory if there is none.
+        """
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = factory()
+                    self._clients[key] = client
+                    logger.info(f"Created the shared {key} client.")
+        return client
+
+    def instructor_client(self) -> Instructor:
+        """The instructor client over litellm's completion. litellm picks the provider from the model name of each call."""
+        return self.get(("instructor", "litellm"), lambda: from_litellm(completion))
+
+    def async_instructor_client(self) -> AsyncInstructor:
+        """The instructor client over litellm's acompletion."""
+        return self.get(("async_instructor", "litellm"), lambda: from_litellm(acompletion))
+
+    def openai_client(self) -> openai.OpenAI:
+        """The OpenAI client, used for the moderation API."""
+        return self.get(("openai", None), lambda: openai.OpenAI(api_key=self._openai_api_key()))
+
+    def async_openai_client(self) -> openai.AsyncOpenAI:
+        """The async OpenAI client, used for the moderation API."""
+        return self.get(("async_openai", None), lambda: openai.AsyncOpenAI(api_key=self._openai_api_key()))
+
+    def openai_compatible_client(self, base_url : str, api_key : str) -> openai.OpenAI:
+        """An OpenAI client for an OpenAI compatible server such as ollama."""
+        return self.get(("openai", base_url), lambda: openai.OpenAI(base_url=base_url, api_key=api_key))
+
+    def async_openai_compatible_client(self, base_url : str, api_key : str) -> openai.AsyncOpenAI:
+        """An async OpenAI client for an OpenAI compatible server such as ollama."""
+        return self.get(("async_openai", base_url), lambda: openai.AsyncOpenAI(base_url=base_url, api_key=api_key))
+
+    def _openai_api_key(self) -> str:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY environment variable not set.")
+        return api_key
+
+    def warm_up(self, model_names : Iterable[str] = (), open_connections : bool = True):
+        """
+        Creates the shared clients and loads the tokenizers of the models so that the first message of the first
+        visitor does not pay for them.
+
+        Args:
+            model_names: The models whose tokenizers are loaded.
+            open_connections: If True, a request is made to the OpenAI API so that the TLS connection of the shared
+                              OpenAI client is open before the first message. Async clients open their connections on
+                              the event loop that first uses them.
+        """
+        self.instructor_client()
+        self.async_instructor_client()
+        for model_name in model_names:
+            try:
+                token_counter(model=model_name, text="warm up")
+            except Exception as e:
+                logger.warning(f"Could not load the tokenizer for {model_name}: {e}")
+        if not os.getenv("OPENAI_API_KEY"):
+            return
+        self.async_openai_client()
+        client = self.openai_client()
+        if open_connections:
+            try:
+                client.models.list()
+            except Exception as e:
+                logger.warning(f"Could not open a connection to the OpenAI API: {e}")
+
+
+_registry : ClientRegistry | None = None
+_registry_lock = Lock()
+
+def get_client_registry() -> ClientRegistry:
+    """
+    Returns the process-wide ClientRegistry.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ClientRegistry()
+    return _registry
@@ -0,0 +1,170 @@
+import os
+import logging
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, NamedTuple
+
+from instructor import Instructor
+
+from vo.Models import ConversationSummary
+from model.MessageStore import MessageRecord
+from model.ClientRegistry import get_client_registry, load_environment
+
+logger = logging.getLogger(__name__)
+
+# Summaries are produced off the request path. The pool is shared by all sessions and kept small because a late
+# summary only means that a few more turns are sent with the next request.
+_summary_executor : ThreadPoolExecutor | None = None
+_summary_executor_lock = Lock()
+
+def get_summary_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool the summaries are written on. It is created on first use, after the .env file has been
+    loaded, with SUMMARY_MAX_WORKERS threads.
+    """
+    global _summary_executor
+    if _summary_executor is None:
+        with _summary_executor_lock:
+            if _summary_executor is None:
+                load_environment()
+                _summary_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SUMMARY_MAX_WORKERS", "2")), thread_name_prefix="summarizer")
+    return _summary_executor
+
+SUMMARY_PROMPT = """You maintain the running summary of a conversation between a user and an assistant.
+Fold the previous summary, if any, and the new messages into a single concise summary of what has been discussed.
+Keep every fact the user gave about themselves (name, email, phone number) and every city they asked about the weather for,
+even if it was mentioned only once. Do not add anything that is not in the conversation."""
+
+
+class PendingSummary(NamedTuple):
+    """A summary that is ready to replace messages[1:fold_end] in the history."""
+    message : MessageRecord
+    fold_end : int
+    boundary : MessageRecord  # the message at fold_end when the summary was scheduled
+
+
+class ConversationSummarizer:
+    """
+    Folds the older part of a long conversation into a compact "conversation so far" message in the background.
+
+    Once the turns after the system prompt pass a token threshold, everything but the most recent turns is sent to a
+    cheap model on a worker thread, which returns a ConversationSummary that keeps the user's name, email, phone and the
+    cities they asked about. The next turn picks the summary up, if it is ready, and puts it in place of the messages
+    it summarizes, right after the system prompt. The turn never waits for the summary.
+    """
+
+    SUMMARY_HEADER = "Conversation so far:"
+
+    def __init__(self,
+                 chat_client,
+                 model_name : str | None = None,
+                 trigger_tokens : int | None = None,
+                 keep_recent_turns : int | None = None):
+        """
+        Initializes the ConversationSummarizer.
+
+        Args:
+            chat_client: The AbstractChatClient whose history is summarized.
+            model_name: The model used to write the summary. Defaults to SUMMARY_MODEL, or gpt-4o-mini.
+            trigger_tokens: The number of tokens after the system prompt at which a summary is started.
+                            Defaults to SUMMARY_TRIGGER_TOKENS, or 3000.
+            keep_recent_turns: The number of recent turns that are left as they are. Defaults to SUMMARY_KEEP_RECENT_TURNS, or 4.
+        """
+        load_environment()
+        self.chat_client = chat_client
+        self.model_name = model_name if model_name is not None else os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+        self.trigger_tokens = trigger_tokens if trigger_tokens is not None else int(os.getenv("SUMMARY_TRIGGER_TOKENS", "3000"))
+        self.keep_recent_turns = keep_recent_turns if keep_recent_turns is not None else int(os.getenv("SUMMARY_KEEP_RECENT_TURNS", "4"))
+        self.client : Instructor = get_client_registry().instructor_client()
+        self._lock = Lock()
+        self._in_flight : Future | None = None
+        self._pending : PendingSummary | None = None
+
+    def apply_pending(self) -> bool:
+        """
+        Replaces the summarized messages with the summary if one is ready. Called at the start of a turn.
+
+        Returns:
+            bool: True if a summary was applied.
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = None
+        if pending is None:
+            return False
+        messages = self.chat_client.messages
+        # The history may have been cleared or rolled back since the summary was scheduled, in which case it is stale.
+        if len(messages) <= pending.fold_end or messages[pending.fold_end] is not pending.boundary:
+            logger.info("Discarding a conversation summary that no longer matches the history.")
+            return False
+        messages.replace(1, pending.fold_end, [pending.message])
+        logger.info(f"Folded {pending.fold_end - 1} messages into the conversation summary.")
+        return True
+
+    def maybe_schedule(self):
+        """
+        Starts summarizing the older turns in the background if the history has passed the threshold.
+        Called at the end of a turn.
+        """
+        with self._lock:
+            if self._in_flight is not None or self._pending is not None:
+                return
+        messages = self.chat_client.messages
+        history_manager = self.chat_client.history_manager
+        if sum(history_manager.count_tokens(message) for message in messages[1:]) < self.trigger_tokens:
+            return
+        turn_starts = [index for index, message in enumerate(messages) if index > 0 and message.role == self.chat_client.USER_ROLE]
+        # At least the latest turn is always kept so that there is a message to check the summary against.
+        keep_recent_turns = max(1, self.keep_recent_turns)
+        if len(turn_starts) <= keep_recent_turns:
+            return
+        fold_end = turn_starts[-keep_recent_turns]
+        if fold_end <= 2:
+            return  # there is nothing but an earlier summary to fold
+        to_summarize = list(messages[1:fold_end])
+        boundary = messages[fold_end]
+        with self._lock:
+            self._in_flight = get_summary_executor().submit(self._summarize, to_summarize, fold_end, boundary)
+
+    def _summarize(self, to_summarize : List[MessageRecord], fold_end : int, boundary : MessageRecord):
+        try:
+            summary : ConversationSummary = self.client.chat.completions.create(
+                model=self.model_name,
+                response_model=ConversationSummary,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": self.to_transcript(to_summarize)},
+                ])
+            message = MessageRecord(self.chat_client.SYSTEM_ROLE, self.to_text(summary))
+            with self._lock:
+                self._pending = PendingSummary(message, fold_end, boundary)
+        except Exception as e:
+            logger.error(f"An error occurred while summarizing the conversation: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._in_flight = None
+
+    def to_transcript(self, messages : List[MessageRecord]) -> str:
+        """
+        Renders the messages as plain text for the summarizing model. Tool calls are left out but their results are kept.
+        """
+        lines : List[str] = []
+        for message in messages:
+            if message.content:
+                lines.append(f"{message.role}: {message.content}")
+        return "\n".join(lines)
+
+    def to_text(self, summary : ConversationSummary) -> str:
+        """
+        Renders a ConversationSummary as the content of the summary message.
+        """
+        lines = [f"{self.SUMMARY_HEADER} {summary.summary}"]
+        if summary.user_name:
+            lines.append(f"User's name: {summary.user_name}")
+        if summary.user_email:
+            lines.append(f"User's email: {summary.user_email}")
+        if summary.user_phone:
+            lines.append(f"User's phone: {summary.user_phone}")
+        if summary.cities_asked_about:
+            lines.append(f"Cities asked about: {', '.join(summary.cities_asked_about)}")
+        return "\n".join(lines)
@@ -0,0 +1,158 @@
+import json
+import logging
+from functools import lru_cache
+from typing import List
+
+from litellm import token_counter
+from model.MessageStore import MessageRecord
+
+logger = logging.getLogger(__name__)
+
+# Every message costs a few tokens on top of its content for the role and the separators.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+@lru_cache(maxsize=8192)
+def _count_text_tokens(model_name : str, text : str) -> int:
+    # The history is resent every turn, so the same texts are counted over and over again.
+    return token_counter(model=model_name, text=text)
+
+
+class HistoryManager:
+    """
+    Keeps the messages sent to the LLM within a token budget.
+
+    The leading system messages (the bio) are always sent. The rest of the history is split into turns, each starting
+    at a user message, and the most recent turns are kept for as long as they fit in the budget. An older turn that does
+    not fit is compressed by dropping its tool exchanges (the assistant message that made the tool call together with
+    its tool messages) and keeping only what the user and the assistant said. Tool exchanges are always kept or dropped
+    as a whole, so a tool message is never sent without the tool call it answers.
+
+    The tokens are counted locally with litellm's tokenizer for the model, so windowing costs no network call.
+    The stored history is not changed; only the list of messages sent with a request is windowed.
+
+    To keep the start of the prompt the same from one turn to the next, which is what the provider's prompt cache
+    matches on, the window does not slide a turn at a time. When the history goes over the budget the window is cut back
+    to the low water mark, and that cut is then kept, with new turns appended, until the budget is exceeded again.
+    """
+
+    def __init__(self, model_name : str, token_budget : int = 8000, low_water_ratio : float = 0.6):
+        """
+        Initializes the HistoryManager.
+
+        Args:
+            model_name: The model whose tokenizer is used to count the tokens.
+            token_budget: The maximum number of prompt tokens to send. The system messages and the latest turn are
+                          always sent, even if they are over the budget on their own.
+            low_water_ratio: The share of the budget the window is cut back to once it is exceeded.
+        """
+        self.model_name = model_name
+        self.token_budget = token_budget
+        self.low_water_ratio = low_water_ratio
+        # The current cut: for each kept turn, its first message and whether it was compressed.
+        self._plan : List[tuple[MessageRecord, bool]] = []
+
+    def count_tokens(self, message : MessageRecord) -> int:
+        """
+        Returns the number of tokens a message takes in the prompt. The count is kept on the message.
+        """
+        if message.token_count is None:
+            text = message.content or ""
+            if message.tool_calls:
+                text += json.dumps([tool_call.to_wire() for tool_call in message.tool_calls])
+            message.token_count = _count_text_tokens(self.model_name, text) + MESSAGE_OVERHEAD_TOKENS
+        return message.token_count
+
+    def split_turns(self, messages : List[MessageRecord]) -> tuple[List[MessageRecord], List[List[MessageRecord]]]:
+        """
+        Splits the history into the leading system messages and a list of turns, each starting with a user message.
+        """
+        pinned_count = 0
+        while pinned_count < len(messages) and messages[pinned_count].role == "system":
+            pinned_count += 1
+        turns : List[List[MessageRecord]] = []
+        for message in messages[pinned_count:]:
+            if not turns or message.role == "user":
+                turns.append([])
+            turns[-1].append(message)
+        return (messages[:pinned_count], turns)
+
+    def is_tool_exchange(self, message : MessageRecord) -> bool:
+        return message.role == "tool" or bool(message.tool_calls)
+
+    def compress_turn(self, turn : List[MessageRecord]) -> List[MessageRecord]:
+        """
+        Returns the turn without its tool exchanges.
+        """
+        return [message for message in turn if not self.is_tool_exchange(message)]
+
+    def window(self, messages) -> List[MessageRecord]:
+        """
+        Returns the messages to send to the LLM so that they fit in the token budget.
+
+        Args:
+            messages: The conversation, a ConversationStore or a list of MessageRecord.
+        """
+        pinned, turns = self.split_turns(messages)
+        if not turns:
+            return list(messages)
+        pinned_tokens = sum(self.count_tokens(message) for message in pinned)
+        kept = self._apply_plan(turns)
+        if kept is None or pinned_tokens + self._count_turns(kept) > self.token_budget:
+            kept = self._cut(turns, pinned_tokens)
+        windowed = list(pinned)
+        for turn in kept:
+            windowed.extend(turn)
+        return windowed
+
+    def _count_turns(self, turns : List[List[MessageRecord]]) -> int:
+        return sum(self.count_tokens(message) for turn in turns for message in turn)
+
+    def _apply_plan(self, turns : List[List[MessageRecord]]) -> List[List[MessageRecord]] | None:
+        """
+        Returns the turns kept by the current cut followed by every newer turn, or None if the cut no longer matches
+        the history (e.g. the turns were folded into a summary or rolled back).
+        """
+        if not self._plan:
+            return list(turns) if len(turns) == 1 else None
+        first_messages = [turn[0] for turn in turns]
+        start = next((index for index, message in enumerate(first_messages) if message is self._plan[0][0]), None)
+        if start is None or len(turns) - start < len(self._plan):
+            return None
+        kept : List[List[MessageRecord]] = []
+        for offset, (first_message, compressed) in enumerate(self._plan):
+            turn = turns[start + offset]
+            if turn[0] is not first_message:
+                return None
+            kept.append(self.compress_turn(turn) if compressed else turn)
+        kept.extend(turns[start + len(self._plan):])
+        return kept
+
+    def _cut(self, turns : List[List[MessageRecord]], pinned_tokens : int) -> List[List[MessageRecord]]:
+        """
+        Chooses the newest turns that fit in the low water mark of the budget and remembers the choice.
+        """
+        target = self.token_budget * self.low_water_ratio if self._count_turns(turns) + pinned_tokens > self.token_budget else self.token_budget
+        used = pinned_tokens
+        plan : List[tuple[MessageRecord, bool]] = []
+        kept : List[List[MessageRecord]] = []
+        for index, turn in enumerate(reversed(turns)):
+            turn_tokens = sum(self.count_tokens(message) for message in turn)
+            if index == 0 or used + turn_tokens <= target:
+                kept.append(turn)
+                plan.append((turn[0], False))
+                used += turn_tokens
+                continue
+            compressed = self.compress_turn(turn)
+            compressed_tokens = sum(self.count_tokens(message) for message in compressed)
+            if compressed and compressed[0] is turn[0] and used + compressed_tokens <= target:
+                kept.append(compressed)
+                plan.append((turn[0], True))
+                used += compressed_tokens
+                continue
+            # Stop at the first turn that does not fit so that the history that is sent has no gaps.
+            break
+        logger.debug(f"History windowed to {len(kept)} of {len(turns)} turns ({used} tokens).")
+        kept.reverse()
+        plan.reverse()
+        self._plan = plan
+        return kept
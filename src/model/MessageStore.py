@@ -0,0 +1,176 @@
+import sys
+from typing import Iterable, Iterator, List
+
+
+class ToolCallRecord:
+    """
+    The part of an assistant's tool call that has to be sent back to the LLM: its id, the function name and the arguments.
+    """
+    __slots__ = ("id", "name", "arguments")
+
+    def __init__(self, id : str, name : str, arguments : str):
+        self.id = id
+        self.name = name
+        self.arguments = arguments
+
+    def to_wire(self) -> dict:
+        return {"id": self.id, "type": "function", "function": {"name": self.name, "arguments": self.arguments}}
+
+    @classmethod
+    def from_wire(cls, tool_call : dict) -> "ToolCallRecord":
+        return cls(tool_call["id"], tool_call["function"]["name"], tool_call["function"]["arguments"])
+
+
+class MessageRecord:
+    """
+    A single message in the conversation. Only the fields that are sent back to the LLM are kept.
+    token_count is filled in lazily by the HistoryManager so that a message is tokenized only once.
+
+    The history used to be a list of dictionaries, so a record can also be read like one, e.g. record["role"] or
+    record.get("tool_calls"), with the keys and values of to_wire.
+    """
+    __slots__ = ("role", "content", "tool_calls", "tool_call_id", "token_count")
+
+    def __init__(self, role : str, content : str | None, tool_calls : tuple | None = None, tool_call_id : str | None = None):
+        self.role = role
+        self.content = content
+        self.tool_calls = tool_calls
+        self.tool_call_id = tool_call_id
+        self.token_count : int | None = None
+
+    def to_wire(self) -> dict:
+        """
+        Returns the message in the format the chat completions API expects.
+        """
+        message = {"role": self.role, "content": self.content}
+        if self.tool_calls:
+            message["tool_calls"] = [tool_call.to_wire() for tool_call in self.tool_calls]
+        if self.tool_call_id is not None:
+            message["tool_call_id"] = self.tool_call_id
+        return message
+
+    @classmethod
+    def from_wire(cls, message : dict) -> "MessageRecord":
+        """
+        Builds a record from a message in the format returned by to_wire.
+        """
+        tool_calls = message.get("tool_calls")
+        return cls(message["role"],
+                   message.get("content"),
+                   tuple(ToolCallRecord.from_wire(tool_call) for tool_call in tool_calls) if tool_calls else None,
+                   message.get("tool_call_id"))
+
+    def __getitem__(self, key : str):
+        return self.to_wire()[key]
+
+    def get(self, key : str, default=None):
+        return self.to_wire().get(key, default)
+
+    def keys(self):
+        return self.to_wire().keys()
+
+    def __contains__(self, key) -> bool:
+        return key in self.to_wire()
+
+    def size_in_bytes(self) -> int:
+        """
+        Returns an estimate of the memory held by the record and its text.
+        """
+        size = sys.getsizeof(self) + (sys.getsizeof(self.content) if self.content is not None else 0)
+        if self.tool_calls:
+            size += sum(sys.getsizeof(tool_call) + sys.getsizeof(tool_call.arguments) for tool_call in self.tool_calls)
+        return size
+
+
+class ConversationStore:
+    """
+    The message history of a conversation.
+
+    Messages are kept as compact MessageRecord objects and only converted to the dictionaries the API expects when a
+    request is sent (see to_wire). The index of the last message of every role and the size of the records are
+    maintained as messages are added and removed, so looking up the last assistant message or the memory held by the
+    conversation does not scan the history.
+    """
+
+    def __init__(self):
+        self._records : List[MessageRecord] = []
+        self._last_index : dict[str, int] = {}
+        self._records_size = 0
+
+    def append(self, record : MessageRecord | dict) -> MessageRecord:
+        """
+        Adds a record, or a message in the format returned by to_wire, to the end of the conversation and returns its
+        record.
+        """
+        if isinstance(record, dict):
+            record = MessageRecord.from_wire(record)
+        self._last_index[record.role] = len(self._records)
+        self._records.append(record)
+        self._records_size += record.size_in_bytes()
+        return record
+
+    def add(self, role : str, content : str | None, tool_calls : tuple | None = None, tool_call_id : str | None = None) -> MessageRecord:
+        """Adds a message to the end of the conversation and returns its record."""
+        return self.append(MessageRecord(role, content, tool_calls, tool_call_id))
+
+    def last(self, role : str) -> MessageRecord | None:
+        """Returns the last message of the role, or None if there is none."""
+        index = self._last_index.get(role)
+        return self._records[index] if index is not None else None
+
+    def truncate(self, length : int):
+        """Removes every message after the first length messages."""
+        self._records_size -= sum(record.size_in_bytes() for record in self._records[length:])
+        del self._records[length:]
+        self._rebuild_index()
+
+    def replace(self, start : int, end : int, records : Iterable[MessageRecord]):
+        """Replaces the messages from start up to (but not including) end with the records."""
+        records = list(records)
+        self._records_size += sum(record.size_in_bytes() for record in records) - sum(record.size_in_bytes() for record in self._records[start:end])
+        self._records[start:end] = records
+        self._rebuild_index()
+
+    def clear(self):
+        self._records = []
+        self._last_index = {}
+        self._records_size = 0
+
+    def _rebuild_index(self):
+        self._last_index = {}
+        for index, record in enumerate(self._records):
+            self._last_index[record.role] = index
+
+    def to_wire(self, records : Iterable[MessageRecord] | None = None) -> List[dict]:
+        """
+        Converts the records (by default the whole conversation) to the format the chat completions API expects.
+        """
+        return [record.to_wire() for record in (self._records if records is None else records)]
+
+    @classmethod
+    def from_wire(cls, messages : Iterable[dict]) -> "ConversationStore":
+        """
+        Builds a store from messages in the format returned by to_wire.
+        """
+        store = cls()
+        for message in messages:
+            store.append(MessageRecord.from_wire(message))
+        return store
+
+    def size_in_bytes(self) -> int:
+        """
+        Returns an estimate of the memory held by the conversation. It is kept up to date as messages are added and removed.
+        """
+        return sys.getsizeof(self._records) + self._records_size
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __getitem__(self, index):
+        return self._records[index]
+
+    def __iter__(self) -> Iterator[MessageRecord]:
+        return iter(self._records)
+
+    def __bool__(self) -> bool:
+        return bool(self._records)
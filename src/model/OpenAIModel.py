@@ -1,10 +1,9 @@
-import os
-import openai as client
 import logging
 
 logger = logging.getLogger(__name__)
 
 from AbstractModel import AbstractChatClient
+from model.ClientRegistry import get_client_registry
 
 class OpenAIModel(AbstractChatClient):
     def __init__(self, model_name="gpt-3.5-turbo", model_key="", model_role_type="You are an assistant"):
@@ -13,18 +12,37 @@ class OpenAIModel(AbstractChatClient):
 
     def initialize_client(self):
         """
-        Initializes the OpenAI client.
+        Initializes the OpenAI clients. They are shared by all sessions instead of configuring the global openai module.
         """
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable not set.")
-        client.api_key = api_key
+        self.client = get_client_registry().openai_client()
+        self.async_client = get_client_registry().async_openai_client()
 
     def chat(self, prompt, temperature=0, max_tokens=500, model=None, print_messages = True) -> str:
         """
         Gets a completion from the OpenAI API.
         """
-        content : str | None = None
+        request = self._build_request(prompt, temperature, max_tokens, model)
+        try:
+            response = self.client.chat.completions.create(**request)
+        except Exception as e:
+            raise self._request_failed(e)
+        return self._handle_response(response, print_messages)
+
+    async def achat(self, prompt, temperature=0, max_tokens=500, model=None, print_messages = True) -> str:
+        """
+        Asynchronously gets a completion from the OpenAI API.
+        """
+        request = self._build_request(prompt, temperature, max_tokens, model)
+        try:
+            response = await self.async_client.chat.completions.create(**request)
+        except Exception as e:
+            raise self._request_failed(e)
+        return self._handle_response(response, print_messages)
+
+    def _build_request(self, prompt, temperature, max_tokens, model) -> dict:
+        """
+        Adds the prompt to the context and returns the arguments of the completion request shared by chat and achat.
+        """
         """
         user can change model but maintain context from the previous conversation
         """
@@ -34,24 +52,20 @@ class OpenAIModel(AbstractChatClient):
         add the prompt to the context
         """    
         self.add_message(self.USER_ROLE, prompt)
-        response = None
+        """
+        some models don't like temperature so if it is not present don't pass it. At some point need to find a way to
+        remove this dependency on the caller. 
+        """
+        if(temperature==0):
+            return {"model": model, "messages": self.get_request_messages()}
+        return {"model": model, "messages": self.get_request_messages(), "temperature": temperature, "max_tokens": max_tokens}
+
+    def _handle_response(self, response, print_messages) -> str:
+        """
+        Adds the content of the completion to the context and returns it.
+        """
+        content : str | None = None
         try:
-            """
-            some models don't like temperature so if it is not present don't pass it. At some point need to find a way to
-            remove this dependency on the caller. 
-            """
-            if(temperature==0):
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=self.get_messages())
-            else:   
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=self.get_messages(),
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                )
-            
             content = response.choices[0].message.content
             """
             add the response to the context
@@ -60,9 +74,15 @@ class OpenAIModel(AbstractChatClient):
             if(print_messages):
                 logger.info(content)
         except Exception as e:
-            logger.error(f"An error occurred: {e}", exc_info=True)
-            raise e
+            raise self._request_failed(e)
         if (content is None):
             return "An error occurred during the chat. Response is empty"
         else: 
-            return content
\ No newline at end of file
+            return content
+
+    def _request_failed(self, e : Exception) -> Exception:
+        """
+        Logs an error of the completion request and returns it for the caller to raise.
+        """
+        logger.error(f"An error occurred: {e}", exc_info=True)
+        return e
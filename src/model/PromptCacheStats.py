@@ -0,0 +1,106 @@
+import logging
+from threading import Lock
+from weakref import WeakValueDictionary
+
+import litellm
+from litellm.integrations.custom_logger import CustomLogger
+
+logger = logging.getLogger(__name__)
+
+
+class PromptCacheStats:
+    """
+    Counts the prompt tokens sent to the LLM and how many of them the provider served from its prompt cache.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.last_cached_tokens = 0
+
+    def record(self, prompt_tokens : int, cached_tokens : int):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.last_cached_tokens = cached_tokens
+
+    def stats(self) -> dict:
+        """
+        Returns the token counters and the cache hit ratio, the share of prompt tokens that were cached.
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "hit_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            }
+
+
+class PromptCacheTracker(CustomLogger):
+    """
+    A litellm callback that records the cached_tokens reported in the usage of every completion made by a chat session.
+
+    It is a litellm callback rather than code around each call because streamed responses are assembled, usage included,
+    only inside litellm. Calls are attributed to a session through the litellm metadata of the call (see metadata_for),
+    and every call that belongs to a session is also added to the deployment-wide totals.
+    """
+    SESSION_KEY = "chattwin_session_id"
+
+    def __init__(self):
+        super().__init__()
+        self.deployment = PromptCacheStats()
+        self._sessions : WeakValueDictionary = WeakValueDictionary()
+
+    def register(self, session_id : str, stats : PromptCacheStats):
+        """Registers the stats of a session. The session is forgotten once its stats are garbage collected."""
+        self._sessions[session_id] = stats
+
+    def metadata_for(self, session_id : str) -> dict:
+        """Returns the litellm metadata that ties a call to a session."""
+        return {self.SESSION_KEY: session_id}
+
+    def _record(self, kwargs, response_obj):
+        try:
+            metadata = (kwargs.get("litellm_params") or {}).get("metadata") or {}
+            session_id = metadata.get(self.SESSION_KEY)
+            usage = getattr(response_obj, "usage", None)
+            if session_id is None or usage is None:
+                return
+            prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+            logger.debug(f"Session {session_id}: {cached_tokens} of {prompt_tokens} prompt tokens were cached.")
+            self.deployment.record(prompt_tokens, cached_tokens)
+            session_stats = self._sessions.get(session_id)
+            if session_stats is not None:
+                session_stats.record(prompt_tokens, cached_tokens)
+        except Exception as e:
+            # Accounting must never break a chat.
+            logger.warning(f"Could not record prompt cache usage: {e}")
+
+    def log_success_event(self, kwargs, response_obj, start_time, end_time):
+        self._record(kwargs, response_obj)
+
+    async def async_log_success_event(self, kwargs, response_obj, start_time, end_time):
+        self._record(kwargs, response_obj)
+
+
+_tracker : PromptCacheTracker | None = None
+_tracker_lock = Lock()
+
+def get_prompt_cache_tracker() -> PromptCacheTracker:
+    """
+    Returns the process-wide PromptCacheTracker, registering it with litellm on first use.
+    """
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                tracker = PromptCacheTracker()
+                litellm.callbacks.append(tracker)
+                _tracker = tracker
+    return _tracker
@@ -0,0 +1,191 @@
+import re
+import time
+import hashlib
+import logging
+from threading import Lock
+
+import numpy as np
+from litellm import embedding, aembedding
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticResponseCache:
+    """
+    A process-wide cache of LLM answers that is looked up by the meaning of the question rather than its exact text.
+
+    The user prompt is embedded and compared, by cosine similarity, against the prompts of past answers. If the best
+    match is above the similarity threshold its answer is returned and the LLM is not called. Every entry is tagged
+    with a fingerprint of the system prompt and model, so answers given with an older version of the bio are never
+    served; storing an answer under a new fingerprint drops all the entries of the old one.
+
+    The cache is shared by every session, so the caller must only use it for prompts whose answer does not depend on
+    the conversation (ChatTwin only uses it for the first turn of a session) and must only store answers that did not
+    involve a tool call. Answers that repeat the visitor's own details are not stored either (see is_shareable).
+    """
+    WORD_PATTERN = re.compile(r"\w+")
+    SENTENCE_PATTERN = re.compile(r"[.!?]+")
+
+    def __init__(self,
+                 embedding_model : str = "text-embedding-3-small",
+                 similarity_threshold : float = 0.92,
+                 max_entries : int = 1000,
+                 ttl_seconds : float = 24 * 60 * 60):
+        """
+        Initializes the SemanticResponseCache.
+
+        Args:
+            embedding_model: The litellm embedding model used to embed the prompts.
+            similarity_threshold: The cosine similarity above which a cached answer is returned.
+            max_entries: The number of answers to keep. The least recently used one is evicted when the cache is full.
+            ttl_seconds: The number of seconds an answer stays valid.
+        """
+        self.embedding_model = embedding_model
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = Lock()
+        self._vectors : np.ndarray | None = None  # allocated once the embedding dimension is known
+        self._answers : list[str | None] = [None] * max_entries
+        self._fingerprints : list[str | None] = [None] * max_entries
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._active_fingerprint : str | None = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(system_prompt : str, model_name : str) -> str:
+        """
+        Returns a fingerprint of the system prompt and model that produced an answer.
+        """
+        return hashlib.sha256(f"{model_name}\n{system_prompt}".encode("utf-8")).hexdigest()
+
+    def is_cacheable(self, prompt : str | None) -> bool:
+        """
+        Returns False for empty prompts, which are never looked up.
+        """
+        return prompt is not None and prompt.strip() != ""
+
+    @classmethod
+    def is_shareable(cls, prompt : str, answer : str, known_text : str = "") -> bool:
+        """
+        Returns False if the answer repeats a name or a number from the prompt that is not in known_text (the bio).
+        Those are most likely the visitor's own details, e.g. "Nice to meet you Jane", and must not be served to anyone else.
+        """
+        prompt_words = {word.lower() for word in cls.WORD_PATTERN.findall(prompt)}
+        known_words = {word.lower() for word in cls.WORD_PATTERN.findall(known_text)}
+        for sentence in cls.SENTENCE_PATTERN.split(answer):
+            for position, word in enumerate(cls.WORD_PATTERN.findall(sentence)):
+                # Every sentence starts with a capital, so only a later capital marks a name.
+                is_name = position > 0 and len(word) > 1 and word[0].isupper()
+                if not (is_name or any(character.isdigit() for character in word)):
+                    continue
+                if word.lower() in prompt_words and word.lower() not in known_words:
+                    return False
+        return True
+
+    def _normalize(self, vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def embed(self, prompt : str) -> np.ndarray:
+        """Embeds a prompt and returns it as a unit length vector."""
+        response = embedding(model=self.embedding_model, input=[prompt])
+        return self._normalize(response.data[0]["embedding"])
+
+    async def aembed(self, prompt : str) -> np.ndarray:
+        """Asynchronous version of embed."""
+        response = await aembedding(model=self.embedding_model, input=[prompt])
+        return self._normalize(response.data[0]["embedding"])
+
+    def lookup_vector(self, vector : np.ndarray, fingerprint : str) -> str | None:
+        """
+        Returns the cached answer whose prompt is the most similar to the vector, if it is above the threshold.
+        """
+        with self._lock:
+            if self._vectors is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            valid = (self._expires_at > now) & np.array([fp == fingerprint for fp in self._fingerprints])
+            if not valid.any():
+                self.misses += 1
+                return None
+            similarities = np.where(valid, self._vectors @ vector, -1.0)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            self._last_used[best] = now
+            self.hits += 1
+            logger.info(f"Semantic cache hit with similarity {similarities[best]:.3f}")
+            return self._answers[best]
+
+    def store_vector(self, vector : np.ndarray, fingerprint : str, answer : str):
+        """
+        Stores an answer for the prompt embedded as vector, replacing the least recently used entry if the cache is full.
+        """
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            if fingerprint != self._active_fingerprint:
+                # The bio or model changed, so nothing answered with the old one can be served again.
+                self._invalidate_locked()
+                self._active_fingerprint = fingerprint
+            now = time.time()
+            # Expired and empty slots have the oldest last used time, so they are reused first.
+            slot = int(np.argmin(np.where(self._expires_at > now, self._last_used, -1.0)))
+            self._vectors[slot] = vector
+            self._answers[slot] = answer
+            self._fingerprints[slot] = fingerprint
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._last_used[slot] = now
+
+    def lookup(self, prompt : str, fingerprint : str) -> tuple[str | None, np.ndarray | None]:
+        """
+        Looks up the answer for a prompt.
+
+        Returns:
+            A tuple of the cached answer (None on a miss) and the prompt's embedding so that it can be
+            passed to store_vector without embedding the prompt again. Both are None for prompts that are not cacheable.
+        """
+        if not self.is_cacheable(prompt):
+            return (None, None)
+        vector = self.embed(prompt)
+        return (self.lookup_vector(vector, fingerprint), vector)
+
+    async def alookup(self, prompt : str, fingerprint : str) -> tuple[str | None, np.ndarray | None]:
+        """Asynchronous version of lookup."""
+        if not self.is_cacheable(prompt):
+            return (None, None)
+        vector = await self.aembed(prompt)
+        return (self.lookup_vector(vector, fingerprint), vector)
+
+    def _invalidate_locked(self):
+        self._expires_at[:] = 0
+        self._last_used[:] = 0
+        self._answers = [None] * self.max_entries
+        self._fingerprints = [None] * self.max_entries
+
+    def invalidate(self):
+        """
+        Removes all the cached answers.
+        """
+        with self._lock:
+            self._invalidate_locked()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters along with the number of live entries.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": int((self._expires_at > time.time()).sum()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock, Thread, Event
+from typing import Callable, Iterator
+
+from model.AbstractModel import AbstractChatClient
+from model.MessageStore import ConversationStore
+from vo.Models import SessionState
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+
+class LiveSession:
+    """
+    A live session: its chat client, when it was last used, the size of its history when it was last measured and the
+    number of turns it has in flight.
+    """
+    __slots__ = ("chat_client", "last_used", "size_in_bytes", "in_flight")
+
+    def __init__(self, chat_client : AbstractChatClient, last_used : float):
+        self.chat_client = chat_client
+        self.last_used = last_used
+        self.size_in_bytes = 0
+        self.in_flight = 0
+
+
+class SessionManager:
+    """
+    Owns the chat clients of the live browser sessions.
+
+    The Gradio state of a session only holds its id (see create_session); the chat client, with its history, is kept
+    here so that it can be evicted when the visitor goes away. A session is evicted when it has been idle for longer
+    than idle_timeout_seconds, when there are more than max_sessions live sessions (least recently used first), or when
+    the estimated memory held by the histories of the live sessions goes over memory_budget_bytes. A session with a turn
+    in flight (see turn) is never evicted.
+
+    The memory of the live sessions is a running total: the size of a session is measured, in constant time, whenever
+    it is used and when its turn ends, so eviction never walks the histories.
+
+    If a spill directory is set, the history and call count of an evicted session are written to disk and read back
+    when the visitor returns, so the conversation carries on where it left off. Without one, a returning visitor gets
+    a fresh conversation.
+    """
+    SPILL_SUFFIX = ".json"
+
+    def __init__(self,
+                 chat_client_factory : Callable[[], AbstractChatClient],
+                 idle_timeout_seconds : float = 1800.0,
+                 max_sessions : int = 500,
+                 memory_budget_bytes : int = 256 * 1024 * 1024,
+                 spill_dir : str | Path | None = None,
+                 sweep_interval_seconds : float = 60.0):
+        """
+        Initializes the SessionManager.
+
+        Args:
+            chat_client_factory: Creates the chat client of a new session.
+            idle_timeout_seconds: How long a session can go without a message before it is evicted.
+            max_sessions: The maximum number of live sessions.
+            memory_budget_bytes: The maximum estimated memory held by the histories of the live sessions.
+            spill_dir: The directory evicted sessions are written to. None disables spilling.
+            sweep_interval_seconds: How often the background sweeper looks for idle sessions.
+        """
+        if max_sessions <= 0:
+            raise ValueError("max_sessions must be greater than 0.")
+        self.chat_client_factory = chat_client_factory
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.max_sessions = max_sessions
+        self.memory_budget_bytes = memory_budget_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.sweep_interval_seconds = sweep_interval_seconds
+        # session id -> live session, least recently used first
+        self._sessions : OrderedDict[str, LiveSession] = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = Lock()
+        self._stop_event = Event()
+        self._sweeper : Thread | None = None
+        self.created = 0
+        self.evictions = 0
+        self.spills = 0
+        self.rehydrations = 0
+
+    def create_session(self) -> SessionState:
+        """
+        Creates the Gradio state of a new browser session. The chat client is created on the first message.
+        """
+        session_state = SessionState()
+        session_state.add_to_session(SessionState.SESSION_ID_KEY, uuid.uuid4().hex)
+        return session_state
+
+    def get_chat_client(self, session_state : SessionState) -> AbstractChatClient:
+        """
+        Returns the chat client of a session, rehydrating it from disk or creating it if it is not live.
+        Use turn instead when the client is used for a turn, so that the session is not evicted in the middle of it.
+        """
+        return self._acquire(session_state, in_flight=False)
+
+    @contextmanager
+    def turn(self, session_state : SessionState) -> Iterator[AbstractChatClient]:
+        """
+        Returns the chat client of a session for the duration of a turn. The session is not evicted or spilled until
+        the turn ends, and the memory it holds is measured again when it does.
+        """
+        chat_client = self._acquire(session_state, in_flight=True)
+        session_id = session_state.get_from_session(SessionState.SESSION_ID_KEY)
+        try:
+            yield chat_client
+        finally:
+            with self._lock:
+                session = self._sessions.get(session_id)
+                if session is not None and session.chat_client is chat_client:
+                    session.in_flight -= 1
+                    now = time.monotonic()
+                    self._touch(session_id, session, now, in_flight=False)
+                    evicted = self._select_evictions(now, keep=session_id)
+                else:
+                    evicted = []
+            self._spill_all(evicted)
+
+    def _acquire(self, session_state : SessionState, in_flight : bool) -> AbstractChatClient:
+        session_id = session_state.get_from_session(SessionState.SESSION_ID_KEY)
+        if session_id is None:
+            session_id = uuid.uuid4().hex
+            session_state.add_to_session(SessionState.SESSION_ID_KEY, session_id)
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._touch(session_id, session, now, in_flight)
+                return session.chat_client
+        # Not live: build it outside the lock because reading the spill file and creating a client take a while.
+        chat_client = self._rehydrate(session_id)
+        if chat_client is None:
+            chat_client = self.chat_client_factory()
+            self.created += 1
+        with self._lock:
+            # Another request of the same session may have got there first.
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = LiveSession(chat_client, now)
+                self._sessions[session_id] = session
+            self._touch(session_id, session, now, in_flight)
+            evicted = self._select_evictions(now, keep=session_id)
+        self._spill_all(evicted)
+        self.start()
+        return session.chat_client
+
+    def _touch(self, session_id : str, session : LiveSession, now : float, in_flight : bool):
+        # Called with the lock held.
+        session.last_used = now
+        if in_flight:
+            session.in_flight += 1
+        self._sessions.move_to_end(session_id)
+        self._measure(session)
+
+    def _measure(self, session : LiveSession):
+        # Called with the lock held. size_in_bytes of a ConversationStore is kept up to date as it changes, so this is O(1).
+        size_in_bytes = session.chat_client.messages.size_in_bytes()
+        self._memory_bytes += size_in_bytes - session.size_in_bytes
+        session.size_in_bytes = size_in_bytes
+
+    def _remove(self, session_id : str) -> LiveSession:
+        # Called with the lock held.
+        session = self._sessions.pop(session_id)
+        self._memory_bytes -= session.size_in_bytes
+        return session
+
+    def evict_idle(self) -> int:
+        """
+        Evicts the sessions that are idle or over the limits.
+
+        Returns:
+            int: The number of sessions evicted.
+        """
+        with self._lock:
+            # The sweep also picks up the growth of sessions whose turns ended without going through turn.
+            for session in self._sessions.values():
+                self._measure(session)
+            evicted = self._select_evictions(time.monotonic())
+        self._spill_all(evicted)
+        return len(evicted)
+
+    def _select_evictions(self, now : float, keep : str | None = None) -> list[tuple[str, AbstractChatClient]]:
+        # Called with the lock held. Sessions are removed from the live map here and spilled after the lock is released.
+        # Sessions with a turn in flight are skipped: spilling them would lose the end of the turn.
+        evicted : list[tuple[str, AbstractChatClient]] = []
+        for session_id, session in list(self._sessions.items()):
+            if session_id == keep or session.in_flight > 0:
+                continue
+            idle = now - session.last_used > self.idle_timeout_seconds
+            over_limits = len(self._sessions) > self.max_sessions or self._memory_bytes > self.memory_budget_bytes
+            if not (idle or over_limits):
+                # The sessions are in least recently used order, so the rest are neither idle nor needed to make room.
+                break
+            evicted.append((session_id, self._remove(session_id).chat_client))
+        self.evictions += len(evicted)
+        return evicted
+
+    def _spill_path(self, session_id : str) -> Path:
+        return self.spill_dir / f"{session_id}{self.SPILL_SUFFIX}"
+
+    def _spill_all(self, evicted : list[tuple[str, AbstractChatClient]]):
+        for session_id, chat_client in evicted:
+            logger.info(f"Evicting session {session_id}.")
+            if self.spill_dir is None:
+                continue
+            try:
+                spill_path = self._spill_path(session_id)
+                temp_path = spill_path.with_suffix(".tmp")
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump({"num_calls": getattr(chat_client, "num_calls", 0), "messages": chat_client.get_messages()}, f)
+                temp_path.replace(spill_path)
+                self.spills += 1
+            except Exception as e:
+                logger.error(f"Could not spill session {session_id} to disk: {e}", exc_info=True)
+
+    def _rehydrate(self, session_id : str) -> AbstractChatClient | None:
+        if self.spill_dir is None:
+            return None
+        spill_path = self._spill_path(session_id)
+        if not spill_path.exists():
+            return None
+        try:
+            with open(spill_path, "r", encoding="utf-8") as f:
+                spilled = json.load(f)
+            spill_path.unlink(missing_ok=True)
+            chat_client = self.chat_client_factory()
+            chat_client.messages = ConversationStore.from_wire(spilled["messages"])
+            if hasattr(chat_client, "num_calls"):
+                chat_client.num_calls = spilled.get("num_calls", 0)
+            self.rehydrations += 1
+            logger.info(f"Rehydrated session {session_id} with {len(chat_client.messages)} messages.")
+            return chat_client
+        except Exception as e:
+            logger.error(f"Could not rehydrate session {session_id}: {e}", exc_info=True)
+            return None
+
+    def start(self):
+        """
+        Starts the background thread that evicts idle sessions. Does nothing if it is already running.
+        """
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._stop_event.clear()
+            self._sweeper = Thread(target=self._run_sweeper, name="session-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop(self, spill : bool = True, timeout : float = 5.0):
+        """
+        Stops the sweeper and, if spill is True and a spill directory is set, writes every live session to disk so
+        that the conversations survive a restart.
+        """
+        self._stop_event.set()
+        sweeper = self._sweeper
+        if sweeper is not None:
+            sweeper.join(timeout)
+        self._sweeper = None
+        if spill and self.spill_dir is not None:
+            with self._lock:
+                live = [(session_id, session.chat_client) for session_id, session in self._sessions.items()]
+                self._sessions.clear()
+                self._memory_bytes = 0
+            self._spill_all(live)
+
+    def _run_sweeper(self):
+        while not self._stop_event.wait(self.sweep_interval_seconds):
+            try:
+                evicted = self.evict_idle()
+                if evicted:
+                    logger.info(f"Evicted {evicted} idle sessions.")
+                logger.debug(f"Session stats: {self.stats()}")
+            except Exception as e:
+                logger.error(f"An error occurred while evicting idle sessions: {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        """
+        Returns the number of live sessions, the estimated memory they hold and the eviction counters.
+        """
+        with self._lock:
+            live_sessions = len(self._sessions)
+            memory_bytes = self._memory_bytes
+        return {
+            "live_sessions": live_sessions,
+            "memory_bytes": memory_bytes,
+            "process_rss_bytes": process_rss_bytes(),
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "created": self.created,
+            "evictions": self.evictions,
+            "spills": self.spills,
+            "rehydrations": self.rehydrations,
+        }
+
+
+def process_rss_bytes() -> int | None:
+    """
+    Returns the resident memory of the process, or None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def session_manager_from_env(chat_client_factory : Callable[[], AbstractChatClient]) -> SessionManager:
+    """
+    Builds a SessionManager configured with the SESSION_* environment variables. Spilling to disk is enabled by setting
+    SESSION_SPILL_ENABLED to true; the files go to SESSION_SPILL_DIR, by default data/sessions.
+    """
+    spill_dir = None
+    if os.getenv("SESSION_SPILL_ENABLED", "false").lower() == "true":
+        spill_dir = os.getenv("SESSION_SPILL_DIR", str(PROJECT_ROOT / "data" / "sessions"))
+    return SessionManager(
+        chat_client_factory,
+        idle_timeout_seconds=float(os.getenv("SESSION_IDLE_TIMEOUT_SECONDS", "1800")),
+        max_sessions=int(os.getenv("SESSION_MAX_LIVE", "500")),
+        memory_budget_bytes=int(float(os.getenv("SESSION_MEMORY_BUDGET_MB", "256")) * 1024 * 1024),
+        spill_dir=spill_dir,
+        sweep_interval_seconds=float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "60")),
+    )
@@ -22,6 +22,7 @@ class DBConfig:
     KEY_DB_HOST = "Connection.DB_HOST"
     KEY_DB_PORT = "Connection.DB_PORT"
     KEY_DB_TYPE = "Connection.DB_TYPE"
+    KEY_DB_PATH = "Connection.DB_PATH"
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
@@ -1,7 +1,46 @@
 import os
-import docx
-from PyPDF2 import PdfReader
+import logging
+import mimetypes
 from html.parser import HTMLParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# The file types walk_directory picks up when ingesting a directory.
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".html", ".htm", ".txt")
+
+# Extractors keyed by file extension (".pdf") or MIME type ("application/pdf"). The handlers import the libraries they
+# need (python-docx, PyPDF2) when they are first called, so importing this module costs nothing for a process that
+# never parses a document.
+_extractors : dict[str, Callable[[str], str]] = {}
+
+def register_extractor(*keys : str):
+    """
+    Decorator that registers a function taking a file path and returning its text for the extensions and MIME types.
+
+    Example:
+        @register_extractor(".md", "text/markdown")
+        def markdown_to_text(file_path : str) -> str: ...
+    """
+    def decorator(extractor : Callable[[str], str]) -> Callable[[str], str]:
+        for key in keys:
+            _extractors[key.lower()] = extractor
+        return extractor
+    return decorator
+
+def get_extractor(file_path : str) -> Callable[[str], str] | None:
+    """
+    Returns the extractor registered for the extension of the file or, failing that, for its MIME type.
+    """
+    extractor = _extractors.get(os.path.splitext(file_path)[1].lower())
+    if extractor is None:
+        mime_type, _ = mimetypes.guess_type(file_path)
+        if mime_type is not None:
+            extractor = _extractors.get(mime_type.lower())
+    return extractor
 
 class TextStripper(HTMLParser):
     def __init__(self):
@@ -13,6 +52,7 @@ class TextStripper(HTMLParser):
     def get_data(self):
         return "".join(self.fed)
 
+@register_extractor(".html", ".htm", "text/html")
 def get_clean_text_from_html(file_name : str) -> str:
     # Your Word-exported HTML string
     with open(file_name, "r", encoding="utf-8", errors="replace") as f:
@@ -23,59 +63,179 @@ def get_clean_text_from_html(file_name : str) -> str:
     stripper.feed(html_content)
     clean_text = stripper.get_data()
     return clean_text
+@register_extractor(".docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
 def docx_to_text(file_path: str) -> str:
     """Extracts text from a .docx file."""
+    import docx
     try:
         document = docx.Document(file_path)
         return "".join([para.text for para in document.paragraphs])
     except Exception as e:
-        # Assuming logger is configured elsewhere or passed in
-        print(f"Error reading docx file {file_path}: {e}")
+        logger.error(f"Error reading docx file {file_path}: {e}")
         raise
 
-def pdf_to_text(file_path: str) -> str:
-    """Extracts text from a .pdf file."""
+class PageText(NamedTuple):
+    """The text of one page of a document. page_number starts at 1 and is None for documents without pages."""
+    page_number : int | None
+    text : str
+
+def _extract_pdf_page_range(file_path : str, start : int, stop : int) -> List[str]:
+    # Runs in a worker process: every worker opens the PDF itself so that only page texts cross the process boundary.
+    from PyPDF2 import PdfReader
+    reader = PdfReader(file_path)
+    return [reader.pages[index].extract_text() or "" for index in range(start, min(stop, len(reader.pages)))]
+
+def iter_pdf_pages(file_path : str, max_workers : int | None = None, pages_per_task : int = 16) -> Iterator[PageText]:
+    """
+    Yields the text of each page of a PDF, in order, one page at a time so that the whole text is never held in memory.
+
+    Args:
+        file_path: The PDF to read.
+        max_workers: If greater than 1, ranges of pages_per_task pages are extracted in that many worker processes.
+                     At most two ranges per worker are in flight at a time.
+        pages_per_task: The number of pages a worker extracts per task.
+    """
+    from PyPDF2 import PdfReader
     try:
         reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return text
+        page_count = len(reader.pages)
+        if max_workers is None or max_workers <= 1 or page_count <= pages_per_task:
+            for index, page in enumerate(reader.pages):
+                yield PageText(index + 1, page.extract_text() or "")
+            return
     except Exception as e:
-        print(f"Error reading PDF file {file_path}: {e}")
+        logger.error(f"Error reading PDF file {file_path}: {e}")
         raise
+    starts = iter(range(0, page_count, pages_per_task))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # The futures are kept in page order and the oldest is awaited first so that the pages come out in order.
+        in_flight : List[tuple[int, Future]] = [(start, executor.submit(_extract_pdf_page_range, file_path, start, start + pages_per_task))
+                                                for start in islice(starts, max_workers * 2)]
+        while in_flight:
+            start, future = in_flight.pop(0)
+            texts = future.result()
+            next_start = next(starts, None)
+            if next_start is not None:
+                in_flight.append((next_start, executor.submit(_extract_pdf_page_range, file_path, next_start, next_start + pages_per_task)))
+            for offset, text in enumerate(texts):
+                yield PageText(start + offset + 1, text)
+
+@register_extractor(".pdf", "application/pdf")
+def pdf_to_text(file_path: str) -> str:
+    """Extracts text from a .pdf file."""
+    return "".join(page.text for page in iter_pdf_pages(file_path))
+
+def _extract_pages(file_path : str, start : int | None, stop : int | None) -> List[PageText]:
+    # Runs in a worker process: pages [start, stop) of a PDF, or the whole text of any other file when start is None.
+    if start is None:
+        return [PageText(None, file_to_text_factory(file_path))]
+    return [PageText(start + offset + 1, text) for offset, text in enumerate(_extract_pdf_page_range(file_path, start, stop))]
+
+def _page_tasks(file_paths : Iterable[str], pages_per_task : int) -> Iterator[tuple[str, int | None, int | None]]:
+    # Splits every PDF into ranges of pages_per_task pages. Only the page count is read here, not the text.
+    from PyPDF2 import PdfReader
+    for file_path in file_paths:
+        if get_extractor(file_path) is not pdf_to_text:
+            yield (file_path, None, None)
+            continue
+        try:
+            page_count = len(PdfReader(file_path).pages)
+        except Exception as e:
+            logger.error(f"Error reading PDF file {file_path}: {e}")
+            yield (file_path, None, None) # Fails again in the worker and is reported like any other unreadable file.
+            continue
+        for start in range(0, page_count, pages_per_task):
+            yield (file_path, start, start + pages_per_task)
+
+def iter_pages_parallel(file_paths : Iterable[str],
+                        max_workers : int | None = None,
+                        pages_per_task : int = 16,
+                        on_error : Callable[[str, Exception], None] | None = None) -> Iterator[tuple[str, PageText]]:
+    """
+    Extracts the files in a pool of processes and yields (path, PageText) for every page, one per page for a PDF and a
+    single one for other files. The files come in the order given and their pages in order, one after the other.
 
+    A PDF is split into ranges of pages_per_task pages that are extracted as separate tasks, and at most two tasks per
+    worker are in flight at a time, so however large the files are only a few ranges of pages are held in memory or
+    sent across the process boundary at once.
+
+    A file that cannot be read is logged, the rest of its pages are skipped and on_error, if given, is called with its
+    path and the exception. The pages of the file that were yielded before the error are not taken back.
+
+    Args:
+        file_paths: The files to extract.
+        max_workers: The number of worker processes. Defaults to the number of CPUs.
+        pages_per_task: The number of PDF pages a worker extracts per task.
+        on_error: Called with the path and the exception of every file that could not be read.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    tasks = _page_tasks(file_paths, pages_per_task)
+    failed : set[str] = set()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # The futures are kept in submission order and the oldest is awaited first so that the pages come out in order.
+        in_flight : deque[tuple[str, Future]] = deque()
+        def submit_next() -> bool:
+            for file_path, start, stop in tasks:
+                if file_path not in failed:
+                    in_flight.append((file_path, executor.submit(_extract_pages, file_path, start, stop)))
+                    return True
+            return False
+        while len(in_flight) < max_workers * 2 and submit_next():
+            pass
+        while in_flight:
+            file_path, future = in_flight.popleft()
+            submit_next()
+            if file_path in failed:
+                continue
+            try:
+                pages = future.result()
+            except Exception as e:
+                logger.error(f"Failed to extract the text of {file_path}: {e}")
+                failed.add(file_path)
+                if on_error is not None:
+                    on_error(file_path, e)
+                continue
+            for page in pages:
+                yield (file_path, page)
+
+@register_extractor(".txt", "text/plain")
 def read_text_file(file_path: str) -> str:
     """Reads a plain text file."""
     try:
         with open(file_path, "r", encoding="utf-8") as f:
             return f.read()
     except Exception as e:
-        print(f"Error reading text file {file_path}: {e}")
+        logger.error(f"Error reading text file {file_path}: {e}")
         raise
 
+@register_extractor(".doc", "application/msword")
+def doc_to_text(file_path : str) -> str:
+    # python-docx does not support .doc files.
+    # Informing the user about this limitation.
+    raise NotImplementedError(".doc files are not supported. Please convert to .docx first.")
+
 def file_to_text_factory(file_path: str) -> str:
     """
     Factory function that reads a file and returns its text content.
-    It delegates to the appropriate function based on file extension.
+    It delegates to the extractor registered for the file's extension or MIME type, see register_extractor.
     """
-    extension = os.path.splitext(file_path)[1].lower()
-    
-    if extension in [".html", ".htm"]:
-        return get_clean_text_from_html(file_path)
-    elif extension == ".docx":
-        return docx_to_text(file_path)
-    elif extension == ".pdf":
-        return pdf_to_text(file_path)
-    elif extension == ".txt":
-        return read_text_file(file_path)
-    elif extension == ".doc":
-        # python-docx does not support .doc files.
-        # Informing the user about this limitation.
-        raise NotImplementedError(".doc files are not supported. Please convert to .docx first.")
-    else:
+    extractor = get_extractor(file_path)
+    if extractor is None:
         # For any other file type, try to read as plain text.
         # This might not work for all binary files, but it's a fallback.
-        print(f"Unsupported file type '{extension}', attempting to read as plain text.")
-        return read_text_file(file_path)
+        logger.warning(f"Unsupported file type '{os.path.splitext(file_path)[1].lower()}', attempting to read as plain text.")
+        extractor = read_text_file
+    return extractor(file_path)
+
 
+def walk_directory(directory : str, extensions : Iterable[str] = SUPPORTED_EXTENSIONS) -> Iterator[str]:
+    """
+    Yields the path of every file under the directory, recursively, whose extension is in extensions.
+    Hidden files and directories are skipped.
+    """
+    extensions = tuple(extension.lower() for extension in extensions)
+    for root, dir_names, file_names in os.walk(directory):
+        dir_names[:] = sorted(name for name in dir_names if not name.startswith("."))
+        for file_name in sorted(file_names):
+            if not file_name.startswith(".") and file_name.lower().endswith(extensions):
+                yield os.path.join(root, file_name)
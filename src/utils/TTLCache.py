@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable
+import time
+
+
+class TTLCache:
+    """
+    A thread-safe, in-memory cache whose entries expire after a fixed time to live.
+    Once the cache is full, the least recently used entry is evicted to make room for a new one.
+    Hits, misses and evictions are counted so that the effectiveness of the cache can be monitored.
+    """
+
+    def __init__(self, max_size : int, ttl_seconds : float, name : str = "cache"):
+        """
+        Initializes the TTLCache.
+
+        Args:
+            max_size: The maximum number of entries to hold before evicting the least recently used one.
+            ttl_seconds: The number of seconds an entry stays valid after it is added.
+            name: A name for the cache, used when reporting its statistics.
+        """
+        if max_size <= 0:
+            raise ValueError("max_size must be greater than 0.")
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries : OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key : Hashable, default : Any = None) -> Any:
+        """
+        Returns the value stored for the key, or the default if it is missing or has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key : Hashable, value : Any):
+        """
+        Stores the value for the key, evicting the least recently used entry if the cache is full.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key : Hashable):
+        """
+        Removes the entry for the key if it is present.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes all the entries. The statistics are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit, miss and eviction counters along with the current size and hit ratio.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
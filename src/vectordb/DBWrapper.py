@@ -13,18 +13,55 @@
 #    Pinecone), one only needs to create a new concrete class that inherits from
 #    AbstractDBWrapper. No application code needs to change.
 
-import uuid
+import os
+import time
+import hashlib
+import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
 from chromadb.api import ClientAPI
 from chromadb.api.types import QueryResult
 from src.vo.Metadata import Metadata
 from src.vo.Models import SearchResult
 from typing import List, Any
+import numpy as np
 from abc import ABC, abstractmethod
 
 from src.utils.DBUtils import DBConfig, get_config
 
+logger = logging.getLogger(__name__)
+
+
+def content_id(text: str, source: str | None = None) -> str:
+    """
+    Returns the ID of a text derived from its content and its source, so that adding the same text from the same source
+    again overwrites it instead of creating a duplicate, while the same text from two sources is kept once per source.
+    """
+    digest = hashlib.sha256()
+    if source is not None:
+        digest.update(source.encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def resolve_ids(texts: List[str], metadatas: List[Metadata] | None, embeddings: np.ndarray | None, ids: List[str] | None) -> List[str]:
+    """
+    Checks that the arguments of AbstractDBWrapper.add have one entry per text and returns the ids, by default the
+    content_id of each text and the "source" in its metadata.
+
+    Raises:
+        ValueError: If metadatas, embeddings or ids does not have one entry per text.
+    """
+    for name, values in (("metadatas", metadatas), ("embeddings", embeddings), ("ids", ids)):
+        if values is not None and len(values) != len(texts):
+            raise ValueError(f"Got {len(texts)} texts but {len(values)} {name}.")
+    if ids is not None:
+        return ids
+    sources = [metadata.root.get("source") for metadata in metadatas] if metadatas else [None] * len(texts)
+    return [content_id(text, str(source) if source is not None else None) for text, source in zip(texts, sources)]
+
 
 class AbstractDBWrapper(ABC):
     """
@@ -35,26 +72,51 @@ class AbstractDBWrapper(ABC):
     """
 
     @abstractmethod
-    def add(self, texts: List[str], metadatas: List[Metadata] | None = None) -> List[str]:
+    def add(self, texts: List[str], metadatas: List[Metadata] | None = None, embeddings: np.ndarray | None = None, ids: List[str] | None = None) -> List[str]:
         """
         Adds texts to the vector database.
         Args:
             texts: A list of texts to add.
             metadatas: An optional list of metadata dictionaries corresponding to the texts.
+            embeddings: An optional float32 matrix with the embedding of each text, e.g. from
+                        AbstractEmbeddingModel.get_embeddings. When it is given the database does not embed the texts again.
+            ids: Optional IDs for the texts, e.g. so that they can be deleted later. Defaults to the content_id of
+                 each text and its source, see resolve_ids.
         Returns:
-            A list of unique IDs generated for the added texts.
+            The ID of each text, in the order of texts. Adding a text with an ID that is already in the database
+            replaces it.
+        Raises:
+            ValueError: If metadatas, embeddings or ids does not have one entry per text.
         """
         pass
 
+    # The fields of a SearchResult that search can be asked to fill, see the include argument of search.
+    INCLUDE_DOCUMENTS = "documents"
+    INCLUDE_METADATAS = "metadatas"
+    INCLUDE_DISTANCES = "distances"
+    DEFAULT_INCLUDE = (INCLUDE_DOCUMENTS, INCLUDE_METADATAS, INCLUDE_DISTANCES)
+
     @abstractmethod
-    def search(self, query_texts: List[str], n_results: int = 5) -> List[SearchResult]:
+    def search(self,
+               query_texts: List[str] | None = None,
+               n_results: int = 5,
+               query_embeddings: np.ndarray | None = None,
+               where: dict | None = None,
+               where_document: dict | None = None,
+               include: List[str] | None = None) -> List[SearchResult]:
         """
         Searches the vector database for similar texts.
         Args:
-            query_texts: A list of texts to search for.
-            n_results: The number of results to return.
+            query_texts: A list of texts to search for. The database embeds them.
+            n_results: The number of results to return per query.
+            query_embeddings: A matrix with one query embedding per row, used instead of query_texts so that
+                              embeddings that were already computed are not computed again.
+            where: A filter on the metadata fields, e.g. {"source": "resume.pdf"} or {"page": {"$lte": 3}}.
+            where_document: A filter on the text of the documents, e.g. {"$contains": "Python"}.
+            include: The fields to return, a subset of DEFAULT_INCLUDE. The fields left out are None in the results.
         Returns:
-            A list of search results.
+            A list of search results, the results of the first query first. query_index tells which query a result
+            belongs to.
         """
         pass
 
@@ -74,6 +136,10 @@ class ChromaDBWrapper(AbstractDBWrapper):
     """
     _client: ClientAPI | None = None
     _client_lock = threading.Lock()
+    # Shared by all instances so that the number of concurrent write requests to the server stays bounded. Created on
+    # first use so that CHROMA_WRITE_MAX_WORKERS is read after the .env file is loaded.
+    _write_executor: ThreadPoolExecutor | None = None
+    _write_executor_lock = threading.Lock()
 
     def __init__(self, collection_name: str = "chattwin_collection"):
         """
@@ -84,6 +150,7 @@ class ChromaDBWrapper(AbstractDBWrapper):
         self._port = get_config(DBConfig.KEY_DB_PORT)
         self._collection_name = collection_name
         self._collection: chromadb.Collection | None = None
+        self._batch_size: int | None = None
 
     @property
     def collection(self) -> chromadb.Collection:
@@ -102,50 +169,121 @@ class ChromaDBWrapper(AbstractDBWrapper):
             self._collection = ChromaDBWrapper._client.get_or_create_collection(self._collection_name)
         return self._collection
 
-    def add(self, texts: List[str], metadatas: List[Metadata] | None = None) -> List[str]:
-        # ChromaDB requires unique IDs for each document. We generate them here.
-        ids = [str(uuid.uuid4()) for _ in texts]
-        
-        # Convert Pydantic Metadata models to dictionaries for ChromaDB
-        chroma_metadatas = [m.model_dump() for m in metadatas] if metadatas else None
+    @classmethod
+    def write_executor(cls) -> ThreadPoolExecutor:
+        """
+        Returns the pool the batches of add are written in, with CHROMA_WRITE_MAX_WORKERS threads (4 by default).
+        """
+        if cls._write_executor is None:
+            with cls._write_executor_lock:
+                if cls._write_executor is None:
+                    ChromaDBWrapper._write_executor = ThreadPoolExecutor(max_workers=int(os.getenv("CHROMA_WRITE_MAX_WORKERS", "4")), thread_name_prefix="chroma-write")
+        return cls._write_executor
 
-        self.collection.add(
-            documents=texts,
-            metadatas=chroma_metadatas,
-            ids=ids
-        )
+    @property
+    def batch_size(self) -> int:
+        """
+        The number of records written per request: CHROMA_BATCH_SIZE (1000 by default), capped at the largest batch
+        the server accepts.
+        """
+        if self._batch_size is None:
+            self._batch_size = int(os.getenv("CHROMA_BATCH_SIZE", "1000"))
+            try:
+                _ = self.collection
+                self._batch_size = min(self._batch_size, ChromaDBWrapper._client.get_max_batch_size())
+            except Exception as e:
+                logger.warning(f"Could not get the maximum batch size from ChromaDB, using {self._batch_size}: {e}")
+        return self._batch_size
+
+    def add(self, texts: List[str], metadatas: List[Metadata] | None = None, embeddings: np.ndarray | None = None, ids: List[str] | None = None) -> List[str]:
+        # ChromaDB requires unique IDs for each document. Unless the caller gave them, they are derived from the
+        # content and source so that re-adding a text is an update rather than a duplicate.
+        ids = resolve_ids(texts, metadatas, embeddings, ids)
+        if embeddings is not None:
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+
+        # A repeated ID would be rejected by ChromaDB within a request, so only its first occurrence is written.
+        rows: List[int] = []
+        seen: set[str] = set()
+        for row, id in enumerate(ids):
+            if id not in seen:
+                seen.add(id)
+                rows.append(row)
+        if len(rows) < len(ids):
+            logger.info(f"Skipping {len(ids) - len(rows)} duplicate texts.")
+
+        batch_size = self.batch_size
+        start = time.perf_counter()
+        futures = [self.write_executor().submit(self._upsert_batch, batch_number, rows[offset:offset + batch_size], texts, metadatas, embeddings, ids)
+                   for batch_number, offset in enumerate(range(0, len(rows), batch_size))]
+        # Wait for every batch before raising so that no write is still running when the caller sees the error.
+        errors = [future.exception() for future in futures]
+        error = next((error for error in errors if error is not None), None)
+        if error is not None:
+            raise error
+        elapsed = time.perf_counter() - start
+        if rows:
+            logger.info(f"Upserted {len(rows)} records in {len(futures)} batches in {elapsed:.2f}s ({len(rows) / elapsed if elapsed else 0:.0f} records/s).")
         return ids
 
-    def search(self, query_texts: List[str], n_results: int = 5) -> List[SearchResult]:
+    def _upsert_batch(self, batch_number: int, rows: List[int], texts: List[str], metadatas: List[Metadata] | None, embeddings: np.ndarray | None, ids: List[str]):
+        start = time.perf_counter()
+        # Convert Pydantic Metadata models to dictionaries for ChromaDB
+        self.collection.upsert(
+            documents=[texts[row] for row in rows],
+            embeddings=embeddings[rows] if embeddings is not None else None,
+            metadatas=[metadatas[row].model_dump() for row in rows] if metadatas else None,
+            ids=[ids[row] for row in rows]
+        )
+        elapsed = time.perf_counter() - start
+        logger.info(f"Batch {batch_number}: {len(rows)} records in {elapsed:.2f}s ({len(rows) / elapsed if elapsed else 0:.0f} records/s).")
+
+    def search(self,
+               query_texts: List[str] | None = None,
+               n_results: int = 5,
+               query_embeddings: np.ndarray | None = None,
+               where: dict | None = None,
+               where_document: dict | None = None,
+               include: List[str] | None = None) -> List[SearchResult]:
+        if (query_texts is None) == (query_embeddings is None):
+            raise ValueError("Exactly one of query_texts and query_embeddings must be given.")
+        include = list(self.DEFAULT_INCLUDE if include is None else include)
+        unknown = set(include) - set(self.DEFAULT_INCLUDE)
+        if unknown:
+            raise ValueError(f"Unsupported include fields: {sorted(unknown)}")
         results: QueryResult = self.collection.query(
             query_texts=query_texts,
-            n_results=n_results
+            query_embeddings=np.asarray(query_embeddings, dtype=np.float32) if query_embeddings is not None else None,
+            n_results=n_results,
+            where=where,
+            where_document=where_document,
+            include=include
         )
 
         # The result from Chroma is a dictionary of lists of lists.
         # We want to transform it into a more usable, flat list of result objects.
-        # Each object will contain the document, its metadata, and distance.
-        if not results or not results['documents']:
+        # Each object will contain the document, its metadata, and distance, as far as they were included.
+        if not results or not results['ids']:
             return []
 
-        # results['documents'] is a List[List[str]]
-        # Let's create one flat list of results across all query_texts
+        # Let's create one flat list of results across all queries
         search_results: List[SearchResult] = []
         
-        # The outer list corresponds to each query_text
-        for i in range(len(results["documents"])):
-            docs = results["documents"][i]
-            metadatas = results["metadatas"][i] if results["metadatas"] else [None] * len(docs)
-            distances = results["distances"][i] if results["distances"] else [None] * len(docs)
+        # The outer list corresponds to each query
+        for i in range(len(results["ids"])):
             ids = results["ids"][i]
+            docs = results["documents"][i] if results.get("documents") else [None] * len(ids)
+            metadatas = results["metadatas"][i] if results.get("metadatas") else [None] * len(ids)
+            distances = results["distances"][i] if results.get("distances") else [None] * len(ids)
             
-            for j in range(len(docs)):
+            for j in range(len(ids)):
                 meta_dict = metadatas[j]
                 search_results.append(SearchResult(
                     id=ids[j],
                     document=docs[j],
                     metadata=Metadata.model_validate(meta_dict) if meta_dict else None,
-                    distance=distances[j]
+                    distance=distances[j],
+                    query_index=i
                 ))
                 
         return search_results
@@ -168,6 +306,10 @@ def get_db_wrapper(collection_name: str) -> AbstractDBWrapper:
 
     if db_type == 'chroma':
         return ChromaDBWrapper(collection_name=collection_name)
+    elif db_type == 'local':
+        # Imported here because the local backend builds on this module.
+        from src.vectordb.LocalDBWrapper import LocalDBWrapper
+        return LocalDBWrapper(collection_name=collection_name)
     # Add other database types here in the future, e.g.:
     # elif db_type == 'pinecone':
     #     return PineconeDBWrapper(collection_name=collection_name)
@@ -0,0 +1,483 @@
+import os
+import copy
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, List
+
+import numpy as np
+
+from src.vo.Metadata import Metadata
+from src.vo.Models import SearchResult
+from src.vectordb.DBWrapper import AbstractDBWrapper, resolve_ids
+from src.utils.DBUtils import DBConfig, get_config
+from src.vectordb.QuantizedIndex import IVFInt8Index
+
+logger = logging.getLogger(__name__)
+
+
+def default_embedding_function(texts: List[str]) -> np.ndarray:
+    """
+    Embeds texts with litellm using the model in LOCAL_DB_EMBEDDING_MODEL (text-embedding-3-small by default).
+    """
+    from litellm import embedding
+    response = embedding(model=os.getenv("LOCAL_DB_EMBEDDING_MODEL", "text-embedding-3-small"), input=texts)
+    vectors = np.empty((len(texts), len(response.data[0]["embedding"])), dtype=np.float32)
+    for row, item in enumerate(response.data):
+        vectors[row] = item["embedding"]
+    return vectors
+
+
+def matches_where(metadata: dict | None, where: dict) -> bool:
+    """
+    Evaluates a ChromaDB style metadata filter, e.g. {"source": "a.pdf"}, {"page": {"$gte": 2}} or
+    {"$and": [{"source": "a.pdf"}, {"page": {"$in": [1, 2]}}]}, against the metadata of one record.
+    """
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if not _compare(value, operator, operand):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _compare(value: Any, operator: str, operand: Any) -> bool:
+    if operator == "$eq":
+        return value == operand
+    if operator == "$ne":
+        return value != operand
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    if value is None:
+        return False
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$lt":
+        return value < operand
+    if operator == "$lte":
+        return value <= operand
+    raise ValueError(f"Unsupported filter operator: {operator}")
+
+
+def matches_where_document(document: str | None, where_document: dict) -> bool:
+    """
+    Evaluates a ChromaDB style document filter ({"$contains": ...}, {"$not_contains": ...}, $and, $or).
+    """
+    document = document or ""
+    for key, condition in where_document.items():
+        if key == "$contains":
+            if condition not in document:
+                return False
+        elif key == "$not_contains":
+            if condition in document:
+                return False
+        elif key == "$and":
+            if not all(matches_where_document(document, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where_document(document, clause) for clause in condition):
+                return False
+        else:
+            raise ValueError(f"Unsupported document filter: {key}")
+    return True
+
+
+class LocalDBWrapper(AbstractDBWrapper):
+    """
+    An in-process implementation of the DBWrapper, for small collections and for running without a database server.
+
+    The vectors are normalized and kept in a float32 matrix that is memory-mapped from a file under DB_PATH, so opening
+    a collection reads nothing up front and the operating system shares the pages between processes. The ids,
+    documents and metadata are kept in a SQLite side table next to it and in memory for filtering. A search is one
+    matrix product over the rows that pass the filters followed by an argpartition for the top k, and the distances
+    are cosine distances (1 - cosine similarity), as in a ChromaDB collection using the cosine space.
+
+    Texts are embedded with embedding_function when add or search is not given embeddings.
+
+    For large collections an approximate index (IVFInt8Index) can be used. It is trained in a background thread once
+    the collection reaches index_min_rows, and retrained when it has grown fourfold since; until it is ready searches
+    stay exact. When the rows that pass the filters reach index_min_rows, the index picks the candidates of a query and
+    only those are scored exactly on the float32 vectors. benchmark_index measures its recall, speed and memory against
+    the exact search.
+    """
+    INITIAL_CAPACITY = 1024
+    INDEX_TRAINING_SAMPLE = 100_000
+    INDEX_BATCH_SIZE = 65_536
+
+    def __init__(self,
+                 collection_name: str = "chattwin_collection",
+                 db_path: str | None = None,
+                 embedding_function: Callable[[List[str]], np.ndarray] | None = None,
+                 index: IVFInt8Index | None = None,
+                 index_min_rows: int | None = None):
+        """
+        Initializes the wrapper and opens, or creates, the collection on disk.
+
+        Args:
+            collection_name: The name of the collection. Its files are in a directory of that name under db_path.
+            db_path: The directory holding the collections. Defaults to DB_PATH in the db config.
+            embedding_function: Embeds a list of texts into a matrix. Defaults to default_embedding_function.
+            index: An approximate index for large collections. Defaults to an IVFInt8Index if LOCAL_DB_INDEX is
+                   ivf_int8 (tuned with LOCAL_DB_INDEX_NPROBE or LOCAL_DB_INDEX_PROBE_FRACTION, and
+                   LOCAL_DB_INDEX_RERANK_FACTOR), and to none otherwise.
+            index_min_rows: The number of rows from which the index is built and used instead of the exact search.
+                            Defaults to LOCAL_DB_INDEX_MIN_ROWS, or 50000.
+        """
+        if index is None and os.getenv("LOCAL_DB_INDEX", "none").lower() == "ivf_int8":
+            nprobe = os.getenv("LOCAL_DB_INDEX_NPROBE")
+            index = IVFInt8Index(nprobe=int(nprobe) if nprobe else None,
+                                 probe_fraction=float(os.getenv("LOCAL_DB_INDEX_PROBE_FRACTION", "0.1")),
+                                 rerank_factor=int(os.getenv("LOCAL_DB_INDEX_RERANK_FACTOR", "4")))
+        self.index = index
+        self.index_min_rows = index_min_rows if index_min_rows is not None else int(os.getenv("LOCAL_DB_INDEX_MIN_ROWS", "50000"))
+        self._index_rows = 0                                  # the size of the collection when the index was trained
+        self._index_changes: set[int] | None = None           # rows added or deleted while the index is being trained
+        self._index_thread: threading.Thread | None = None
+        self._collection_name = collection_name
+        self._directory = Path(db_path if db_path is not None else get_config(DBConfig.KEY_DB_PATH)) / collection_name
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._embedding_function = embedding_function or default_embedding_function
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(self._directory / "records.sqlite", check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                document TEXT,
+                metadata TEXT
+            )""")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._connection.commit()
+        self._load()
+        with self._lock:
+            self._maybe_build_index()
+
+    def _load(self):
+        info = dict(self._connection.execute("SELECT key, value FROM info").fetchall())
+        self._dimension: int | None = int(info["dimension"]) if "dimension" in info else None
+        self._capacity = int(info.get("capacity", 0))
+        self._ids: List[str | None] = [None] * self._capacity
+        self._documents: List[str | None] = [None] * self._capacity
+        self._metadatas: List[dict | None] = [None] * self._capacity
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._row_of: dict[str, int] = {}
+        for row, id, document, metadata in self._connection.execute("SELECT row, id, document, metadata FROM records"):
+            self._ids[row] = id
+            self._documents[row] = document
+            self._metadatas[row] = json.loads(metadata) if metadata is not None else None
+            self._alive[row] = True
+            self._row_of[id] = row
+        self._free_rows = [row for row in range(self._capacity - 1, -1, -1) if not self._alive[row]]
+        self._vectors: np.memmap | None = None
+        if self._dimension is not None and self._capacity > 0:
+            self._vectors = np.memmap(self._vectors_path(), dtype=np.float32, mode="r+", shape=(self._capacity, self._dimension))
+        logger.info(f"Opened local collection {self._collection_name} with {len(self._row_of)} records.")
+
+    def _vectors_path(self) -> Path:
+        return self._directory / "vectors.f32"
+
+    def _set_info(self, key: str, value: Any):
+        self._connection.execute("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _grow(self, needed: int, dimension: int):
+        """
+        Makes room for needed more rows, doubling the capacity of the vector file when it is full.
+        """
+        if self._dimension is None:
+            self._dimension = dimension
+            self._set_info("dimension", dimension)
+        elif dimension != self._dimension:
+            raise ValueError(f"Embeddings of dimension {dimension} cannot be added to a collection of dimension {self._dimension}.")
+        if needed <= len(self._free_rows):
+            return
+        new_capacity = max(self.INITIAL_CAPACITY, self._capacity)
+        while new_capacity - self._capacity + len(self._free_rows) < needed:
+            new_capacity *= 2
+        if new_capacity == self._capacity:
+            return
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+        # Growing the file keeps the rows already in it; the new rows are zero.
+        with open(self._vectors_path(), "ab") as f:
+            f.truncate(new_capacity * self._dimension * 4)
+        self._vectors = np.memmap(self._vectors_path(), dtype=np.float32, mode="r+", shape=(new_capacity, self._dimension))
+        extra = new_capacity - self._capacity
+        self._ids.extend([None] * extra)
+        self._documents.extend([None] * extra)
+        self._metadatas.extend([None] * extra)
+        self._alive = np.concatenate([self._alive, np.zeros(extra, dtype=bool)])
+        self._free_rows = list(range(new_capacity - 1, self._capacity - 1, -1)) + self._free_rows
+        self._capacity = new_capacity
+        self._set_info("capacity", new_capacity)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def add(self, texts: List[str], metadatas: List[Metadata] | None = None, embeddings: np.ndarray | None = None, ids: List[str] | None = None) -> List[str]:
+        ids = resolve_ids(texts, metadatas, embeddings, ids)
+        if not texts:
+            return ids
+        vectors = self._normalize(embeddings if embeddings is not None else self._embedding_function(list(texts)))
+        metadata_dicts = [m.model_dump() for m in metadatas] if metadatas else [None] * len(texts)
+        with self._lock:
+            new_ids = {id for id in ids if id not in self._row_of}
+            self._grow(len(new_ids), vectors.shape[1])
+            records = []
+            rows = []
+            for text, vector, metadata, id in zip(texts, vectors, metadata_dicts, ids):
+                # Adding an id that is already there replaces its record, like an upsert.
+                row = self._row_of.get(id)
+                if row is None:
+                    row = self._free_rows.pop()
+                    self._row_of[id] = row
+                self._vectors[row] = vector
+                self._ids[row] = id
+                self._documents[row] = text
+                self._metadatas[row] = metadata
+                self._alive[row] = True
+                records.append((row, id, text, json.dumps(metadata) if metadata is not None else None))
+                rows.append(row)
+            if self.index is not None and self.index.is_trained:
+                self.index.add(np.asarray(rows), vectors)
+            if self._index_changes is not None:
+                self._index_changes.update(rows)
+            self._vectors.flush()
+            self._connection.executemany("INSERT OR REPLACE INTO records (row, id, document, metadata) VALUES (?, ?, ?, ?)", records)
+            self._connection.commit()
+            self._maybe_build_index()
+        return ids
+
+    def _candidate_rows(self, where: dict | None, where_document: dict | None) -> np.ndarray:
+        rows = np.flatnonzero(self._alive)
+        if where is None and where_document is None:
+            return rows
+        keep = [row for row in rows
+                if (where is None or matches_where(self._metadatas[row], where))
+                and (where_document is None or matches_where_document(self._documents[row], where_document))]
+        return np.asarray(keep, dtype=np.int64)
+
+    def _rank(self, queries: np.ndarray, candidates: np.ndarray, n_results: int, use_index: bool | None = None) -> List[tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns, for each query, the rows of the n_results most similar candidates and their cosine similarities, best first.
+        The index is used when it is trained and there are at least index_min_rows candidates, unless use_index says otherwise.
+        """
+        if use_index is None:
+            use_index = len(candidates) >= self.index_min_rows
+        if not use_index or self.index is None or not self.index.is_trained:
+            return self._rank_exact(queries, candidates, n_results)
+        allowed = None
+        if len(candidates) < len(self._row_of):
+            allowed = np.zeros(self._capacity, dtype=bool)
+            allowed[candidates] = True
+        ranked = []
+        for query in queries:
+            rows = self.index.candidates(query, n_results, allowed)
+            if len(rows) < min(n_results, len(candidates)):
+                # The index could not find enough rows that pass the filters, so this query is answered exactly.
+                rows = candidates
+            # The candidates of the index are re-ranked exactly on the float32 vectors.
+            ranked.extend(self._rank_exact(query.reshape(1, -1), rows, n_results))
+        return ranked
+
+    def _maybe_build_index(self):
+        """
+        Starts training the index in the background if the collection has reached index_min_rows and the index is not
+        trained yet, or the collection has grown fourfold since, as the lists then no longer fit the data.
+        Called with the lock held.
+        """
+        if self.index is None or self._index_thread is not None or len(self._row_of) < self.index_min_rows:
+            return
+        if self.index.is_trained and len(self._row_of) <= 4 * self._index_rows:
+            return
+        self._start_index_build()
+
+    def _start_index_build(self) -> threading.Thread:
+        self._index_changes = set()
+        self._index_thread = threading.Thread(target=self._build_index, name=f"index-{self._collection_name}", daemon=True)
+        self._index_thread.start()
+        return self._index_thread
+
+    def build_index(self, wait: bool = True):
+        """
+        Trains the index on the collection now rather than waiting for it to grow to index_min_rows, or joins the
+        training that is already running. Searches stay exact and writes go on while it trains.
+        """
+        if self.index is None:
+            raise ValueError("The collection has no index to build.")
+        with self._lock:
+            if len(self._row_of) == 0:
+                return
+            thread = self._index_thread if self._index_thread is not None else self._start_index_build()
+        if wait:
+            thread.join()
+
+    def _build_index(self):
+        """
+        Trains a copy of the index without holding the lock, then swaps it in. Rows written while it trained are
+        recorded in _index_changes and re-applied to the new index before the swap.
+        """
+        try:
+            start = time.perf_counter()
+            with self._lock:
+                rows = np.flatnonzero(self._alive)
+                vectors = self._vectors
+                capacity = self._capacity
+            rng = np.random.default_rng(self.index.seed)
+            sample = rows if len(rows) <= self.INDEX_TRAINING_SAMPLE else np.sort(rng.choice(rows, self.INDEX_TRAINING_SAMPLE, replace=False))
+            index = copy.copy(self.index)
+            index.train(vectors[sample], capacity, n_vectors=len(rows))
+            for batch_start in range(0, len(rows), self.INDEX_BATCH_SIZE):
+                batch = rows[batch_start:batch_start + self.INDEX_BATCH_SIZE]
+                index.add(batch, vectors[batch])
+            with self._lock:
+                changed = np.fromiter(self._index_changes, dtype=np.int64, count=len(self._index_changes))
+                alive = self._alive[changed]
+                index.resize(self._capacity)
+                index.remove(changed[~alive])
+                index.add(changed[alive], self._vectors[changed[alive]])
+                self.index = index
+                self._index_rows = len(rows)
+            logger.info(f"Trained the index of {self._collection_name} on {len(rows)} vectors in {time.perf_counter() - start:.2f}s.")
+        except Exception as e:
+            logger.error(f"Training the index of {self._collection_name} failed, searches stay exact: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._index_changes = None
+                self._index_thread = None
+
+    def _rank_exact(self, queries: np.ndarray, candidates: np.ndarray, n_results: int) -> List[tuple[np.ndarray, np.ndarray]]:
+        if len(candidates) == 0:
+            return [(candidates, np.zeros(0, dtype=np.float32)) for _ in range(queries.shape[0])]
+        if 2 * len(candidates) >= self._capacity:
+            # Scoring the whole matrix in place is cheaper than copying most of its rows out first.
+            similarities = (self._vectors @ queries.T)[candidates]
+        else:
+            similarities = self._vectors[candidates] @ queries.T
+        ranked = []
+        k = min(n_results, len(candidates))
+        for query_index in range(queries.shape[0]):
+            column = similarities[:, query_index]
+            top = np.argpartition(-column, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+            top = top[np.argsort(-column[top], kind="stable")]
+            ranked.append((candidates[top], column[top]))
+        return ranked
+
+    def search(self,
+               query_texts: List[str] | None = None,
+               n_results: int = 5,
+               query_embeddings: np.ndarray | None = None,
+               where: dict | None = None,
+               where_document: dict | None = None,
+               include: List[str] | None = None) -> List[SearchResult]:
+        if (query_texts is None) == (query_embeddings is None):
+            raise ValueError("Exactly one of query_texts and query_embeddings must be given.")
+        include = set(self.DEFAULT_INCLUDE if include is None else include)
+        unknown = include - set(self.DEFAULT_INCLUDE)
+        if unknown:
+            raise ValueError(f"Unsupported include fields: {sorted(unknown)}")
+        queries = self._normalize(query_embeddings if query_embeddings is not None else self._embedding_function(list(query_texts)))
+        with self._lock:
+            if self._vectors is None or n_results <= 0:
+                return []
+            candidates = self._candidate_rows(where, where_document)
+            if len(candidates) == 0:
+                return []
+            ranked = self._rank(queries, candidates, n_results)
+            search_results: List[SearchResult] = []
+            for query_index, (rows, similarities) in enumerate(ranked):
+                for row, similarity in zip(rows, similarities):
+                    metadata = self._metadatas[row]
+                    search_results.append(SearchResult(
+                        id=self._ids[row],
+                        document=self._documents[row] if self.INCLUDE_DOCUMENTS in include else None,
+                        metadata=Metadata.model_validate(metadata) if metadata and self.INCLUDE_METADATAS in include else None,
+                        distance=float(1.0 - similarity) if self.INCLUDE_DISTANCES in include else None,
+                        query_index=query_index
+                    ))
+            return search_results
+
+    def delete(self, ids: List[str]) -> None:
+        with self._lock:
+            rows = [self._row_of.pop(id) for id in ids if id in self._row_of]
+            for row in rows:
+                self._alive[row] = False
+                self._ids[row] = None
+                self._documents[row] = None
+                self._metadatas[row] = None
+                self._free_rows.append(row)
+            if self.index is not None and self.index.is_trained:
+                self.index.remove(np.asarray(rows, dtype=np.int64))
+            if self._index_changes is not None:
+                self._index_changes.update(rows)
+            self._connection.executemany("DELETE FROM records WHERE row = ?", [(row,) for row in rows])
+            self._connection.commit()
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def benchmark_index(self, query_embeddings: np.ndarray, n_results: int = 10) -> dict:
+        """
+        Runs the queries one at a time with the exact search and with the index, training the index first if needed, and reports
+        recall@k of the index against the exact results, the queries per second of both and the memory per vector of
+        the float32 matrix and of the index, which is kept in addition to it.
+        """
+        if self.index is None:
+            raise ValueError("The collection has no index to benchmark.")
+        if len(self) == 0:
+            raise ValueError("The collection is empty.")
+        queries = self._normalize(query_embeddings)
+        self.build_index(wait=True)
+        with self._lock:
+            candidates = np.flatnonzero(self._alive)
+            # Both are timed one query at a time, as a chat turn searches.
+            start = time.perf_counter()
+            exact = [ranked for query in queries for ranked in self._rank(query.reshape(1, -1), candidates, n_results, use_index=False)]
+            exact_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            approximate = [ranked for query in queries for ranked in self._rank(query.reshape(1, -1), candidates, n_results, use_index=True)]
+            index_seconds = time.perf_counter() - start
+            hits = sum(len(set(exact_rows.tolist()) & set(approximate_rows.tolist()))
+                       for (exact_rows, _), (approximate_rows, _) in zip(exact, approximate))
+            expected = sum(len(exact_rows) for exact_rows, _ in exact)
+            float32_bytes = self._dimension * 4
+            index_bytes = self.index.memory_bytes() / max(1, len(self.index))
+            report = {
+                "vectors": len(self._row_of),
+                "k": n_results,
+                "lists": len(self.index.centroids),
+                "nprobe": self.index.probes,
+                "rerank_factor": self.index.rerank_factor,
+                f"recall@{n_results}": hits / expected if expected else 1.0,
+                "exact_qps": len(queries) / exact_seconds if exact_seconds else float("inf"),
+                "index_qps": len(queries) / index_seconds if index_seconds else float("inf"),
+                "float32_bytes_per_vector": float32_bytes,
+                "index_bytes_per_vector": index_bytes,
+                "total_bytes_per_vector": float32_bytes + index_bytes,
+            }
+        logger.info(f"Index benchmark of {self._collection_name}: {report}")
+        return report
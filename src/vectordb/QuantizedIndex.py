@@ -0,0 +1,175 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class IVFInt8Index:
+    """
+    An approximate nearest neighbour index over normalized vectors: an inverted file (IVF) coarse quantizer with the
+    vectors stored as int8.
+
+    The vectors are clustered with k-means into n_lists lists. A query only scores the vectors in the lists whose
+    centroids are closest to it, and it scores them on their int8 codes (one byte per dimension, with a scale per
+    dimension). The best rerank_factor * k of those candidates are returned so that the caller can re-rank them exactly
+    on the float32 vectors. The number of lists probed is nprobe, or probe_fraction of the lists when nprobe is not set.
+    Raising either, or rerank_factor, raises recall@k at the cost of speed.
+
+    The codes are kept in addition to the float32 vectors the caller re-ranks on, so the index costs about
+    dimension + 4 bytes per vector on top of them; what it saves is the time of scoring every vector.
+
+    The index is keyed by the row of a vector in the collection and lives in memory.
+    """
+
+    def __init__(self, n_lists : int | None = None, nprobe : int | None = None, probe_fraction : float = 0.1, rerank_factor : int = 4, train_iterations : int = 10, seed : int = 0):
+        """
+        Initializes the index. It is empty until train is called.
+
+        Args:
+            n_lists: The number of IVF lists. Defaults to sqrt(number of vectors).
+            nprobe: The number of lists searched per query. Defaults to probe_fraction of the lists.
+            probe_fraction: The fraction of the lists searched per query when nprobe is not set.
+            rerank_factor: The number of candidates returned per query, as a multiple of k.
+            train_iterations: The number of k-means iterations.
+            seed: The seed of the random initialization of k-means.
+        """
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.probe_fraction = probe_fraction
+        self.rerank_factor = rerank_factor
+        self.train_iterations = train_iterations
+        self.seed = seed
+        self.centroids : np.ndarray | None = None
+        self.scale : np.ndarray | None = None
+        self.codes = np.zeros((0, 0), dtype=np.int8)
+        self.list_of_row = np.zeros(0, dtype=np.int32)   # -1 for rows that are not in the index
+        self._order : np.ndarray | None = None
+        self._offsets : np.ndarray | None = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def probes(self) -> int:
+        """The number of lists searched per query."""
+        if self.centroids is None:
+            return 0
+        nprobe = self.nprobe if self.nprobe is not None else int(np.ceil(self.probe_fraction * len(self.centroids)))
+        return max(1, min(nprobe, len(self.centroids)))
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.list_of_row >= 0))
+
+    def train(self, sample : np.ndarray, capacity : int, n_vectors : int | None = None):
+        """
+        Clusters a sample of the vectors and sets the quantization scale. The index is empty afterwards; the vectors
+        are indexed with add, which can be done a batch at a time.
+
+        Args:
+            sample: Normalized vectors to train on, e.g. a random sample of the collection.
+            capacity: The number of rows of the collection.
+            n_vectors: The number of vectors that will be indexed, which sets the default n_lists. Defaults to len(sample).
+        """
+        rng = np.random.default_rng(self.seed)
+        sample = np.asarray(sample, dtype=np.float32)
+        n_lists = self.n_lists or max(1, int(np.sqrt(n_vectors or len(sample))))
+        n_lists = min(n_lists, len(sample))
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(self.train_iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for list_id in range(n_lists):
+                members = sample[assignment == list_id]
+                # An empty list takes a random vector so that no centroid is wasted.
+                centroid = members.sum(axis=0) if len(members) else sample[rng.integers(len(sample))]
+                norm = np.linalg.norm(centroid)
+                centroids[list_id] = centroid / norm if norm > 0 else centroid
+        self.centroids = centroids
+        max_abs = np.abs(sample).max(axis=0)
+        self.scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        self.codes = np.zeros((capacity, sample.shape[1]), dtype=np.int8)
+        self.list_of_row = np.full(capacity, -1, dtype=np.int32)
+        self._order = None
+        logger.info(f"Trained an IVF index with {n_lists} lists on {len(sample)} vectors.")
+    def resize(self, capacity : int):
+        """Makes room for rows up to capacity."""
+        extra = capacity - len(self.list_of_row)
+        if extra > 0:
+            self.codes = np.concatenate([self.codes, np.zeros((extra, self.codes.shape[1]), dtype=np.int8)])
+            self.list_of_row = np.concatenate([self.list_of_row, np.full(extra, -1, dtype=np.int32)])
+
+    def quantize(self, vectors : np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def add(self, rows : np.ndarray, vectors : np.ndarray):
+        """Indexes (or re-indexes) the normalized vectors at the rows."""
+        if len(rows) == 0:
+            return
+        rows = np.asarray(rows, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.resize(int(rows.max()) + 1)
+        self.codes[rows] = self.quantize(vectors)
+        self.list_of_row[rows] = np.argmax(vectors @ self.centroids.T, axis=1)
+        self._order = None
+
+    def remove(self, rows : np.ndarray):
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[rows < len(self.list_of_row)]
+        self.list_of_row[rows] = -1
+        self._order = None
+
+    def _inverted_lists(self) -> tuple[np.ndarray, np.ndarray]:
+        # The rows sorted by list and the offset of each list in that order, rebuilt after the index changed.
+        if self._order is None:
+            indexed = np.flatnonzero(self.list_of_row >= 0)
+            lists = self.list_of_row[indexed]
+            sort = np.argsort(lists, kind="stable")
+            self._order = indexed[sort]
+            self._offsets = np.searchsorted(lists[sort], np.arange(len(self.centroids) + 1))
+        return self._order, self._offsets
+
+    def candidates(self, query : np.ndarray, k : int, allowed : np.ndarray | None = None) -> np.ndarray:
+        """
+        Returns the rows of up to rerank_factor * k approximate nearest neighbours of a normalized query, to be
+        re-ranked exactly by the caller.
+
+        Args:
+            query: The normalized query vector.
+            k: The number of results the caller wants.
+            allowed: An optional boolean mask over the rows; rows where it is False are never returned. When the probed
+                     lists hold fewer than k allowed rows, more lists are probed until they do or all of them are.
+        """
+        order, offsets = self._inverted_lists()
+        centroid_scores = self.centroids @ query
+        probes = self.probes
+        ranked_lists = np.argsort(-centroid_scores) if probes < len(self.centroids) else np.arange(len(self.centroids))
+        rows = self._rows_of_lists(order, offsets, ranked_lists[:probes], allowed)
+        while len(rows) < k and probes < len(ranked_lists):
+            # A filter can leave too few rows in the nearest lists, so the probe is widened to the next lists.
+            extra = ranked_lists[probes:probes * 2]
+            rows = np.concatenate([rows, self._rows_of_lists(order, offsets, extra, allowed)])
+            probes += len(extra)
+        count = min(len(rows), k * self.rerank_factor)
+        if count == 0:
+            return rows
+        # The scale is folded into the query so the int8 codes are scored without being dequantized first.
+        approximate = self.codes[rows].astype(np.float32) @ (query * self.scale)
+        if count < len(rows):
+            rows = rows[np.argpartition(-approximate, count - 1)[:count]]
+        return rows
+
+    def _rows_of_lists(self, order : np.ndarray, offsets : np.ndarray, list_ids : np.ndarray, allowed : np.ndarray | None) -> np.ndarray:
+        if len(list_ids) == 0:
+            return np.zeros(0, dtype=order.dtype)
+        rows = np.concatenate([order[offsets[list_id]:offsets[list_id + 1]] for list_id in list_ids])
+        return rows[allowed[rows]] if allowed is not None else rows
+
+    def memory_bytes(self) -> int:
+        """Returns the memory held by the index: the codes, the list of each row, the centroids and the inverted lists."""
+        size = self.codes.nbytes + self.list_of_row.nbytes
+        if self.centroids is not None:
+            size += self.centroids.nbytes + self.scale.nbytes
+        if self._order is not None:
+            size += self._order.nbytes + self._offsets.nbytes
+        return size
@@ -1,8 +1,8 @@
 from pydantic import BaseModel, Field
-from typing import Union, Any
+from typing import Union, Any, List
 from src.vo.Metadata import Metadata
 
-__all__ = ["Weather", "GeneralChat", "Contact", "WeatherReport", "Choices", "SessionState", "SearchResult"]
+__all__ = ["Weather", "GeneralChat", "Contact", "WeatherReport", "Choices", "ChoicesStream", "ConversationSummary", "SessionState", "SearchResult"]
 
 class Weather(BaseModel):
     """
@@ -48,10 +48,30 @@ class Choices(BaseModel):
     """
     choice : Union[GeneralChat, Contact, Weather] = Field(description="A union of GeneralChat, Contact, or Weather, representing the chosen action.")
 
+class ChoicesStream(BaseModel):
+    """
+    Wraps a list of Choices in a single model so that it can be streamed.
+    Instructor can stream a Partial of a Pydantic model token by token but not a bare List[Choices],
+    so the streaming chat path asks the LLM for this model instead.
+    """
+    choices : List[Choices] = Field(description="One or more choices, each representing an action to take in response to the user.")
+
+class ConversationSummary(BaseModel):
+    """
+    A compact summary of the older part of a conversation, along with the facts about the user that must not be lost
+    when the turns they were mentioned in are folded into the summary.
+    """
+    summary : str = Field(description="A concise summary of what the user and the assistant have discussed so far.")
+    user_name : str | None = Field(default=None, description="The name of the user, if they gave it.")
+    user_email : str | None = Field(default=None, description="The email of the user, if they gave it.")
+    user_phone : str | None = Field(default=None, description="The phone number of the user, if they gave it.")
+    cities_asked_about : List[str] = Field(default_factory=list, description="The cities the user asked about the weather for.")
+
 class SessionState():
 
 
     MODEL_KEY = "Model_Key"
+    SESSION_ID_KEY = "Session_Id_Key"
     NUMBER_OF_CALLS_KEY = "Number_of_Calls_Key"
     
     def __init__(self):
@@ -77,6 +97,7 @@ class SearchResult(BaseModel):
     Represents a single search result from the vector database.
     """
     id: str
-    document: str
+    document: str | None = None
     metadata: Metadata | None = None
     distance: float | None = None
+    query_index: int = 0
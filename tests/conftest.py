@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# litellm fetches its model cost map over the network when it is imported unless told to use the bundled copy.
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("SUMMARY_ENABLED", "false")
+# The embedding model reports the stats of the process-wide embedding cache, which would otherwise be created in data/.
+os.environ.setdefault("EMBEDDING_CACHE_DIR", tempfile.mkdtemp(prefix="embedding-cache-"))
@@ -0,0 +1,55 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from instructor import Partial
+
+from model.ChatTwinModel import ChatTwin
+from vo.Models import ChoicesStream
+
+MESSAGE = "Hello there, I have been writing Java for twenty years and Python for the last few."
+
+
+def deltas(response : dict, size : int = 5):
+    """Splits the JSON of a response into the small pieces an LLM streams."""
+    text = json.dumps(response)
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+class FakeCompletions:
+    def __init__(self, response : dict):
+        self.response = response
+        self.requests = []
+
+    def create_partial(self, model, messages, response_model, **kwargs):
+        self.requests.append(messages)
+        return Partial[response_model].model_from_chunks(iter(deltas(self.response)))
+
+
+@pytest.fixture
+def chat_twin():
+    twin = ChatTwin(model_role_type="You are Jag.")
+    twin.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions({"choices": [{"choice": {"message": MESSAGE}}]})))
+    return twin
+
+
+def test_partial_text_reads_incomplete_choices():
+    partials = list(Partial[ChoicesStream].model_from_chunks(iter(deltas({"choices": [{"choice": {"message": MESSAGE}}, {"choice": {"city": "Toronto"}}]}))))
+    texts = [ChatTwin.get_partial_text(None, partial) for partial in partials]
+
+    # An incomplete choice is still a dict, so the text is there before the message is finished.
+    incomplete = [text for partial, text in zip(partials, texts)
+                  if partial.choices and isinstance(partial.choices[0].choice, dict)]
+    assert any(0 < len(text) < len(MESSAGE) for text in incomplete)
+    assert texts[-1] == MESSAGE
+
+
+def test_stream_yields_growing_text_as_chunks_arrive(chat_twin):
+    yielded = list(chat_twin.chat_stream("Tell me about yourself"))
+
+    assert len(yielded) > 5
+    assert len(yielded[0]) < len(MESSAGE)
+    for previous, current in zip(yielded, yielded[1:]):
+        assert current.startswith(previous)
+    assert yielded[-1] == MESSAGE
+    assert chat_twin.get_last_message(chat_twin.ASSISTANT_ROLE) == MESSAGE
@@ -0,0 +1,80 @@
+import numpy as np
+from chonkie.embeddings import BaseEmbeddings
+
+from embeddings.EmbeddingCache import CachedEmbeddings, EmbeddingCache
+
+
+class CountingEmbeddings(BaseEmbeddings):
+    """Embeds a text as a vector derived from its length and remembers every text it was asked to embed."""
+
+    def __init__(self):
+        super().__init__()
+        self.embedded = []
+
+    def embed(self, text):
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts):
+        self.embedded.extend(texts)
+        return [np.full(4, len(text), dtype=np.float32) for text in texts]
+
+    @property
+    def dimension(self):
+        return 4
+
+    def get_tokenizer(self):
+        return str.split
+
+    @classmethod
+    def _is_available(cls):
+        return True
+
+
+def test_round_trip_survives_a_new_instance(tmp_path):
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+    EmbeddingCache(tmp_path).put_many("model", ["a", "b", "c"], list(vectors))
+
+    cache = EmbeddingCache(tmp_path)
+    found = cache.get_many("model", 4, ["c", "missing", "a"])
+
+    np.testing.assert_array_equal(found[0], vectors[2])
+    assert found[1] is None
+    np.testing.assert_array_equal(found[2], vectors[0])
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_models_and_dimensions_are_kept_apart(tmp_path):
+    cache = EmbeddingCache(tmp_path)
+    cache.put_many("model", ["a"], [np.ones(4, dtype=np.float32)])
+
+    assert cache.get_many("other-model", 4, ["a"]) == [None]
+    assert cache.get_many("model", 8, ["a"]) == [None]
+
+
+def test_least_recently_used_entry_is_evicted_when_full(tmp_path):
+    # Room for two vectors of dimension 4.
+    cache = EmbeddingCache(tmp_path, max_bytes=2 * 4 * 4)
+    cache.put_many("model", ["a"], [np.full(4, 1, dtype=np.float32)])
+    cache.put_many("model", ["b"], [np.full(4, 2, dtype=np.float32)])
+    cache.get_many("model", 4, ["a"])
+    cache.put_many("model", ["c"], [np.full(4, 3, dtype=np.float32)])
+
+    a, b, c = cache.get_many("model", 4, ["a", "b", "c"])
+    np.testing.assert_array_equal(a, np.full(4, 1))
+    assert b is None
+    np.testing.assert_array_equal(c, np.full(4, 3))
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cached_embeddings_only_embed_the_missing_texts(tmp_path):
+    model = CountingEmbeddings()
+    embeddings = CachedEmbeddings(model, "model", EmbeddingCache(tmp_path))
+
+    first = embeddings.embed_batch(["one", "three"])
+    second = embeddings.embed_batch(["three", "seven", "one"])
+
+    assert model.embedded == ["one", "three", "seven"]
+    np.testing.assert_array_equal(second[0], first[1])
+    np.testing.assert_array_equal(second[1], np.full(4, 5))
+    np.testing.assert_array_equal(second[2], first[0])
@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from utils import FileProcessor
+from utils.FileProcessor import docx_to_text, file_to_text_factory, get_clean_text_from_html, get_extractor, pdf_to_text, read_text_file, register_extractor
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Lets a test register extractors without leaving them behind."""
+    monkeypatch.setattr(FileProcessor, "_extractors", dict(FileProcessor._extractors))
+
+
+@pytest.mark.parametrize("file_name, extractor", [
+    ("resume.pdf", pdf_to_text),
+    ("RESUME.PDF", pdf_to_text),
+    ("letter.docx", docx_to_text),
+    ("page.html", get_clean_text_from_html),
+    ("page.htm", get_clean_text_from_html),
+    ("notes.txt", read_text_file),
+])
+def test_extractor_is_found_by_extension(file_name, extractor):
+    assert get_extractor(file_name) is extractor
+
+
+def test_unknown_file_type_has_no_extractor():
+    assert get_extractor("archive.unknown-extension") is None
+
+
+def test_extractor_is_found_by_mime_type(registry):
+    @register_extractor("text/csv")
+    def csv_to_text(file_path):
+        return "csv"
+
+    assert get_extractor("table.csv") is csv_to_text
+    assert get_extractor("table.CSV") is csv_to_text
+
+
+def test_extension_takes_precedence_over_mime_type(registry):
+    @register_extractor(".csv")
+    def by_extension(file_path):
+        return "extension"
+
+    @register_extractor("text/csv")
+    def by_mime_type(file_path):
+        return "mime type"
+
+    assert get_extractor("table.csv") is by_extension
+
+
+def test_file_to_text_factory_uses_the_registered_extractor(tmp_path):
+    html = tmp_path / "page.html"
+    html.write_text("<html><body><p>Hello</p> <b>world</b></body></html>", encoding="utf-8")
+    unknown = tmp_path / "notes.unknown-extension"
+    unknown.write_text("read as plain text", encoding="utf-8")
+
+    assert file_to_text_factory(str(html)) == "Hello world"
+    assert file_to_text_factory(str(unknown)) == "read as plain text"
+
+
+def test_doc_files_are_rejected():
+    with pytest.raises(NotImplementedError):
+        file_to_text_factory("old.doc")
+
+
+def test_importing_the_module_does_not_import_the_parsers():
+    # A fresh interpreter, since the other tests may already have loaded the parsers.
+    code = "import sys, utils.FileProcessor; print(sorted(m for m in ('docx', 'PyPDF2') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            env={**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(FileProcessor.__file__))})
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from chonkie import Pipeline
+from chonkie.embeddings import BaseEmbeddings
+
+from embeddings.AbstractEmbeddingModel import AbstractEmbeddingModel
+from embeddings.IngestionManifest import IngestionManifest
+from embeddings.Ingestor import Ingestor
+from src.vectordb.LocalDBWrapper import LocalDBWrapper
+
+
+class HashEmbeddings(BaseEmbeddings):
+    """Embeds a text as a deterministic pseudo-random vector, without calling an API."""
+
+    def embed(self, text):
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts):
+        return [np.random.default_rng(sum(text.encode("utf-8"))).standard_normal(8).astype(np.float32) for text in texts]
+
+    @property
+    def dimension(self):
+        return 8
+
+    def get_tokenizer(self):
+        return str.split
+
+    @classmethod
+    def _is_available(cls):
+        return True
+
+
+class RecursiveEmbeddingModel(AbstractEmbeddingModel):
+    def initialize_client(self):
+        pass
+
+    def configure_chunker_for_pipeline(self, pipeline : Pipeline):
+        pipeline.chunk_with("recursive", chunk_size=32)
+
+    def get_embedding_model(self):
+        return HashEmbeddings()
+
+
+@pytest.fixture
+def ingestor(tmp_path, monkeypatch):
+    monkeypatch.setenv("INGEST_MAX_WORKERS", "1")
+    db = LocalDBWrapper(collection_name="test", db_path=str(tmp_path / "db"), embedding_function=lambda texts: pytest.fail("texts must not be embedded"))
+    return Ingestor(RecursiveEmbeddingModel(None, None, None), db, IngestionManifest(tmp_path / "manifest.db"))
+
+
+@pytest.fixture
+def documents(tmp_path):
+    directory = tmp_path / "documents"
+    directory.mkdir()
+    (directory / "a.txt").write_text("Jag has written Java for twenty years. " * 10, encoding="utf-8")
+    (directory / "b.txt").write_text("Jag lives in Toronto and likes hiking. " * 10, encoding="utf-8")
+    return directory
+
+
+def sources(db):
+    return sorted({metadata["source"].rsplit("/", 1)[-1] for metadata in db._metadatas if metadata})
+
+
+def test_sync_ingests_new_files_and_skips_unchanged_ones(ingestor, documents):
+    first = ingestor.sync(str(documents))
+    second = ingestor.sync(str(documents))
+
+    assert (first.added, first.failed) == (2, 0)
+    assert first.chunks_written == len(ingestor.db_wrapper) > 0
+    assert (second.added, second.changed, second.unchanged, second.chunks_written) == (0, 0, 2, 0)
+    assert sources(ingestor.db_wrapper) == ["a.txt", "b.txt"]
+
+
+def test_unreadable_file_keeps_its_chunks_and_is_retried(ingestor, documents):
+    ingestor.sync(str(documents))
+    entry = ingestor.manifest.get(str(documents / "b.txt"))
+    # Not UTF-8, so reading it fails.
+    (documents / "b.txt").write_bytes(b"\xff\xfe broken")
+
+    report = ingestor.sync(str(documents))
+
+    assert (report.changed, report.failed, report.chunks_deleted) == (1, 1, 0)
+    assert ingestor.manifest.get(str(documents / "b.txt")) == entry
+    assert sources(ingestor.db_wrapper) == ["a.txt", "b.txt"]
+
+    (documents / "b.txt").write_text("Jag moved to Vancouver. " * 10, encoding="utf-8")
+    report = ingestor.sync(str(documents))
+
+    assert (report.changed, report.failed, report.chunks_deleted) == (1, 0, len(entry.chunk_ids))
+    assert ingestor.manifest.get(str(documents / "b.txt")).chunk_ids != entry.chunk_ids
+
+
+def test_file_without_text_is_recorded_with_no_chunks(ingestor, documents):
+    ingestor.sync(str(documents))
+    (documents / "b.txt").write_text("   \n", encoding="utf-8")
+
+    report = ingestor.sync(str(documents))
+
+    assert (report.changed, report.failed) == (1, 0)
+    assert ingestor.manifest.get(str(documents / "b.txt")).chunk_ids == []
+    assert sources(ingestor.db_wrapper) == ["a.txt"]
+
+
+def test_removed_file_loses_its_chunks(ingestor, documents):
+    ingestor.sync(str(documents))
+    (documents / "a.txt").unlink()
+
+    report = ingestor.sync(str(documents))
+
+    assert report.removed == 1
+    assert ingestor.manifest.get(str(documents / "a.txt")) is None
+    assert sources(ingestor.db_wrapper) == ["b.txt"]
@@ -0,0 +1,151 @@
+import numpy as np
+import pytest
+
+from src.vectordb.LocalDBWrapper import LocalDBWrapper
+from src.vectordb.QuantizedIndex import IVFInt8Index
+from src.vo.Metadata import Metadata
+
+ROWS = 4000
+DIMENSION = 32
+SOURCES = 10
+
+
+def clustered_vectors(rng, count, centers):
+    vectors = centers[rng.integers(len(centers), size=count)] + 0.3 * rng.standard_normal((count, centers.shape[1]))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((40, DIMENSION))
+    return clustered_vectors(rng, ROWS, centers), clustered_vectors(rng, 50, centers)
+
+
+def open_collection(path, index=None, index_min_rows=1000):
+    return LocalDBWrapper(collection_name="test", db_path=str(path), embedding_function=lambda texts: pytest.fail("texts must not be embedded"),
+                          index=index, index_min_rows=index_min_rows)
+
+
+def fill(db, vectors):
+    metadatas = [Metadata.model_validate({"source": f"file{row % SOURCES}.pdf", "page": row}) for row in range(len(vectors))]
+    db.add([f"chunk {row}" for row in range(len(vectors))], metadatas, embeddings=vectors, ids=[f"id{row}" for row in range(len(vectors))])
+
+
+def exact_top(vectors, query, k, rows=None):
+    rows = np.arange(len(vectors)) if rows is None else rows
+    scores = vectors[rows] @ query
+    return [f"id{row}" for row in rows[np.argsort(-scores, kind="stable")[:k]]]
+
+
+def recall(db, vectors, queries, k, where=None, rows=None):
+    hits = 0
+    for query in queries:
+        found = [result.id for result in db.search(query_embeddings=query.reshape(1, -1), n_results=k, where=where)]
+        assert len(found) == k
+        hits += len(set(found) & set(exact_top(vectors, query, k, rows)))
+    return hits / (k * len(queries))
+
+
+@pytest.fixture
+def index_calls(indexed, monkeypatch):
+    """Counts the queries that went through the index rather than the exact search."""
+    calls = []
+    candidates = indexed.index.candidates
+    monkeypatch.setattr(indexed.index, "candidates", lambda *args: calls.append(args) or candidates(*args))
+    return calls
+
+
+@pytest.fixture(scope="module")
+def indexed(tmp_path_factory, data):
+    vectors, _ = data
+    db = open_collection(tmp_path_factory.mktemp("indexed"), index=IVFInt8Index(probe_fraction=0.2), index_min_rows=200)
+    fill(db, vectors)
+    db.build_index(wait=True)
+    assert db.index.is_trained
+    return db
+
+
+def test_exact_search_matches_brute_force(tmp_path, data):
+    vectors, queries = data
+    db = open_collection(tmp_path)
+    fill(db, vectors)
+
+    results = db.search(query_embeddings=queries[:1], n_results=5)
+
+    assert [result.id for result in results] == exact_top(vectors, queries[0], 5)
+    assert results[0].distance == pytest.approx(1.0 - float(vectors[int(results[0].id[2:])] @ queries[0]), abs=1e-5)
+    assert results[0].metadata.root["source"] == f"file{int(results[0].id[2:]) % SOURCES}.pdf"
+
+
+def test_exact_search_with_filters(tmp_path, data):
+    vectors, queries = data
+    db = open_collection(tmp_path)
+    fill(db, vectors)
+    rows = np.arange(3, ROWS, SOURCES)
+
+    results = db.search(query_embeddings=queries[:1], n_results=5, where={"source": "file3.pdf"})
+
+    assert [result.id for result in results] == exact_top(vectors, queries[0], 5, rows)
+    assert db.search(query_embeddings=queries[:1], n_results=5, where={"source": "missing.pdf"}) == []
+
+
+def test_index_recall(indexed, index_calls, data):
+    vectors, queries = data
+    assert recall(indexed, vectors, queries, 10) >= 0.9
+    assert len(index_calls) == len(queries)
+
+
+def test_index_recall_with_filters(indexed, index_calls, data):
+    vectors, queries = data
+    # A tenth of the rows pass the filter, still enough for the index to be used.
+    rows = np.arange(3, ROWS, SOURCES)
+    assert recall(indexed, vectors, queries, 10, where={"source": "file3.pdf"}, rows=rows) >= 0.9
+    assert len(index_calls) == len(queries)
+
+
+def test_index_returns_k_rows_for_a_selective_filter(indexed, index_calls, data, monkeypatch):
+    vectors, queries = data
+    monkeypatch.setattr(indexed, "index_min_rows", 1)
+    # Too few of the rows in the probed lists pass the filter, so the probe is widened or the query answered exactly.
+    rows = np.arange(0, 250, SOURCES)
+    where = {"$and": [{"source": "file0.pdf"}, {"page": {"$lt": 250}}]}
+    assert recall(indexed, vectors, queries, 10, where=where, rows=rows) >= 0.9
+    assert len(index_calls) == len(queries)
+
+
+def test_index_widens_the_probe_for_a_selective_filter(indexed, data):
+    _, queries = data
+    allowed = np.zeros(indexed._capacity, dtype=bool)
+    allowed[np.arange(0, 250, SOURCES)] = True
+
+    for query in queries:
+        rows = indexed.index.candidates(query, 10, allowed)
+        assert len(rows) >= 10
+        assert allowed[rows].all()
+
+
+def test_deleted_rows_are_not_returned(tmp_path, data):
+    vectors, queries = data
+    db = open_collection(tmp_path, index=IVFInt8Index(probe_fraction=0.2), index_min_rows=200)
+    fill(db, vectors)
+    db.build_index(wait=True)
+    top = exact_top(vectors, queries[0], 5)
+
+    db.delete(top[:2])
+
+    found = [result.id for result in db.search(query_embeddings=queries[:1], n_results=5)]
+    assert not set(top[:2]) & set(found)
+    assert found[:3] == top[2:]
+
+
+def test_collection_is_reopened_from_disk(tmp_path, data):
+    vectors, queries = data
+    db = open_collection(tmp_path)
+    fill(db, vectors)
+    expected = [result.id for result in db.search(query_embeddings=queries[:1], n_results=5)]
+
+    reopened = open_collection(tmp_path)
+
+    assert len(reopened) == ROWS
+    assert [result.id for result in reopened.search(query_embeddings=queries[:1], n_results=5)] == expected
@@ -0,0 +1,131 @@
+import pytest
+
+from model.HistoryManager import HistoryManager
+from model.MessageStore import ConversationStore, MessageRecord, ToolCallRecord
+
+
+def record(store : ConversationStore, role : str, content : str | None, tokens : int, **kwargs) -> MessageRecord:
+    """Adds a message whose token count is given, so that no tokenizer is needed."""
+    message = store.add(role, content, **kwargs)
+    message.token_count = tokens
+    return message
+
+
+def add_turn(store : ConversationStore, number : int, tokens : int = 10, tool_tokens : int = 0):
+    record(store, "user", f"question {number}", tokens)
+    if tool_tokens:
+        tool_call = ToolCallRecord(f"call_{number}", "Weather", '{"city": "Toronto"}')
+        record(store, "assistant", None, tokens, tool_calls=(tool_call,))
+        record(store, "tool", "It is 20 degrees.", tool_tokens, tool_call_id=tool_call.id)
+    record(store, "assistant", f"answer {number}", tokens)
+
+
+def assert_no_orphaned_tool_messages(window):
+    call_ids = set()
+    for message in window:
+        if message.tool_calls:
+            call_ids.update(tool_call.id for tool_call in message.tool_calls)
+        if message.role == "tool":
+            assert message.tool_call_id in call_ids
+
+
+@pytest.fixture
+def store():
+    store = ConversationStore()
+    record(store, "system", "You are Jag.", 10)
+    return store
+
+
+def test_short_history_is_sent_whole(store):
+    add_turn(store, 1)
+    add_turn(store, 2)
+
+    assert HistoryManager("gpt-4o-mini", token_budget=100).window(store) == list(store)
+
+
+def test_window_prefix_stays_stable_between_cuts(store):
+    # 10 tokens of system prompt and 20 per turn: the budget holds 4 turns and the low water mark 2.
+    manager = HistoryManager("gpt-4o-mini", token_budget=100, low_water_ratio=0.6)
+    first_kept = []
+    for number in range(12):
+        add_turn(store, number)
+        window = manager.window(store)
+        assert window[0].role == "system"
+        assert sum(message.token_count for message in window) <= 100
+        first_kept.append(window[1]["content"])
+
+    # The window is cut back to the low water mark when the budget is exceeded, and then only grows until the next cut,
+    # so the start of the prompt changes every few turns rather than every turn.
+    assert first_kept == ["question 0"] * 4 + ["question 3"] * 3 + ["question 6"] * 3 + ["question 9"] * 2
+
+
+def test_window_is_recut_when_the_history_no_longer_matches(store):
+    manager = HistoryManager("gpt-4o-mini", token_budget=100, low_water_ratio=0.6)
+    for number in range(6):
+        add_turn(store, number)
+        manager.window(store)
+
+    # E.g. the old turns were folded into a summary.
+    store.replace(1, len(store) - 2, [])
+    window = manager.window(store)
+
+    assert [message["content"] for message in window] == ["You are Jag.", "question 5", "answer 5"]
+
+
+def test_tool_exchanges_are_dropped_whole_from_old_turns(store):
+    # A turn costs 60 tokens with its tool exchange and 20 without it, so after a cut to the low water mark of 120
+    # tokens only the newest turn is whole and the two before it are compressed.
+    manager = HistoryManager("gpt-4o-mini", token_budget=200, low_water_ratio=0.6)
+    for number in range(8):
+        add_turn(store, number, tool_tokens=30)
+        assert_no_orphaned_tool_messages(manager.window(store))
+
+    window = manager.window(store)
+
+    assert [message.role for message in window] == ["system"] + ["user", "assistant"] * 2 + ["user", "assistant", "tool", "assistant"]
+    assert [message["content"] for message in window if message.role == "user"] == ["question 5", "question 6", "question 7"]
+
+
+def test_latest_turn_is_sent_even_if_it_is_over_the_budget(store):
+    add_turn(store, 1, tokens=200, tool_tokens=200)
+
+    window = HistoryManager("gpt-4o-mini", token_budget=100).window(store)
+
+    assert window == list(store)
+    assert_no_orphaned_tool_messages(window)
+
+
+def test_message_record_reads_like_a_dict():
+    tool_call = ToolCallRecord("call_1", "Weather", '{"city": "Toronto"}')
+    message = MessageRecord("assistant", None, tool_calls=(tool_call,))
+
+    assert message["role"] == "assistant"
+    assert message["content"] is None
+    assert message["tool_calls"][0]["function"]["name"] == "Weather"
+    assert message.get("tool_call_id") is None
+    assert message.get("tool_call_id", "none") == "none"
+    assert "tool_calls" in message and "tool_call_id" not in message
+    assert dict(message) == message.to_wire()
+    with pytest.raises(KeyError):
+        message["name"]
+
+
+def test_store_accepts_wire_messages_and_tracks_its_size(store):
+    store.append({"role": "user", "content": "What's the weather in Toronto?"})
+    store.append({"role": "assistant", "content": None, "refusal": None,
+                  "tool_calls": [{"id": "call_1", "type": "function", "function": {"name": "Weather", "arguments": "{}"}}]})
+    store.add("tool", "It is 20 degrees.", tool_call_id="call_1")
+
+    assert [message["role"] for message in store] == ["system", "user", "assistant", "tool"]
+    assert store.last("assistant")["tool_calls"][0]["id"] == "call_1"
+    assert ConversationStore.from_wire(store.to_wire()).to_wire() == store.to_wire()
+
+    def recomputed(store):
+        return ConversationStore.from_wire(store.to_wire()).size_in_bytes()
+
+    assert store.size_in_bytes() == recomputed(store)
+    store.truncate(2)
+    assert store.size_in_bytes() == recomputed(store)
+    assert store.last("tool") is None
+    store.replace(1, 2, [MessageRecord("system", "A summary of the conversation.")])
+    assert store.size_in_bytes() == recomputed(store)
@@ -0,0 +1,91 @@
+import pytest
+
+from externalservices.NotificationOutbox import NotificationOutbox, PermanentSendError
+
+
+class RecordingSender:
+    """Records every message and answers with the given results, or raises them if they are exceptions."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.messages = []
+
+    def __call__(self, message : str) -> bool:
+        self.messages.append(message)
+        result = self.results.pop(0) if self.results else True
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def make_outbox(tmp_path):
+    def make_outbox(sender : RecordingSender) -> NotificationOutbox:
+        # The workers are never started: the tests send with process_due, and retries are due at once.
+        return NotificationOutbox(tmp_path / "outbox.db", sender=sender, max_attempts=3, base_backoff_seconds=0,
+                                  coalesce_window_seconds=0)
+    return make_outbox
+
+
+def test_burst_is_coalesced_into_one_call(make_outbox):
+    sender = RecordingSender()
+    outbox = make_outbox(sender)
+    outbox.enqueue("Jane wants to get in touch.")
+    outbox.enqueue("John wants to get in touch.")
+
+    assert outbox.process_due()
+    assert not outbox.process_due()
+    assert sender.messages == ["Jane wants to get in touch.\n---\nJohn wants to get in touch."]
+    assert outbox.stats() == {"pending": 0, "failed": 0, "sent": 2, "api_calls": 1}
+
+
+def test_failed_send_is_retried_until_max_attempts(make_outbox):
+    sender = RecordingSender(False, ConnectionError("timed out"), False)
+    outbox = make_outbox(sender)
+    outbox.enqueue("Jane wants to get in touch.")
+
+    while outbox.stats()["pending"]:
+        outbox.process_due()
+
+    assert len(sender.messages) == 3
+    assert outbox.stats()["failed"] == 1
+
+
+def test_permanent_error_is_not_retried(make_outbox):
+    sender = RecordingSender(PermanentSendError("invalid token"))
+    outbox = make_outbox(sender)
+    outbox.enqueue("Jane wants to get in touch.")
+
+    assert not outbox.process_due()
+    assert not outbox.process_due()
+    assert len(sender.messages) == 1
+    assert outbox.stats()["pending"] == 0
+    assert outbox.stats()["failed"] == 1
+
+
+def test_queued_notifications_survive_a_restart(make_outbox):
+    outbox = make_outbox(RecordingSender(False))
+    outbox.enqueue("Jane wants to get in touch.")
+    outbox.process_due()
+    outbox.enqueue("John wants to get in touch.")
+    outbox.stop()
+
+    sender = RecordingSender()
+    restarted = make_outbox(sender)
+    assert restarted.stats()["pending"] == 2
+    restarted.process_due()
+
+    assert sender.messages == ["Jane wants to get in touch.\n---\nJohn wants to get in touch."]
+    assert restarted.stats()["pending"] == 0
+
+
+def test_notifications_being_sent_when_the_process_stopped_are_sent_again(make_outbox):
+    outbox = make_outbox(RecordingSender())
+    outbox.enqueue("Jane wants to get in touch.")
+    # The process stops after the batch was claimed but before the send returned.
+    outbox._claim_batch()
+
+    sender = RecordingSender()
+    make_outbox(sender).process_due()
+
+    assert sender.messages == ["Jane wants to get in touch."]
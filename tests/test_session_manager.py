@@ -0,0 +1,137 @@
+from types import SimpleNamespace
+
+import pytest
+
+import model.SessionManager as session_manager_module
+from model.MessageStore import ConversationStore
+from model.SessionManager import SessionManager
+from vo.Models import SessionState
+
+
+class FakeChatClient:
+    """Holds a history like a chat client, without a model behind it."""
+
+    def __init__(self):
+        self.messages = ConversationStore()
+        self.messages.add("system", "You are Jag.")
+        self.num_calls = 0
+
+    def get_messages(self):
+        return self.messages.to_wire()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_manager_module, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+@pytest.fixture
+def make_manager(tmp_path, clock):
+    managers = []
+    def make_manager(**kwargs) -> SessionManager:
+        kwargs.setdefault("spill_dir", tmp_path / "sessions")
+        manager = SessionManager(FakeChatClient, sweep_interval_seconds=3600, **kwargs)
+        managers.append(manager)
+        return manager
+    yield make_manager
+    for manager in managers:
+        manager.stop(spill=False)
+
+
+def chat(manager : SessionManager, session_state : SessionState, number : int):
+    with manager.turn(session_state) as chat_client:
+        chat_client.messages.add("user", f"question {number}")
+        chat_client.messages.add("assistant", f"answer {number}")
+        chat_client.num_calls += 1
+
+
+def test_spilled_session_is_rehydrated_with_its_history(make_manager, tmp_path):
+    manager = make_manager(max_sessions=1)
+    session_state = manager.create_session()
+    chat(manager, session_state, 1)
+    chat(manager, session_state, 2)
+    history = manager.get_chat_client(session_state).get_messages()
+
+    # A second visitor needs the only live slot, so the first session is spilled to disk.
+    chat(manager, manager.create_session(), 1)
+    spill_path = tmp_path / "sessions" / f"{session_state.get_from_session(SessionState.SESSION_ID_KEY)}.json"
+    assert spill_path.exists()
+
+    chat_client = manager.get_chat_client(session_state)
+
+    assert chat_client.get_messages() == history
+    assert chat_client.num_calls == 2
+    assert not spill_path.exists()
+    assert manager.stats()["spills"] == 2
+    assert manager.stats()["rehydrations"] == 1
+
+
+def test_sessions_survive_a_restart(make_manager):
+    manager = make_manager()
+    session_state = manager.create_session()
+    chat(manager, session_state, 1)
+    history = manager.get_chat_client(session_state).get_messages()
+    manager.stop()
+
+    assert make_manager().get_chat_client(session_state).get_messages() == history
+
+
+def test_least_recently_used_session_is_evicted_first(make_manager, clock):
+    manager = make_manager(max_sessions=2, spill_dir=None)
+    first, second, third = (manager.create_session() for _ in range(3))
+    chat(manager, first, 1)
+    clock.now += 1
+    chat(manager, second, 1)
+    clock.now += 1
+    chat(manager, first, 2)
+    clock.now += 1
+    chat(manager, third, 1)
+
+    assert manager.stats()["evictions"] == 1
+    # Without a spill directory the evicted visitor starts over.
+    assert len(manager.get_chat_client(second).get_messages()) == 1
+    assert len(manager.get_chat_client(third).get_messages()) == 3
+
+
+def test_idle_sessions_are_evicted(make_manager, clock):
+    manager = make_manager(idle_timeout_seconds=60)
+    idle, active = manager.create_session(), manager.create_session()
+    chat(manager, idle, 1)
+    clock.now += 50
+    chat(manager, active, 1)
+    clock.now += 20
+
+    assert manager.evict_idle() == 1
+    assert manager.stats()["live_sessions"] == 1
+
+
+def test_sessions_are_evicted_over_the_memory_budget(make_manager):
+    manager = make_manager(memory_budget_bytes=1)
+    first, second = manager.create_session(), manager.create_session()
+    chat(manager, first, 1)
+    chat(manager, second, 1)
+
+    # The session being used is kept even if it alone is over the budget.
+    assert manager.stats()["live_sessions"] == 1
+    assert manager.stats()["memory_bytes"] == manager.get_chat_client(second).messages.size_in_bytes()
+
+
+def test_session_with_a_turn_in_flight_is_not_evicted(make_manager, clock):
+    manager = make_manager(idle_timeout_seconds=60)
+    session_state = manager.create_session()
+    with manager.turn(session_state) as chat_client:
+        clock.now += 120
+        assert manager.evict_idle() == 0
+        chat_client.messages.add("user", "question 1")
+
+    assert manager.get_chat_client(session_state) is chat_client
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pytest
+
+import utils.TTLCache as ttl_cache_module
+from utils.TTLCache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(ttl_cache_module, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_entries_expire_after_their_time_to_live(clock):
+    cache = TTLCache(max_size=10, ttl_seconds=60)
+    cache.put("toronto", (43.7, -79.4))
+
+    clock.now += 59
+    assert cache.get("toronto") == (43.7, -79.4)
+    clock.now += 1
+    assert cache.get("toronto", "expired") == "expired"
+    assert len(cache) == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_putting_an_entry_again_renews_it(clock):
+    cache = TTLCache(max_size=10, ttl_seconds=60)
+    cache.put("toronto", "old")
+    clock.now += 50
+    cache.put("toronto", "new")
+    clock.now += 50
+
+    assert cache.get("toronto") == "new"
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(max_size=2, ttl_seconds=60)
+    cache.put("toronto", 1)
+    cache.put("ottawa", 2)
+    cache.get("toronto")
+    cache.put("montreal", 3)
+
+    assert cache.get("ottawa") is None
+    assert cache.get("toronto") == 1
+    assert cache.get("montreal") == 3
+    assert cache.stats()["evictions"] == 1